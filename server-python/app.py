@@ -1,138 +1,267 @@
 from flask import Flask, request, Response, stream_with_context, jsonify
 from flask_cors import CORS
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
-import requests
 import json
 from datetime import datetime
-import pytz
 import logging
 import time
-
-# Set up logging
-logging.basicConfig(level=logging.INFO, 
-                   format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+import itertools
+import math
+import secrets
+import threading
 
 # Load environment variables based on environment
 env = os.getenv('FLASK_ENV', 'development')
 env_file = f'.env.{env}'
-if os.path.exists(env_file):
-    logger.info(f"Loading environment from {env_file}")
+env_file_found = os.path.exists(env_file)
+if env_file_found:
     load_dotenv(env_file)
 else:
-    logger.warning(f"Environment file {env_file} not found, falling back to .env")
     load_dotenv()
 
-# Configure the Gemini API with your API key
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+# Local modules read their settings from the environment at import time
+import structured_logging  # noqa: E402
+
+# Set up logging: records are written as JSON by a background thread, never on the request thread
+structured_logging.configure_logging()
+logger = logging.getLogger(__name__)
+if env_file_found:
+    logger.info(f"Loaded environment from {env_file}")
+else:
+    logger.warning(f"Environment file {env_file} not found, fell back to .env")
+
+import generation  # noqa: E402
+import response_cache  # noqa: E402
+import prompt_builder  # noqa: E402
+import rate_limit  # noqa: E402
+import conversation  # noqa: E402
+import coalescing  # noqa: E402
+import metrics  # noqa: E402
+import market_history  # noqa: E402
+import calculator  # noqa: E402
+import intent_router  # noqa: E402
+import stream_replay  # noqa: E402
+import compression  # noqa: E402
+import batch  # noqa: E402
+from market_data import get_indian_market_data  # noqa: E402
+from logging_wrapper import setup_interaction_logging  # noqa: E402
+
+# The Gemini client is configured with GOOGLE_API_KEY on first use, in prompt_builder.get_model()
 
 app = Flask(__name__)
 # Enable CORS for all routes with specific settings for better mobile compatibility
 CORS(app, resources={r"/*": {"origins": ["http://localhost:3001", "https://finwise.rerecreation.us", "http://finwise.rerecreation.us"]}})
 
-# First, get a detailed response
-DETAILED_PROMPT = """
-You are an ethical financial advisor specializing in Indian markets. Your name is FinWise.
-Provide clear, direct financial advice based on real financial data and best practices.
-
-IMPORTANT RULES:
-1. Keep your response to a maximum of 200 words
-2. Write in a conversational, easy-to-understand style
-3. Focus on actionable advice
-4. End with a brief one-line disclaimer in italics
-5. Add 3 natural follow-up questions with emojis on new lines
-
-Focus on:
-- Long-term investment strategies aligned with the client's goals
-- Ethical investment considerations
-- Risk management and diversification
-- Indian tax implications and regulations
-- Market trends in BSE/NSE
-"""
-
-# Cache for financial data to avoid excessive API calls
-market_data_cache = {
-    "timestamp": None,
-    "data": None,
-    "cache_expiry_seconds": 300  # Cache expires after 5 minutes
-}
-
-def get_indian_market_data():
-    """Fetch live data from Indian stock markets (NSE/BSE)"""
-    current_time = datetime.now(pytz.timezone('Asia/Kolkata'))
-    
-    # Check if cache is valid
-    if (market_data_cache["timestamp"] and
-        (current_time - market_data_cache["timestamp"]).total_seconds() < market_data_cache["cache_expiry_seconds"]):
-        return market_data_cache["data"]
-    
-    # For real implementation, replace with actual API calls to NSE/BSE data providers
-    # This is a placeholder using a public API for demo purposes
+# Batched append-only log of queries and answers, enabled by FINWISE_INTERACTION_LOG_DIR
+log_interaction = setup_interaction_logging(app)
+
+@app.after_request
+def compress_body(response):
+    """gzip/brotli for buffered responses; streams compress as they go in stream_response"""
+    return compression.compress_response(response, request.headers.get('Accept-Encoding', ''))
+
+# Upper bound for a whole /stream response, enforced as the upstream call deadline
+STREAM_TIMEOUT_SECONDS = float(os.getenv("STREAM_TIMEOUT_SECONDS", 60))
+
+def iter_response_text(response):
+    """Yield the text of a streaming Gemini response as each chunk arrives"""
+    # Iterating the SDK response object looks one chunk ahead before yielding,
+    # which would hold every chunk back until its successor lands. Read the
+    # already-fetched first chunk and then the raw upstream iterator instead.
+    # These are private attributes of google-generativeai 0.3.2 (pinned, and checked
+    # by test_app); if they change, fall back to plain iteration, one chunk late.
+    from google.generativeai.types import BlockedPromptException, GenerateContentResponse
+
+    error = getattr(response, '_error', None)
+    if error:
+        raise error
+    buffered = getattr(response, '_chunks', None)
+    if isinstance(buffered, list) and hasattr(response, '_iterator'):
+        chunks = (GenerateContentResponse.from_response(raw_chunk)
+                  for raw_chunk in itertools.chain(buffered, response._iterator or ()))
+    else:
+        logger.warning("Unexpected GenerateContentResponse internals, streaming without early chunks")
+        chunks = iter(response)
+    for chunk in chunks:
+        if chunk.prompt_feedback.block_reason:
+            raise BlockedPromptException(chunk)
+        candidates = chunk.candidates
+        if not candidates or not candidates[0].content.parts:
+            continue
+        text = "".join(part.text for part in candidates[0].content.parts)
+        if text:
+            yield text
+
+def cancel_response(response):
+    """Abort an in-flight streaming Gemini call so it stops using the connection"""
+    cancel = getattr(getattr(response, '_iterator', None), 'cancel', None)
+    if cancel is None:
+        return
     try:
-        # Fetch major Indian indices
-        nse_response = requests.get("https://api.polygon.io/v2/aggs/ticker/NSEI/prev?adjusted=true&apiKey=" + os.getenv("POLYGON_API_KEY", ""))
-        bse_response = requests.get("https://api.polygon.io/v2/aggs/ticker/SENSEX/prev?adjusted=true&apiKey=" + os.getenv("POLYGON_API_KEY", ""))
-        
-        # Fetch top gainers/losers - In a real app, you'd use appropriate APIs
-        # For demo, we'll simulate this data
-        top_gainers = [
-            {"symbol": "RELIANCE.NS", "change_percent": 2.45},
-            {"symbol": "TCS.NS", "change_percent": 1.78},
-            {"symbol": "HDFCBANK.NS", "change_percent": 1.65}
-        ]
-        
-        top_losers = [
-            {"symbol": "INFY.NS", "change_percent": -1.23},
-            {"symbol": "ICICIBANK.NS", "change_percent": -0.89},
-            {"symbol": "AXISBANK.NS", "change_percent": -0.72}
-        ]
-        
-        # Get currency rates
-        usd_inr = requests.get("https://open.er-api.com/v6/latest/USD")
-        
-        market_data = {
-            "indices": {
-                "nifty50": nse_response.json() if nse_response.status_code == 200 else {"c": 22000, "percent_change": 0.67},
-                "sensex": bse_response.json() if bse_response.status_code == 200 else {"c": 72500, "percent_change": 0.58}
-            },
-            "top_gainers": top_gainers,
-            "top_losers": top_losers,
-            "forex": {
-                "usd_inr": usd_inr.json()["rates"]["INR"] if usd_inr.status_code == 200 else 83.2
-            },
-            "timestamp": current_time.strftime("%Y-%m-%d %H:%M:%S IST")
-        }
-        
-        # Update cache
-        market_data_cache["timestamp"] = current_time
-        market_data_cache["data"] = market_data
-        
-        return market_data
-        
+        cancel()
+    except Exception as e:
+        logger.warning(f"Error cancelling upstream generation: {str(e)}")
+
+def new_request_id():
+    """Timestamp plus a random part; /stream request IDs also key the replay buffer, so they must not be guessable"""
+    return datetime.now().strftime('%Y%m%d-%H%M%S-') + secrets.token_hex(8)
+
+def wants_sse(req):
+    return 'text/event-stream' in req.headers.get('Accept', '') or req.args.get('format') == 'sse'
+
+def sse_response(request_id, after=0):
+    """Server-Sent Events for a buffered stream, from the chunk after event id `after`"""
+    body, encoding = compressed_stream(stream_replay.events(request_id, after))
+    resp = Response(body, mimetype='text/event-stream')
+    resp.headers.update({
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'X-Request-ID',
+        'Cache-Control': 'no-cache, no-store, must-revalidate, max-age=0',
+        'X-Accel-Buffering': 'no',
+        'X-Request-ID': request_id
+    })
+    if encoding is not None:
+        resp.headers['Content-Encoding'] = encoding
+    return resp
+
+def sse_error_message(error):
+    """What an SSE client is told when the generation behind its stream fails"""
+    if isinstance(error, generation.GenerationTimeout):
+        return "Response generation timed out. Please try a shorter question."
+    return "Error generating response. Please try again."
+
+def busy_response(request_id):
+    """503 returned when an endpoint has no free generation slots"""
+    resp = jsonify({
+        "error": "Server is busy. Please try again shortly.",
+        "request_id": request_id
+    })
+    resp.status_code = 503
+    resp.headers.update({
+        'Access-Control-Allow-Origin': '*',
+        'Retry-After': '2'
+    })
+    return resp
+
+def rate_limited_response(request_id, retry_after, message="Too many requests. Please slow down."):
+    """429 returned when a client is over its rate limit or already has requests queued"""
+    resp = jsonify({
+        "error": message,
+        "request_id": request_id
+    })
+    resp.status_code = 429
+    resp.headers.update({
+        'Access-Control-Allow-Origin': '*',
+        'Retry-After': str(max(1, math.ceil(retry_after)))
+    })
+    return resp
+
+def is_mobile_client(user_agent):
+    user_agent = user_agent.lower()
+    return any(device in user_agent for device in ['mobile', 'android', 'iphone', 'ipad', 'ipod'])
+
+def run_chat_generation(flight, generate_response, timeout_seconds, client, device_type):
+    """Run a /chat generation as the leader of its flight and share the answer with any followers"""
+    try:
+        # Run on the shared bounded executor; on timeout we return immediately and
+        # the transport deadline aborts the call instead of pinning a worker
+        with generation.generation_slot('chat', client, device_type):
+            text = generation.run_with_timeout(generate_response, timeout_seconds)
+    except generation.ClientBusy:
+        # Only the leader's client is over its queue share; followers just see a busy server
+        flight.fail(generation.GenerationRejected("Too many concurrent chat requests"))
+        raise
     except Exception as e:
-        print(f"Error fetching market data: {str(e)}")
-        # Return fallback data if API calls fail
-        return {
-            "indices": {
-                "nifty50": {"c": 22000, "percent_change": 0.67},
-                "sensex": {"c": 72500, "percent_change": 0.58}
-            },
-            "top_gainers": top_gainers,
-            "top_losers": top_losers,
-            "forex": {
-                "usd_inr": 83.2
-            },
-            "timestamp": current_time.strftime("%Y-%m-%d %H:%M:%S IST")
-        }
+        flight.fail(e)
+        raise
+    flight.publish(text)
+    flight.finish()
+    return text
+
+def compressed_stream(body):
+    """Compress a streamed body if the client accepts it; returns (body, encoding or None)"""
+    encoding = compression.negotiate(request.headers.get('Accept-Encoding', ''))
+    if encoding is None:
+        return body, None
+    return compression.compress_stream(body, encoding), encoding
+
+def stream_response(body):
+    """Wrap a text chunk iterator in a /stream response with CORS and no-cache headers"""
+    body, encoding = compressed_stream(body)
+    resp = Response(body, mimetype='text/plain; charset=utf-8')
+    
+    # Add comprehensive CORS and caching headers
+    resp.headers.update({
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Allow-Methods': 'POST, OPTIONS',
+        'Access-Control-Allow-Headers': 'Content-Type, Authorization',
+        'Access-Control-Allow-Credentials': 'false',
+        'Access-Control-Expose-Headers': '*',
+        'Cache-Control': 'no-cache, no-store, must-revalidate, max-age=0',
+        'Pragma': 'no-cache',
+        'Expires': '0',
+        'X-Accel-Buffering': 'no',
+        'Transfer-Encoding': 'chunked',
+        'Content-Type': 'text/plain; charset=utf-8'
+    })
+    if encoding is not None:
+        resp.headers['Content-Encoding'] = encoding
+    return resp
 
 @app.route('/market-data', methods=['GET'])
 def market_data():
-    """API endpoint to get current market data"""
-    return get_indian_market_data()
+    """
+    API endpoint to get current market data. The ETag follows the snapshot's
+    timestamp, so a polling client gets a 304 until the next refresh.
+    """
+    data = get_indian_market_data()
+    etag = response_cache.content_version(str(data.get("timestamp", "")))
+    if request.if_none_match.contains_weak(etag):
+        metrics.inc("finwise_market_data_conditional_total", result="not_modified")
+        resp = Response(status=304)
+    else:
+        if request.if_none_match:
+            metrics.inc("finwise_market_data_conditional_total", result="modified")
+        resp = jsonify(data)
+    # Weak: the gzip and brotli encodings of the body carry the same tag
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+HISTORY_WINDOW_UNITS = {"h": 3600, "d": 86400, "w": 7 * 86400}
+
+@app.route('/market-data/history', methods=['GET'])
+def market_data_history():
+    """
+    Stored market snapshots for a time range with rolling aggregates.
+    Query parameters: window (e.g. 12h, 1d, 1w; default 1d) or start/end as epoch
+    seconds, max_points (downsampling bound) and movers=true for gainers/losers.
+    """
+    try:
+        window = request.args.get('window', '1d')
+        now = time.time()
+        if 'start' in request.args or 'end' in request.args:
+            start = float(request.args['start']) if 'start' in request.args else None
+            end = float(request.args['end']) if 'end' in request.args else None
+        else:
+            start, end = now - float(window[:-1]) * HISTORY_WINDOW_UNITS[window[-1]], None
+        max_points = min(int(request.args.get('max_points', market_history.MARKET_HISTORY_MAX_POINTS)),
+                         market_history.MARKET_HISTORY_MAX_POINTS)
+        if max_points < 1:
+            raise ValueError("max_points must be at least 1")
+    except (ValueError, KeyError, IndexError):
+        return jsonify({"error": "Invalid window, start, end or max_points"}), 400
+
+    result = market_history.history.query(start, end, max_points,
+                                          include_movers=request.args.get('movers') == 'true')
+    result["aggregates"] = market_history.history.aggregates(now)
+    resp = jsonify(result)
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    return resp
 
 @app.route('/chat', methods=['POST', 'OPTIONS'])
+@log_interaction
 def chat():
     """
     Main chat endpoint that processes requests and returns responses in a standard JSON format
@@ -150,14 +279,22 @@ def chat():
         })
         return response
 
-    request_id = datetime.now().strftime('%Y%m%d-%H%M%S-') + str(id(request))[:8]
+    request_id = new_request_id()
+    structured_logging.start_request(request_id)
+    timings = metrics.RequestTimings()
     try:
         # Log request details
         logger.info(f"[{request_id}] New chat request received")
+
+        client = rate_limit.client_key(request)
+        retry_after = rate_limit.check(request, 'chat')
+        if retry_after:
+            logger.warning(f"[{request_id}] Client over rate limit, retry in {retry_after:.1f}s")
+            metrics.inc("finwise_requests_total", endpoint="chat", outcome="rate_limited")
+            return rate_limited_response(request_id, retry_after)
         
         # Check if request is from mobile device
-        user_agent = request.headers.get('User-Agent', '').lower()
-        is_mobile = any(device in user_agent for device in ['mobile', 'android', 'iphone', 'ipad', 'ipod'])
+        is_mobile = is_mobile_client(request.headers.get('User-Agent', ''))
         
         logger.info(f"[{request_id}] Client IP: {request.remote_addr}, Mobile: {is_mobile}")
         
@@ -168,25 +305,24 @@ def chat():
         
         data = request.json
         msg = data.get('chat', '')
-        history = data.get('history', [])
+        history = data.get('history') or []
         
         if not msg:
             logger.error(f"[{request_id}] Empty message received")
             return jsonify({"error": "Message cannot be empty"}), 400
+        history_error = conversation.history_error(history)
+        if history_error:
+            return jsonify({"error": history_error}), 400
         
-        # For mobile, limit input length to reduce processing time
-        if is_mobile and len(msg) > 150:
-            msg = msg[:150]
-            logger.info(f"[{request_id}] Mobile request - truncated long message to 150 chars")
-        
-        logger.info(f"[{request_id}] Message length: {len(msg)}")
-        logger.info(f"[{request_id}] History items: {len(history)}")
+        logger.debug(f"[{request_id}] Message length: {len(msg)}")
+        logger.debug(f"[{request_id}] History items: {len(history)}")
 
         # Get market data with error handling
+        fetch_start = time.perf_counter()
         try:
-            logger.info(f"[{request_id}] Fetching market data...")
+            logger.debug(f"[{request_id}] Fetching market data...")
             market_data = get_indian_market_data()
-            logger.info(f"[{request_id}] Market data fetched successfully")
+            logger.debug(f"[{request_id}] Market data fetched successfully")
         except Exception as market_error:
             logger.error(f"[{request_id}] Error fetching market data: {str(market_error)}", exc_info=True)
             # Continue with empty market data rather than failing
@@ -197,76 +333,133 @@ def chat():
                 "top_gainers": [],
                 "top_losers": []
             }
+        timings.record("market_data", time.perf_counter() - fetch_start)
 
-        # Create context message with market data
-        market_context = f"""
-Current Indian Market Data ({market_data['timestamp']}):
-- Nifty 50: {market_data['indices']['nifty50']['c']} ({market_data['indices']['nifty50']['percent_change']}%)
-- Sensex: {market_data['indices']['sensex']['c']} ({market_data['indices']['sensex']['percent_change']}%)
-- USD/INR: {market_data['forex']['usd_inr']}
-
-Top Gainers:
-{', '.join([f"{g['symbol']}: +{g['change_percent']}%" for g in market_data['top_gainers']])}
+        # Quotes, definitions and plain calculations are answered without the model
+        with timings.stage("routing"):
+            intent, local_answer = intent_router.route(msg, market_data, 'chat')
+        if local_answer is not None:
+            logger.info(f"[{request_id}] Answered locally ({intent})")
+            metrics.inc("finwise_requests_total", endpoint="chat", outcome="routed")
+            return jsonify({
+                "text": local_answer,
+                "request_id": request_id,
+                "timing": {
+                    "total_seconds": time.perf_counter() - fetch_start,
+                    "stages": timings.as_dict()
+                },
+                "device_type": "mobile" if is_mobile else "desktop",
+                "routed": intent
+            }), 200
 
-Top Losers:
-{', '.join([f"{l['symbol']}: {l['change_percent']}%" for l in market_data['top_losers']])}
-"""
-        logger.info(f"[{request_id}] Market context prepared")
+        # Rendered once per market data refresh and shared by both endpoints
+        with timings.stage("prompt_build"):
+            prompt_context = prompt_builder.get_prompt_context(market_data)
+            history_section = conversation.build_history_section(history, data.get('conversation_id'))
+        logger.debug(f"[{request_id}] Market context prepared")
 
         # Generate response with timeout
         start_time = time.time()
+
+        # Answers depend on the system prompt and market snapshot as well as the query,
+        # so a change to either invalidates every cached answer
+        context_version = prompt_context.version
+        device_type = "mobile" if is_mobile else "desktop"
+        # Follow-ups are only reused within the same conversation context
+        cache_variant = device_type + response_cache.content_version(history_section) if history_section else device_type
+        if response_cache.RESPONSE_CACHE_ENABLED:
+            cached_response = response_cache.cache.get(msg, context_version, cache_variant)
+            if cached_response is not None:
+                logger.info(f"[{request_id}] Response cache hit")
+                metrics.inc("finwise_requests_total", endpoint="chat", outcome="cached")
+                return jsonify({
+                    "text": cached_response,
+                    "request_id": request_id,
+                    "timing": {
+                        "total_seconds": time.time() - start_time,
+                        "stages": timings.as_dict()
+                    },
+                    "device_type": device_type,
+                    "cached": True
+                }), 200
         
         # Set timeout based on device type
         timeout_seconds = 10 if is_mobile else 25
         
         try:
-            logger.info(f"[{request_id}] Initializing Gemini model...")
-            model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+            model = prompt_builder.get_model()
             
             # Set a more concise response limit for mobile
-            prompt_suffix = "\n\nKeep your response very brief." if is_mobile else ""
+            prompt_suffix = prompt_builder.MOBILE_PROMPT_SUFFIX if is_mobile else ""
+            # Numbers the model would otherwise have to work out itself
+            with timings.stage("calculator"):
+                figures = calculator.figures_for_query(msg)
+            with timings.stage("prompt_build"):
+                prompt = prompt_builder.build_prompt(prompt_context, msg, prompt_suffix, history_section, figures)
             
             logger.info(f"[{request_id}] Generating content with Gemini (timeout: {timeout_seconds}s)...")
             
-            # Use a separate thread with timeout for model generation
-            from concurrent.futures import ThreadPoolExecutor, TimeoutError
-            
             def generate_response():
-                return model.generate_content(
-                    f"{DETAILED_PROMPT}\n\n{market_context}\n\nQuery: {msg}{prompt_suffix}"
+                return generation.generate_content(
+                    model,
+                    prompt,
+                    timeout_seconds
                 ).text
             
-            with ThreadPoolExecutor() as executor:
-                future = executor.submit(generate_response)
-                try:
-                    detailed_response = future.result(timeout=timeout_seconds)
-                except TimeoutError:
-                    logger.error(f"[{request_id}] Model generation timed out after {timeout_seconds} seconds")
-                    return jsonify({
-                        "error": "Response generation timed out. Please try a shorter question.",
-                        "request_id": request_id
-                    }), 500
+            # Identical questions arriving while this one is being answered wait for
+            # the same generation instead of calling the model again
+            flight, is_leader = coalescing.join(coalescing.flight_key(msg, context_version, cache_variant), 'chat')
+            try:
+                if is_leader:
+                    detailed_response = run_chat_generation(flight, generate_response, timeout_seconds,
+                                                            client, device_type)
+                else:
+                    logger.info(f"[{request_id}] Joined an identical generation already in flight")
+                    detailed_response = flight.result(timeout_seconds)
+                    if detailed_response is None:
+                        raise generation.GenerationTimeout(f"Generation timed out after {timeout_seconds} seconds")
+            except generation.ClientBusy:
+                logger.warning(f"[{request_id}] Client already has chat requests queued, rejecting request")
+                metrics.inc("finwise_requests_total", endpoint="chat", outcome="rate_limited")
+                return rate_limited_response(request_id, generation.ENDPOINT_QUEUE_WAIT_SECONDS,
+                                             "Too many requests in progress. Please wait for an answer.")
+            except generation.GenerationRejected as rejected:
+                logger.warning(f"[{request_id}] Chat generation rejected: {str(rejected)}")
+                metrics.inc("finwise_requests_total", endpoint="chat", outcome="rejected")
+                return busy_response(request_id)
+            except generation.GenerationTimeout:
+                logger.error(f"[{request_id}] Model generation timed out after {timeout_seconds} seconds")
+                metrics.inc("finwise_generation_timeouts_total", endpoint="chat")
+                metrics.inc("finwise_requests_total", endpoint="chat", outcome="timeout")
+                return jsonify({
+                    "error": "Response generation timed out. Please try a shorter question.",
+                    "request_id": request_id
+                }), 500
+            finally:
+                flight.detach()
             
             generation_time = time.time() - start_time
+            timings.record("generation", generation_time)
+            metrics.inc("finwise_requests_total", endpoint="chat", outcome="ok")
             logger.info(f"[{request_id}] Generated response in {generation_time:.2f}s, length: {len(detailed_response)}")
-            logger.info(f"[{request_id}] First 100 chars: {detailed_response[:100]}")
-            
-            # For mobile devices, ensure response isn't too long to avoid rendering issues
-            if is_mobile and len(detailed_response) > 1000:
-                detailed_response = detailed_response[:1000] + "...\n\n*Response truncated for mobile.*"
-                logger.info(f"[{request_id}] Truncated long response for mobile device")
+            logger.debug(f"[{request_id}] First 100 chars: {detailed_response[:100]}")
+            if is_leader and response_cache.RESPONSE_CACHE_ENABLED:
+                response_cache.cache.put(msg, context_version, detailed_response, cache_variant)
             
             return jsonify({
                 "text": detailed_response,
                 "request_id": request_id,
                 "timing": {
-                    "total_seconds": generation_time
+                    "total_seconds": generation_time,
+                    "stages": timings.as_dict()
                 },
                 "device_type": "mobile" if is_mobile else "desktop"
             }), 200
             
         except Exception as model_error:
             logger.error(f"[{request_id}] Model generation error: {str(model_error)}", exc_info=True)
+            metrics.inc("finwise_upstream_errors_total", provider="gemini")
+            metrics.inc("finwise_requests_total", endpoint="chat", outcome="error")
             return jsonify({
                 "error": f"Error generating response: {str(model_error)}",
                 "request_id": request_id
@@ -274,12 +467,14 @@ Top Losers:
 
     except Exception as e:
         logger.error(f"[{request_id}] Unhandled error in chat endpoint: {str(e)}", exc_info=True)
+        metrics.inc("finwise_requests_total", endpoint="chat", outcome="error")
         return jsonify({
             "error": f"Server error: {str(e)}",
             "request_id": request_id
         }), 500
 
 @app.route('/stream', methods=['POST', 'OPTIONS'])
+@log_interaction
 def stream():
     if request.method == 'OPTIONS':
         # Handle preflight request
@@ -293,103 +488,220 @@ def stream():
         })
         return response
 
-    request_id = datetime.now().strftime('%Y%m%d-%H%M%S-') + str(id(request))[:8]
+    request_id = new_request_id()
+    log_state = structured_logging.start_request(request_id)
+    timings = metrics.RequestTimings()
     try:
-        # Log complete request details
+        # Log request details
         logger.info(f"[{request_id}] New stream request received")
-        logger.info(f"[{request_id}] Headers: {dict(request.headers)}")
-        logger.info(f"[{request_id}] Client IP: {request.remote_addr}")
-        logger.info(f"[{request_id}] Method: {request.method}")
+        logger.info(f"[{request_id}] Client IP: {request.remote_addr}, "
+                    f"User-Agent: {request.headers.get('User-Agent', '')}")
+
+        client = rate_limit.client_key(request)
+        retry_after = rate_limit.check(request, 'stream')
+        if retry_after:
+            logger.warning(f"[{request_id}] Client over rate limit, retry in {retry_after:.1f}s")
+            metrics.inc("finwise_requests_total", endpoint="stream", outcome="rate_limited")
+            return rate_limited_response(request_id, retry_after)
+        device_type = "mobile" if is_mobile_client(request.headers.get('User-Agent', '')) else "desktop"
+        sse = wants_sse(request)
         
         data = request.json
         msg = data.get('chat', '')
-        history = data.get('history', [])
+        history = data.get('history') or []
+        history_error = conversation.history_error(history)
+        if history_error:
+            resp = jsonify({"error": history_error})
+            resp.headers['Access-Control-Allow-Origin'] = '*'
+            return resp, 400
         
-        logger.info(f"[{request_id}] Message length: {len(msg)}")
-        logger.info(f"[{request_id}] History items: {len(history)}")
+        logger.debug(f"[{request_id}] Message length: {len(msg)}")
+        logger.debug(f"[{request_id}] History items: {len(history)}")
 
         # Get market data
-        logger.info(f"[{request_id}] Fetching market data...")
-        market_data = get_indian_market_data()
-        logger.info(f"[{request_id}] Market data fetched successfully")
+        logger.debug(f"[{request_id}] Fetching market data...")
+        with timings.stage("market_data"):
+            market_data = get_indian_market_data()
+        logger.debug(f"[{request_id}] Market data fetched successfully")
 
-        # Create context message with market data
-        market_context = f"""
-Current Indian Market Data ({market_data['timestamp']}):
-- Nifty 50: {market_data['indices']['nifty50']['c']} ({market_data['indices']['nifty50']['percent_change']}%)
-- Sensex: {market_data['indices']['sensex']['c']} ({market_data['indices']['sensex']['percent_change']}%)
-- USD/INR: {market_data['forex']['usd_inr']}
+        with timings.stage("routing"):
+            intent, local_answer = intent_router.route(msg, market_data, 'stream')
+        if local_answer is not None:
+            logger.info(f"[{request_id}] Answered locally ({intent})")
+            metrics.inc("finwise_requests_total", endpoint="stream", outcome="routed")
+            if sse:
+                stream_replay.record(request_id, iter([local_answer]))
+                return sse_response(request_id)
+            return stream_response(iter([local_answer]))
 
-Top Gainers:
-{', '.join([f"{g['symbol']}: +{g['change_percent']}%" for g in market_data['top_gainers']])}
+        # Rendered once per market data refresh and shared by both endpoints
+        with timings.stage("prompt_build"):
+            prompt_context = prompt_builder.get_prompt_context(market_data)
+            history_section = conversation.build_history_section(history, data.get('conversation_id'))
+        logger.debug(f"[{request_id}] Market context prepared")
 
-Top Losers:
-{', '.join([f"{l['symbol']}: {l['change_percent']}%" for l in market_data['top_losers']])}
-"""
-        logger.info(f"[{request_id}] Market context prepared")
+        # The stream prompt matches the desktop /chat prompt, so the two share entries
+        context_version = prompt_context.version
+        cache_variant = "desktop" + response_cache.content_version(history_section) if history_section else "desktop"
+        if response_cache.RESPONSE_CACHE_ENABLED:
+            cached_response = response_cache.cache.get(msg, context_version, cache_variant)
+            if cached_response is not None:
+                logger.info(f"[{request_id}] Response cache hit")
+                metrics.inc("finwise_requests_total", endpoint="stream", outcome="cached")
+                if sse:
+                    stream_replay.record(request_id, iter([cached_response]))
+                    return sse_response(request_id)
+                return stream_response(iter([cached_response]))
 
         # Generate response
-        logger.info(f"[{request_id}] Initializing Gemini model...")
-        model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+        model = prompt_builder.get_model()
+        with timings.stage("calculator"):
+            figures = calculator.figures_for_query(msg)
+        with timings.stage("prompt_build"):
+            prompt = prompt_builder.build_prompt(prompt_context, msg, history_section=history_section, figures=figures)
         
-        logger.info(f"[{request_id}] Generating content with Gemini...")
-        try:
-            detailed_response = model.generate_content(
-                f"{DETAILED_PROMPT}\n\n{market_context}\n\nQuery: {msg}"
-            ).text
-            logger.info(f"[{request_id}] Generated response length: {len(detailed_response)}")
-            logger.info(f"[{request_id}] First 100 chars: {detailed_response[:100]}")
-        except Exception as model_error:
-            logger.error(f"[{request_id}] Model generation error: {str(model_error)}", exc_info=True)
-            raise
+        # Identical questions arriving while this one is being answered read the same
+        # upstream stream instead of calling the model again
+        flight, is_leader = coalescing.join(coalescing.flight_key(msg, context_version, cache_variant), 'stream')
+        start_time = time.time()
+        if is_leader:
+            logger.info(f"[{request_id}] Generating content with Gemini (streaming)...")
+            try:
+                release_slot = generation.acquire_slot('stream', client, device_type)
+            except generation.ClientBusy:
+                # Only this client is over its queue share; followers just see a busy server
+                flight.fail(generation.GenerationRejected("Too many concurrent stream requests"))
+                flight.detach()
+                logger.warning(f"[{request_id}] Client already has stream requests queued, rejecting request")
+                metrics.inc("finwise_requests_total", endpoint="stream", outcome="rate_limited")
+                return rate_limited_response(request_id, generation.ENDPOINT_QUEUE_WAIT_SECONDS,
+                                             "Too many requests in progress. Please wait for an answer.")
+            except generation.GenerationRejected as rejected:
+                flight.fail(rejected)
+                flight.detach()
+                logger.warning(f"[{request_id}] Stream concurrency limit reached, rejecting request")
+                metrics.inc("finwise_requests_total", endpoint="stream", outcome="rejected")
+                return busy_response(request_id)
+
+            try:
+                # Blocks only until the first chunk arrives, so model errors still
+                # surface as a 500 before any bytes are sent to the client
+                response = generation.run_with_timeout(
+                    lambda: generation.generate_content(
+                        model,
+                        prompt,
+                        STREAM_TIMEOUT_SECONDS,
+                        stream=True
+                    ),
+                    STREAM_TIMEOUT_SECONDS
+                )
+            except Exception as model_error:
+                release_slot()
+                flight.fail(model_error)
+                flight.detach()
+                if isinstance(model_error, generation.ModelUnavailable):
+                    logger.warning(f"[{request_id}] Gemini circuit is open, rejecting request")
+                    metrics.inc("finwise_requests_total", endpoint="stream", outcome="rejected")
+                    return busy_response(request_id)
+                if isinstance(model_error, generation.GenerationTimeout):
+                    metrics.inc("finwise_generation_timeouts_total", endpoint="stream")
+                else:
+                    metrics.inc("finwise_upstream_errors_total", provider="gemini")
+                logger.error(f"[{request_id}] Model generation error: {str(model_error)}", exc_info=True)
+                raise
+
+            def on_done(flight):
+                # The stream slot is held until the generation ends or every reader has gone away
+                release_slot()
+                if flight.cancelled:
+                    logger.info(f"[{request_id}] Cancelled upstream generation")
+                elif flight.error is not None:
+                    metrics.inc("finwise_upstream_errors_total", provider="gemini")
+                else:
+                    timings.record("generation", time.time() - start_time)
+                    if response_cache.RESPONSE_CACHE_ENABLED:
+                        response_cache.cache.put(msg, context_version, flight.text(), cache_variant)
+
+            flight.set_source(iter_response_text(response), on_cancel=lambda: cancel_response(response))
+            flight.add_done_callback(on_done)
+        else:
+            logger.info(f"[{request_id}] Joined an identical generation already in flight")
+            started = flight.wait_started(STREAM_TIMEOUT_SECONDS)
+            if not started or (flight.error is not None and not flight.chunks):
+                flight.detach()
+                if isinstance(flight.error, generation.GenerationRejected):
+                    metrics.inc("finwise_requests_total", endpoint="stream", outcome="rejected")
+                    return busy_response(request_id)
+                raise flight.error or generation.GenerationTimeout(
+                    f"Generation timed out after {STREAM_TIMEOUT_SECONDS} seconds")
+
+        first_chunk_time = time.time() - start_time
+        timings.record("time_to_first_token", first_chunk_time)
+        logger.info(f"[{request_id}] First chunk received in {first_chunk_time:.2f}s")
+
+        left = []
+
+        def leave_flight():
+            # The last reader to leave an unfinished flight cancels the upstream call
+            if not left:
+                left.append(True)
+                flight.detach()
 
         def generate():
+            chunks_sent = 0
+            chars_sent = 0
+            stream_start = time.time()
+            # The generator runs after the view returns; keep logging against this request
+            structured_logging.bind(log_state)
+            log_chunks = logger.isEnabledFor(logging.DEBUG)
             try:
-                # Send the response in smaller chunks for better mobile compatibility
-                chunk_size = 50  # Reduced chunk size for mobile
-                total_chunks = len(detailed_response) // chunk_size + (1 if len(detailed_response) % chunk_size else 0)
-                chunks_sent = 0
-                
-                logger.info(f"[{request_id}] Starting stream with {total_chunks} chunks")
-                
-                for i in range(0, len(detailed_response), chunk_size):
-                    chunk = detailed_response[i:i + chunk_size]
+                # Chunks are pulled from the model only as fast as the fastest
+                # reader of this flight takes them
+                for chunk in flight.subscribe():
                     chunks_sent += 1
-                    logger.info(f"[{request_id}] Sending chunk {chunks_sent}/{total_chunks}, size: {len(chunk)}")
-                    # Send chunk without adding newline
+                    chars_sent += len(chunk)
+                    if log_chunks:
+                        logger.debug(f"[{request_id}] Sending chunk {chunks_sent} ({len(chunk)} chars)",
+                                     extra=structured_logging.SAMPLED)
                     yield chunk
-                
-                logger.info(f"[{request_id}] Stream completed successfully")
+                metrics.inc("finwise_requests_total", endpoint="stream", outcome="ok")
+                logger.info(f"[{request_id}] Stream completed successfully: {chunks_sent} chunks, "
+                            f"{chars_sent} chars in {time.time() - start_time:.2f}s "
+                            f"(first chunk {first_chunk_time:.2f}s)")
+            except GeneratorExit:
+                logger.warning(f"[{request_id}] Client disconnected after {chunks_sent} chunks")
+                metrics.inc("finwise_requests_total", endpoint="stream", outcome="disconnected")
+                raise
             except Exception as stream_error:
                 logger.error(f"[{request_id}] Error during streaming: {str(stream_error)}", exc_info=True)
+                metrics.inc("finwise_requests_total", endpoint="stream", outcome="error")
                 raise
+            finally:
+                leave_flight()
+                timings.record("stream_duration", time.time() - stream_start)
+                logger.info(f"[{request_id}] Stage timings", extra={"stages": timings.as_dict()})
                 
-        logger.info(f"[{request_id}] Setting up response stream...")
-        resp = Response(
-            stream_with_context(generate()),
-            mimetype='text/plain; charset=utf-8'
-        )
-        
-        # Add comprehensive CORS and caching headers
-        resp.headers.update({
-            'Access-Control-Allow-Origin': '*',
-            'Access-Control-Allow-Methods': 'POST, OPTIONS',
-            'Access-Control-Allow-Headers': 'Content-Type, Authorization',
-            'Access-Control-Allow-Credentials': 'false',
-            'Access-Control-Expose-Headers': '*',
-            'Cache-Control': 'no-cache, no-store, must-revalidate, max-age=0',
-            'Pragma': 'no-cache',
-            'Expires': '0',
-            'X-Accel-Buffering': 'no',
-            'Transfer-Encoding': 'chunked',
-            'Content-Type': 'text/plain; charset=utf-8'
-        })
-        
-        logger.info(f"[{request_id}] Response headers set: {dict(resp.headers)}")
+        if sse:
+            # The answer is buffered as it arrives and keeps arriving if the client
+            # drops, so it can reconnect to /stream/<request_id> and resume
+            try:
+                stream_replay.record(request_id, generate(), on_error=sse_error_message)
+            except Exception:
+                # generate() never started, so its cleanup would not leave the flight
+                # or give back the stream slot
+                leave_flight()
+                raise
+            return sse_response(request_id)
+
+        logger.debug(f"[{request_id}] Setting up response stream...")
+        resp = stream_response(stream_with_context(generate()))
+        # Also covers a client that goes away before the body is first read
+        resp.call_on_close(leave_flight)
         return resp
 
     except Exception as e:
         logger.error(f"[{request_id}] Error in stream endpoint: {str(e)}", exc_info=True)
+        metrics.inc("finwise_requests_total", endpoint="stream", outcome="error")
         error_resp = Response(
             json.dumps({
                 "error": str(e),
@@ -408,6 +720,147 @@ Top Losers:
         logger.error(f"[{request_id}] Returning error response: {str(e)}")
         return error_resp
 
+@app.route('/stream/<request_id>', methods=['GET'])
+def resume_stream(request_id):
+    """
+    Resume an SSE stream after a disconnect without generating the answer again.
+    Sends the chunks after the Last-Event-ID header (or last_event_id parameter),
+    then follows the stream live if it is still running.
+    """
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id') or 0
+    try:
+        after = int(last_event_id)
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID"}), 400
+    if stream_replay.store.read(request_id, after, 0) is None:
+        metrics.inc("finwise_stream_resumes_total", result="miss")
+        resp = jsonify({"error": "Stream not found or expired", "request_id": request_id})
+        resp.headers['Access-Control-Allow-Origin'] = '*'
+        return resp, 404
+    metrics.inc("finwise_stream_resumes_total", result="hit")
+    logger.info(f"[{request_id}] Resuming stream after event {after}")
+    return sse_response(request_id, after)
+
+@app.route('/calculate', methods=['POST'])
+def calculate():
+    """
+    Deterministic financial calculations without a model call. The body names a
+    type (sip, lumpsum, compare, goal, monte_carlo, tax) and its inputs, e.g.
+    {"type": "sip", "monthly": 5000, "years": 10, "annual_return": 12}.
+    """
+    try:
+        result = calculator.calculate(request.get_json(silent=True))
+        status = 200
+    except calculator.CalculationError as e:
+        result, status = {"error": str(e)}, 400
+    resp = jsonify(result)
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    return resp, status
+
+def batch_error_response(error):
+    status = 404 if isinstance(error, batch.JobNotFound) else 409 if isinstance(error, batch.JobBusy) else 400
+    return jsonify({"error": str(error)}), status
+
+def batch_owner():
+    """
+    The caller's API key digest. Batch jobs can cost thousands of generations, so
+    they are only for callers with a key from FINWISE_API_KEYS, and each caller
+    sees only its own jobs.
+    """
+    return rate_limit.api_key_id(request)
+
+@app.route('/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    Answer many queries in one request: {"items": [{"id": ..., "chat": ...}, ...]}.
+    Returns JSON lines as items finish: a "job" line, one "result" line per item
+    (text or error, with timings) and a "summary" line. The X-Batch-Job-ID header
+    names the job; POST {"job_id": ...} again after a crash or disconnect to resume
+    it without redoing finished items. Requires a configured API key.
+    """
+    owner = batch_owner()
+    if owner is None:
+        return jsonify({"error": "Batch jobs require an API key"}), 401
+    retry_after = rate_limit.check(request, 'batch')
+    if retry_after:
+        metrics.inc("finwise_requests_total", endpoint="batch", outcome="rate_limited")
+        return rate_limited_response(new_request_id(), retry_after)
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request must be a JSON object"}), 400
+    try:
+        job_id = data.get('job_id')
+        if (data.get('items') is None) == (job_id is None):
+            raise batch.BatchError("Send items to start a job or job_id to resume one")
+        if job_id is None:
+            job_id = batch.create_job(data['items'], owner)
+        job = batch.open_job(job_id, owner)
+    except batch.BatchError as e:
+        return batch_error_response(e)
+    concurrency = data.get('concurrency') if isinstance(data.get('concurrency'), int) else None
+    metrics.inc("finwise_requests_total", endpoint="batch", outcome="ok")
+
+    def lines():
+        results = job.run(concurrency)
+        try:
+            for line in results:
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            # A disconnect stops the job; queued items run again on resume
+            results.close()
+
+    body, encoding = compressed_stream(lines())
+    resp = Response(body, mimetype='application/x-ndjson')
+    # Also releases the job if the body is never read
+    resp.call_on_close(job.close)
+    resp.headers.update({
+        'Cache-Control': 'no-cache, no-store, must-revalidate, max-age=0',
+        'X-Accel-Buffering': 'no',
+        'X-Batch-Job-ID': job_id
+    })
+    if encoding is not None:
+        resp.headers['Content-Encoding'] = encoding
+    return resp
+
+@app.route('/chat/batch/<job_id>', methods=['GET'])
+def chat_batch_status(job_id):
+    """Progress of one of the caller's batch jobs; ?results=true adds the results persisted so far"""
+    owner = batch_owner()
+    if owner is None:
+        return jsonify({"error": "Batch jobs require an API key"}), 401
+    try:
+        status = batch.job_status(job_id, owner)
+    except batch.BatchError as e:
+        return batch_error_response(e)
+    if request.args.get('results') == 'true':
+        status["results"] = [result for _, result in sorted(batch.load_results(job_id).items())]
+    return jsonify(status)
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters and size of the response cache"""
+    resp = jsonify(response_cache.cache.stats())
+    resp.headers['Access-Control-Allow-Origin'] = '*'
+    return resp
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus-style metrics: stage latency quantiles, cache hit rates, in-flight and error counts"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Set when this worker begins a graceful shutdown or reload (see gunicorn.conf.py)
+draining = threading.Event()
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe: 200 as soon as the worker can serve, 503 once it is draining
+    so the load balancer stops sending it new requests while streams finish
+    """
+    if draining.is_set():
+        return jsonify({"status": "draining"}), 503
+    return jsonify({"status": "ready", "model_loaded": prompt_builder.model_loaded()}), 200
+
 @app.route('/ping', methods=['GET'])
 def ping():
     """Simple endpoint to check if server is running"""
@@ -419,4 +872,5 @@ def ping():
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 9000))
     logger.info(f"Starting server on port {port}")
-    app.run(debug=True, host='0.0.0.0', port=port) 
\ No newline at end of file
+    # Development server only; production runs gunicorn -c gunicorn.conf.py app:app
+    app.run(debug=os.getenv("DEBUG", "false").lower() == "true", host='0.0.0.0', port=port) 
\ No newline at end of file
@@ -0,0 +1,377 @@
+import os
+import re
+import json
+import time
+import logging
+import secrets
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import metrics
+import calculator
+import conversation
+import generation
+import intent_router
+import prompt_builder
+import response_cache
+from market_data import get_indian_market_data
+
+try:
+    import fcntl
+except ImportError:  # Windows: a job is only protected against concurrent runs within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Each job is <job_id>.json (items plus the market snapshot and prompt prefix frozen at
+# creation, so resumes answer against the same context) and <job_id>.jsonl (results,
+# appended as items finish)
+BATCH_JOB_DIR = os.getenv("BATCH_JOB_DIR", os.path.join(tempfile.gettempdir(), "finwise_batch_jobs"))
+# Worker threads per job, unless the caller asks for fewer
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
+# Gemini calls in flight across every batch job in the process. Batches use their own
+# threads and this limit rather than the /chat and /stream generation slots.
+BATCH_MAX_GENERATIONS = int(os.getenv("BATCH_MAX_GENERATIONS", 8))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", 10000))
+BATCH_ITEM_TIMEOUT_SECONDS = float(os.getenv("BATCH_ITEM_TIMEOUT_SECONDS", 25))
+# Job files older than this are deleted when a new job is created
+BATCH_JOB_RETENTION_SECONDS = int(os.getenv("BATCH_JOB_RETENTION_SECONDS", 7 * 86400))
+
+_JOB_ID = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+metrics.COUNTERS["finwise_batch_items_total"] = \
+    "Batch items answered, by outcome (generated, routed, duplicate, error)"
+
+_generation_slots = threading.BoundedSemaphore(BATCH_MAX_GENERATIONS)
+_in_flight = [0]
+_running_jobs = set()
+_lock = threading.Lock()
+
+
+class BatchError(Exception):
+    """A batch request that cannot be run as given"""
+
+
+class JobNotFound(BatchError):
+    """No job with this ID in BATCH_JOB_DIR"""
+
+
+class JobBusy(BatchError):
+    """The job is already being run by another request or process"""
+
+
+def _path(job_id, suffix):
+    return os.path.join(BATCH_JOB_DIR, job_id + suffix)
+
+
+def _normalize_item(index, item):
+    """
+    {"id", "chat", "history", "conversation_id"} for a raw item, or an error message.
+    A malformed history raises BatchError, as /chat rejects it with a 400.
+    """
+    if isinstance(item, str):
+        item = {"chat": item}
+    if not isinstance(item, dict):
+        return None, "Item must be a string or an object with a 'chat' field"
+    history = item.get("history") or []
+    history_error = conversation.history_error(history)
+    if history_error:
+        raise BatchError(f"Item {item.get('id', index)}: {history_error}")
+    msg = item.get("chat")
+    if not isinstance(msg, str) or not msg.strip():
+        return None, "Message cannot be empty"
+    return {
+        "id": str(item.get("id", index)),
+        "chat": msg,
+        "history": history,
+        "conversation_id": item.get("conversation_id"),
+    }, None
+
+
+def _remove_expired_jobs(now):
+    try:
+        names = os.listdir(BATCH_JOB_DIR)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(BATCH_JOB_DIR, name)
+        try:
+            if now - os.stat(path).st_mtime > BATCH_JOB_RETENTION_SECONDS:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def create_job(items, owner=None):
+    """
+    Validate items, freeze the current market snapshot and prompt prefix, and write
+    the job manifest. Returns the generated job ID. owner (the caller's API key
+    digest) scopes the job to that caller. Invalid items are kept and reported as
+    errors when the job runs; an empty or oversized batch, or an item with a
+    malformed history, raises BatchError.
+    """
+    if not isinstance(items, list) or not items:
+        raise BatchError("items must be a non-empty list")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise BatchError(f"A batch can hold at most {BATCH_MAX_ITEMS} items")
+    # Always generated, so callers cannot pick, guess or collide with another caller's job
+    job_id = time.strftime("%Y%m%d-%H%M%S-") + secrets.token_hex(12)
+
+    os.makedirs(BATCH_JOB_DIR, exist_ok=True)
+    now = time.time()
+    _remove_expired_jobs(now)
+
+    market_data = get_indian_market_data()
+    context = prompt_builder.get_prompt_context(market_data)
+    normalized = []
+    for index, item in enumerate(items):
+        entry, error = _normalize_item(index, item)
+        if error is not None:
+            item_id = item.get("id", index) if isinstance(item, dict) else index
+            entry = {"id": str(item_id), "error": error}
+        normalized.append(entry)
+    manifest = {
+        "job_id": job_id,
+        "created": now,
+        "owner": owner,
+        "market_data": market_data,
+        "prompt": {"market_context": context.market_context, "prefix": context.prefix,
+                   "version": context.version},
+        "items": normalized,
+    }
+    fd, tmp_path = tempfile.mkstemp(dir=BATCH_JOB_DIR, prefix=".batch.")
+    with os.fdopen(fd, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, _path(job_id, ".json"))
+    logger.info(f"Created batch job {job_id} with {len(items)} items")
+    return job_id
+
+
+def load_results(job_id):
+    """Persisted results by item index; a later line for an index replaces an earlier one"""
+    results = {}
+    try:
+        with open(_path(job_id, ".jsonl"), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    continue  # a line cut short by a crash
+                results[result["index"]] = result
+    except FileNotFoundError:
+        pass
+    return results
+
+
+def _load_manifest(job_id, owner=None):
+    """A job's manifest; another owner's job is reported as unknown rather than forbidden"""
+    if not isinstance(job_id, str) or not _JOB_ID.match(job_id):
+        raise JobNotFound(f"Unknown batch job {job_id}")
+    try:
+        with open(_path(job_id, ".json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise JobNotFound(f"Unknown batch job {job_id}")
+    if owner is not None and manifest.get("owner") != owner:
+        raise JobNotFound(f"Unknown batch job {job_id}")
+    return manifest
+
+
+def job_status(job_id, owner=None):
+    """Progress of a job without running it; raises JobNotFound unless owner matches the job's"""
+    manifest = _load_manifest(job_id, owner)
+    results = load_results(job_id)
+    errors = sum(1 for r in results.values() if "error" in r)
+    with _lock:
+        running = job_id in _running_jobs
+    return {
+        "job_id": job_id,
+        "created": manifest["created"],
+        "total": len(manifest["items"]),
+        "completed": len(results) - errors,
+        "errors": errors,
+        "running": running,
+    }
+
+
+def _generate(model, prompt):
+    with _generation_slots:
+        with _lock:
+            _in_flight[0] += 1
+        try:
+            return generation.generate_content(model, prompt, BATCH_ITEM_TIMEOUT_SECONDS).text
+        finally:
+            with _lock:
+                _in_flight[0] -= 1
+
+
+class Job:
+    """
+    An opened job, locked against concurrent runs until close(). Use as a context
+    manager, or call run() and let it close the job when it finishes. With owner
+    given, only that caller's jobs can be opened.
+    """
+
+    def __init__(self, job_id, owner=None):
+        self.job_id = job_id
+        self.manifest = _load_manifest(job_id, owner)
+        self._lock_file = None
+        with _lock:
+            if job_id in _running_jobs:
+                raise JobBusy(f"Batch job {job_id} is already running")
+            _running_jobs.add(job_id)
+        if fcntl is not None:
+            self._lock_file = open(_path(job_id, ".lock"), "a")
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.close()
+                raise JobBusy(f"Batch job {job_id} is already running in another process")
+        prompt = self.manifest["prompt"]
+        self.context = prompt_builder.PromptContext(prompt["market_context"], prompt["prefix"], prompt["version"])
+
+    def close(self):
+        """Release the job; safe to call more than once"""
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        with _lock:
+            _running_jobs.discard(self.job_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _answer(self, item, model):
+        """Answer one unique query: (text, source, stage timings)"""
+        timings = metrics.RequestTimings()
+        msg = item["chat"]
+        market_data = self.manifest["market_data"]
+        with timings.stage("routing"):
+            intent, local_answer = intent_router.route(msg, market_data, "batch")
+        if local_answer is not None:
+            return {"text": local_answer, "routed": intent}, "routed", timings
+
+        with timings.stage("prompt_build"):
+            history_section = conversation.build_history_section(item["history"], item.get("conversation_id"))
+        # The shared response cache is not used: the job's frozen context version is
+        # usually older than the live one, and the cache drops every entry when it is
+        # asked about a different version. Duplicates within the job are answered once.
+        with timings.stage("calculator"):
+            figures = calculator.figures_for_query(msg)
+        with timings.stage("prompt_build"):
+            prompt = prompt_builder.build_prompt(self.context, msg, history_section=history_section, figures=figures)
+        with timings.stage("generation"):
+            text = _generate(model, prompt)
+        return {"text": text}, "generated", timings
+
+    def _run_item(self, item, model):
+        start = time.perf_counter()
+        try:
+            answer, source, timings = self._answer(item, model)
+        except Exception as e:
+            logger.warning(f"Batch job {self.job_id} item {item['id']} failed: {str(e)}")
+            if isinstance(e, generation.ModelUnavailable):
+                answer = {"error": "Model temporarily unavailable"}
+            else:
+                answer = {"error": f"Error generating response: {str(e)}"}
+            return answer, "error", {}, time.perf_counter() - start
+        return answer, source, timings.as_dict(), time.perf_counter() - start
+
+    def run(self, concurrency=None):
+        """
+        Yield the job's results as dicts: a "job" line, one "result" line per item
+        (results persisted by an earlier run first, marked "replayed"), then a
+        "summary" line. Items that failed before are tried again.
+        """
+        start = time.perf_counter()
+        concurrency = max(1, min(concurrency or BATCH_CONCURRENCY, BATCH_CONCURRENCY))
+        items = self.manifest["items"]
+        done = {index: r for index, r in load_results(self.job_id).items() if "error" not in r}
+        counts = {"ok": len(done), "errors": 0}
+        executor = None
+        try:
+            yield {"type": "job", "job_id": self.job_id, "total": len(items), "completed": len(done),
+                   "market_data_timestamp": self.manifest["market_data"].get("timestamp")}
+            for index in sorted(done):
+                yield dict(done[index], replayed=True)
+
+            # Identical questions in one job are answered once
+            pending = {}
+            with open(_path(self.job_id, ".jsonl"), "a", encoding="utf-8") as out:
+                def emit(index, answer, timing):
+                    result = dict({"type": "result", "index": index, "id": items[index]["id"]}, **answer)
+                    result["timing"] = timing
+                    # One line per result, flushed so a crash loses at most the items in flight
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()
+                    counts["errors" if "error" in result else "ok"] += 1
+                    return result
+
+                for index, item in enumerate(items):
+                    if index in done:
+                        continue
+                    if "error" in item:
+                        metrics.inc("finwise_batch_items_total", outcome="error")
+                        yield emit(index, {"error": item["error"]}, {"total_seconds": 0.0})
+                        continue
+                    key = (response_cache.normalize_query(item["chat"]),
+                           json.dumps(item["history"], sort_keys=True), item.get("conversation_id"))
+                    pending.setdefault(key, []).append(index)
+
+                if pending:
+                    model = prompt_builder.get_model()
+                    executor = ThreadPoolExecutor(max_workers=min(concurrency, len(pending)),
+                                                  thread_name_prefix=f"batch-{self.job_id}")
+                    futures = {executor.submit(self._run_item, items[indices[0]], model): indices
+                               for indices in pending.values()}
+                    for future in as_completed(futures):
+                        answer, source, stages, seconds = future.result()
+                        for n, index in enumerate(futures[future]):
+                            metrics.inc("finwise_batch_items_total", outcome=source if n == 0 else "duplicate")
+                            yield emit(index, answer, {"total_seconds": round(seconds, 4), "stages": stages})
+
+            logger.info(f"Batch job {self.job_id}: {counts['ok']} ok, {counts['errors']} errors "
+                        f"in {time.perf_counter() - start:.2f}s")
+            yield {"type": "summary", "job_id": self.job_id, "total": len(items), "ok": counts["ok"],
+                   "errors": counts["errors"], "seconds": round(time.perf_counter() - start, 3)}
+        finally:
+            if executor is not None:
+                # Client gone or job abandoned: drop queued items, they run again on resume
+                executor.shutdown(wait=False, cancel_futures=True)
+            self.close()
+
+
+def open_job(job_id, owner=None):
+    """Open an existing job for running; raises JobNotFound or JobBusy"""
+    return Job(job_id, owner)
+
+
+def run(items=None, job_id=None, concurrency=None):
+    """
+    Python API: create a job from items (or resume job_id when items is None) and
+    yield its result dicts as they complete.
+
+        for line in batch.run([{"id": "c1", "chat": "How should I invest 5 lakh?"}]):
+            ...
+    """
+    if (items is None) == (job_id is None):
+        raise BatchError("Pass items to start a job or job_id to resume one")
+    if items is not None:
+        job_id = create_job(items)
+    job = open_job(job_id)
+    yield from job.run(concurrency)
+
+
+def _collect_metrics():
+    with _lock:
+        running, in_flight = len(_running_jobs), _in_flight[0]
+    yield ("finwise_batch_jobs_running", "gauge", "Batch jobs being run in this process", {}, running)
+    yield ("finwise_batch_generations_in_flight", "gauge", "Gemini generations running for batch jobs",
+           {}, in_flight)
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,137 @@
+"""
+Bytes on the wire and transfer time of compressed responses on slow mobile links.
+
+Compares identity, gzip and (if installed) brotli for:
+  - a /market-data body, and a 304 answer to a conditional poll
+  - a long /chat answer, and the 1000-character cut that mobile clients used to get
+  - a /stream answer sent chunk by chunk, where each chunk is flushed as it is
+    compressed (so the per-chunk ratio is worse than for a whole body)
+
+Transfer time is modelled as one round trip plus body size over the link's
+bandwidth, plus the measured compression time; TCP slow start and headers are
+ignored, so treat the numbers as a comparison rather than absolute latency.
+
+Usage (from server-python/):
+    python benchmarks/bench_compression.py
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compression  # noqa: E402
+from bench_prompt import MARKET_DATA  # noqa: E402
+
+# name -> (downlink kbit/s, round trip ms)
+LINKS = {
+    "2G (EDGE)": (240, 400),
+    "3G": (780, 200),
+    "4G (weak)": (4000, 100),
+}
+
+ANSWER = """## Starting a SIP with ₹5,000 a month
+
+**1. Pick your goal and horizon.** For goals 7+ years away, equity funds suit best; for 3-5 years, \
+a hybrid or balanced advantage fund reduces the swings.
+
+**2. Start with a Nifty 50 index fund.** Costs are low (expense ratio around 0.1-0.2% for direct plans), \
+there is no fund manager risk, and it tracks the Nifty 50, currently at 22,000 (+0.67% today).
+
+**3. Split the amount:**
+- ₹3,000 in a Nifty 50 index fund
+- ₹1,500 in a flexi-cap fund for broader market exposure
+- ₹500 in an ELSS fund if you use the old tax regime, for Section 80C deductions
+
+**4. What to expect.** At 12% a year, ₹5,000 a month grows to about ₹11.6 lakh in 10 years, of which \
+₹6 lakh is your investment. Returns vary year to year; equity funds can fall 20-30% in a bad year.
+
+**5. Practical steps:**
+- Complete KYC with your PAN and Aadhaar
+- Choose direct plans on the AMC website or a zero-commission platform
+- Set the SIP date a few days after your salary credit
+- Increase the SIP by 10% each year as your income grows (step-up SIP)
+
+**6. Before you start.** Keep 6 months of expenses in an emergency fund (a liquid fund or savings \
+account) and get term life and health insurance first.
+
+*This is general information, not personalised investment advice. Consider speaking to a SEBI-registered \
+investment adviser for your situation.*
+"""
+STREAM_CHUNK_CHARS = 120
+
+
+def encodings():
+    return [None] + list(reversed(compression.supported_encodings()))
+
+
+def encoded_size(data, encoding):
+    return len(compression.compress(data, encoding)) if encoding else len(data)
+
+
+def compress_seconds(data, encoding, number=50):
+    if encoding is None:
+        return 0.0
+    return timeit.timeit(lambda: compression.compress(data, encoding), number=number) / number
+
+
+def stream_sizes(chunks, encoding):
+    """Bytes per chunk on the wire, including HTTP chunked framing"""
+    if encoding is None:
+        bodies = [c.encode("utf-8") for c in chunks]
+    else:
+        bodies = [b for b in compression.compress_stream(iter(chunks), encoding) if b]
+    return [len(b) + len(f"{len(b):x}") + 4 for b in bodies]
+
+
+def transfer_ms(size, link, cpu_seconds=0.0):
+    kbps, rtt_ms = LINKS[link]
+    return rtt_ms + size * 8 / kbps + cpu_seconds * 1000
+
+
+def report_body(title, data):
+    print(f"\n{title}")
+    print(f"  {'encoding':<10}{'bytes':>8}{'ratio':>8}{'cpu ms':>8}" + "".join(f"{link:>12}" for link in LINKS))
+    for encoding in encodings():
+        size = encoded_size(data, encoding)
+        cpu = compress_seconds(data, encoding)
+        times = "".join(f"{transfer_ms(size, link, cpu):>10.0f}ms" for link in LINKS)
+        print(f"  {encoding or 'identity':<10}{size:>8}{size / len(data):>8.2f}{cpu * 1000:>8.2f}{times}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args()
+    # Benchmark every body, not only those above the production threshold
+    compression.COMPRESSION_MIN_BYTES = 0
+
+    market = json.dumps(MARKET_DATA).encode("utf-8")
+    report_body("/market-data (200)", market)
+    print(f"  conditional poll answered 304: 0 body bytes on every link (one round trip: "
+          f"{', '.join(f'{link} {LINKS[link][1]}ms' for link in LINKS)})")
+
+    chat = json.dumps({"text": ANSWER, "request_id": "20250323-100000-0123456789abcdef"}).encode("utf-8")
+    report_body(f"/chat, full answer ({len(ANSWER)} chars)", chat)
+    truncated = ANSWER[:1000] + "...\n\n*Response truncated for mobile.*"
+    report_body("/chat, answer cut to 1000 chars as mobile clients used to get it",
+                json.dumps({"text": truncated}).encode("utf-8"))
+
+    chunks = [ANSWER[i:i + STREAM_CHUNK_CHARS] for i in range(0, len(ANSWER), STREAM_CHUNK_CHARS)]
+    print(f"\n/stream, {len(chunks)} chunks of {STREAM_CHUNK_CHARS} chars, flushed per chunk")
+    print(f"  {'encoding':<10}{'bytes':>8}{'ratio':>8}{'per chunk':>10}" +
+          "".join(f"{link:>12}" for link in LINKS))
+    identity_total = sum(stream_sizes(chunks, None))
+    for encoding in encodings():
+        sizes = stream_sizes(chunks, encoding)
+        total = sum(sizes)
+        # Time the whole answer spends on the link; with generation slower than the
+        # link this is hidden, on 2G it adds directly to time-to-last-token
+        times = "".join(f"{total * 8 / LINKS[link][0]:>10.0f}ms" for link in LINKS)
+        print(f"  {encoding or 'identity':<10}{total:>8}{total / identity_total:>8.2f}"
+              f"{total / len(chunks):>10.0f}{times}")
+
+
+if __name__ == "__main__":
+    main()
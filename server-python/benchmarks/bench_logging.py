@@ -0,0 +1,93 @@
+"""
+Micro-benchmark of logging cost on the request thread for one /stream request.
+
+Replays the records a stream request used to log (header dumps and a line per
+chunk, written synchronously by logging.basicConfig's handler) against the
+structured_logging pipeline (JSON written by a background thread, sampled chunk
+events, per-request cap). Output goes to a temporary file in both cases.
+
+Usage (from server-python/):
+    python benchmarks/bench_logging.py [--requests 2000] [--chunks 40]
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import structured_logging  # noqa: E402
+
+HEADERS = {
+    "Host": "finwise.rerecreation.us", "User-Agent": "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X)",
+    "Accept": "*/*", "Accept-Language": "en-IN,en;q=0.9", "Accept-Encoding": "gzip, deflate, br",
+    "Content-Type": "application/json", "Content-Length": "64", "Origin": "https://finwise.rerecreation.us",
+    "Connection": "keep-alive",
+}
+logger = logging.getLogger("bench")
+
+
+def legacy_request(request_id, chunks):
+    logger.info(f"[{request_id}] New stream request received")
+    logger.info(f"[{request_id}] Headers: {HEADERS}")
+    logger.info(f"[{request_id}] Client IP: 127.0.0.1")
+    logger.info(f"[{request_id}] Method: POST")
+    for n in range(chunks):
+        logger.info(f"[{request_id}] Sending chunk {n + 1}/{chunks}")
+    logger.info(f"[{request_id}] Response headers set: {HEADERS}")
+    logger.info(f"[{request_id}] Stream completed successfully")
+
+
+def structured_request(request_id, chunks):
+    structured_logging.start_request(request_id)
+    logger.info(f"[{request_id}] New stream request received")
+    logger.info(f"[{request_id}] Client IP: 127.0.0.1, User-Agent: {HEADERS['User-Agent']}")
+    log_chunks = logger.isEnabledFor(logging.DEBUG)
+    for n in range(chunks):
+        if log_chunks:
+            logger.debug(f"[{request_id}] Sending chunk {n + 1} (50 chars)", extra=structured_logging.SAMPLED)
+    logger.info(f"[{request_id}] Stage timings", extra={"stages": {"generation": 1.2}})
+    logger.info(f"[{request_id}] Stream completed successfully")
+
+
+def run(fn, requests, chunks):
+    start = time.perf_counter()
+    for i in range(requests):
+        fn(f"20250323-100000-{i:08d}", chunks)
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--chunks", type=int, default=40, help="chunks per streamed answer")
+    parser.add_argument("--level", default="INFO", help="log level for the structured run (DEBUG logs sampled chunks)")
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    with tempfile.TemporaryDirectory() as tmp:
+        with open(os.path.join(tmp, "legacy.log"), "w") as legacy_out:
+            handler = logging.StreamHandler(legacy_out)
+            handler.setFormatter(logging.Formatter(structured_logging.TEXT_FORMAT))
+            root.handlers = [handler]
+            root.setLevel(logging.INFO)
+            legacy = run(legacy_request, args.requests, args.chunks)
+
+        with open(os.path.join(tmp, "structured.log"), "w") as structured_out:
+            structured_logging.configure_logging(level=args.level, fmt="json", stream=structured_out)
+            structured = run(structured_request, args.requests, args.chunks)
+            structured_logging.stop_logging()
+        legacy_bytes = os.path.getsize(os.path.join(tmp, "legacy.log"))
+        structured_bytes = os.path.getsize(os.path.join(tmp, "structured.log"))
+
+    print(f"{'legacy':>12}: {legacy:8.1f} us/request on the request thread, "
+          f"{legacy_bytes / args.requests:7.0f} B/request")
+    print(f"{'structured':>12}: {structured:8.1f} us/request on the request thread, "
+          f"{structured_bytes / args.requests:7.0f} B/request")
+    print(f"{'speedup':>12}: {legacy / structured:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
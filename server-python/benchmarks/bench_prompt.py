@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of per-request prompt assembly overhead.
+
+Compares the original per-request path (render market context, concatenate the
+system prompt and construct a GenerativeModel on every request) with
+prompt_builder, which renders once per market snapshot and reuses one model.
+
+Usage (from server-python/):
+    python benchmarks/bench_prompt.py [--iterations 20000]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import google.generativeai as genai  # noqa: E402
+
+import prompt_builder  # noqa: E402
+
+MARKET_DATA = {
+    "indices": {"nifty50": {"c": 22000, "percent_change": 0.67}, "sensex": {"c": 72500, "percent_change": 0.58}},
+    "forex": {"usd_inr": 83.2},
+    "top_gainers": [
+        {"symbol": "RELIANCE.NS", "change_percent": 2.45},
+        {"symbol": "TCS.NS", "change_percent": 1.78},
+        {"symbol": "HDFCBANK.NS", "change_percent": 1.65}
+    ],
+    "top_losers": [
+        {"symbol": "INFY.NS", "change_percent": -1.23},
+        {"symbol": "ICICIBANK.NS", "change_percent": -0.89},
+        {"symbol": "AXISBANK.NS", "change_percent": -0.72}
+    ],
+    "timestamp": "2025-03-23 10:00:00 IST"
+}
+QUERY = "What is the best SIP for a beginner with 5000 rupees a month?"
+
+
+def legacy_request():
+    """The prompt path chat() and stream() each ran before prompt_builder"""
+    market_data = MARKET_DATA
+    market_context = f"""
+Current Indian Market Data ({market_data['timestamp']}):
+- Nifty 50: {market_data['indices']['nifty50']['c']} ({market_data['indices']['nifty50']['percent_change']}%)
+- Sensex: {market_data['indices']['sensex']['c']} ({market_data['indices']['sensex']['percent_change']}%)
+- USD/INR: {market_data['forex']['usd_inr']}
+
+Top Gainers:
+{', '.join([f"{g['symbol']}: +{g['change_percent']}%" for g in market_data['top_gainers']])}
+
+Top Losers:
+{', '.join([f"{loser['symbol']}: {loser['change_percent']}%" for loser in market_data['top_losers']])}
+"""
+    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+    prompt = f"{prompt_builder.DETAILED_PROMPT}\n\n{market_context}\n\nQuery: {QUERY}"
+    return model, prompt
+
+
+def builder_request():
+    context = prompt_builder.get_prompt_context(MARKET_DATA)
+    model = prompt_builder.get_model()
+    prompt = prompt_builder.build_prompt(context, QUERY)
+    return model, prompt
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    assert legacy_request()[1] == builder_request()[1], "prompt layout changed"
+
+    results = {}
+    for name, fn in (("legacy", legacy_request), ("prompt_builder", builder_request)):
+        best = min(timeit.repeat(fn, number=args.iterations, repeat=5))
+        results[name] = best / args.iterations * 1e6
+        print(f"{name:>15}: {results[name]:8.2f} us/request")
+    print(f"{'speedup':>15}: {results['legacy'] / results['prompt_builder']:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
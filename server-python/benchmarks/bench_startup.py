@@ -0,0 +1,144 @@
+"""
+Startup time and per-worker memory of the production server profile.
+
+Measures:
+  - `import app` time in a fresh interpreter, and what google-generativeai would
+    add if it were still imported eagerly
+  - gunicorn (gunicorn.conf.py) time from launch until /ready answers, with and
+    without preloading the app in the master
+  - RSS and PSS (proportional set size: shared pages split between the processes
+    sharing them) of the master and every worker after each worker has served a
+    streamed chat, against the local fake upstreams
+
+Linux only (reads /proc). Usage (from server-python/):
+    python benchmarks/bench_startup.py --workers 4
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_upstreams import FakeUpstreams, Latency  # noqa: E402
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import app
+app_seconds = time.perf_counter() - start
+start = time.perf_counter()
+import google.generativeai
+print(app_seconds, time.perf_counter() - start)
+"""
+
+
+def memory_kb(pid):
+    """(RSS, PSS) of a process in kB"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                if line.startswith(("Rss:", "Pss:")):
+                    key, value = line.split(":", 1)
+                    values[key] = int(value.split()[0])
+    except OSError:
+        return None, None
+    return values.get("Rss"), values.get("Pss")
+
+
+def children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def measure_import(env, runs):
+    app_times, genai_times = [], []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=SERVER_DIR, env=env,
+                             capture_output=True, text=True, check=True).stdout.split()
+        app_times.append(float(out[0]))
+        genai_times.append(float(out[1]))
+    return statistics.median(app_times), statistics.median(genai_times)
+
+
+def measure_server(env, workers, preload, port):
+    env = dict(env, WEB_CONCURRENCY=str(workers), PORT=str(port), GUNICORN_PRELOAD=str(preload).lower())
+    url = f"http://127.0.0.1:{port}"
+    start = time.monotonic()
+    master = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+                              cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                if requests.get(f"{url}/ready", timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            if master.poll() is not None or time.monotonic() - start > 60:
+                raise RuntimeError("gunicorn failed to start")
+            time.sleep(0.02)
+        ready_seconds = time.monotonic() - start
+
+        while len(children(master.pid)) < workers:
+            time.sleep(0.05)
+        # Each request lands on whichever worker accepts it first; send enough that
+        # every worker has loaded the model client and served a stream
+        for n in range(workers * 4):
+            requests.post(f"{url}/stream", json={"chat": f"How should I start investing, take {n}?"},
+                          timeout=30).content
+        time.sleep(0.5)
+        master_mem = memory_kb(master.pid)
+        worker_mem = [memory_kb(pid) for pid in children(master.pid)]
+    finally:
+        master.terminate()
+        master.wait()
+    return ready_seconds, master_mem, worker_mem
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--import-runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=9450)
+    args = parser.parse_args()
+
+    fakes = FakeUpstreams(gemini=Latency(50, 0), chunk_delay_ms=1).start()
+    workdir = tempfile.mkdtemp(prefix="finwise-startup-")
+    env = dict(os.environ, **fakes.app_env())
+    env.update({
+        "MARKET_DATA_SNAPSHOT_PATH": os.path.join(workdir, "market_snapshot.json"),
+        "MARKET_HISTORY_DIR": os.path.join(workdir, "market_history"),
+        "RATE_LIMIT_ENABLED": "false",
+        "RESPONSE_CACHE_ENABLED": "false",
+        "LOG_LEVEL": "WARNING",
+        "FLASK_ENV": "benchmark",
+    })
+    try:
+        app_seconds, genai_seconds = measure_import(env, args.import_runs)
+        print(f"import app: {app_seconds * 1000:.0f} ms "
+              f"(google.generativeai, now deferred to first use: +{genai_seconds * 1000:.0f} ms)")
+        for preload in (True, False):
+            ready, master_mem, worker_mem = measure_server(env, args.workers, preload, args.port)
+            rss = [m[0] for m in worker_mem]
+            pss = [m[1] for m in worker_mem]
+            print(f"\ngunicorn preload={preload} workers={args.workers}: /ready after {ready * 1000:.0f} ms")
+            print(f"  master  rss={master_mem[0]} kB pss={master_mem[1]} kB")
+            print(f"  workers rss={statistics.mean(rss):.0f} kB pss={statistics.mean(pss):.0f} kB (mean per worker)")
+            print(f"  total   pss={master_mem[1] + sum(pss)} kB")
+    finally:
+        fakes.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Local stand-ins for the services FinWise calls, for offline benchmarks and tests.
+
+FakeUpstreams runs:
+  - a threaded HTTP server answering
+        GET /v2/aggs/ticker/<ticker>/prev    polygon.io previous close
+        GET /v6/latest/USD                   open.er-api.com FX rates
+  - a TLS gRPC server implementing GenerativeService.GenerateContent and
+    StreamGenerateContent, so the real google-generativeai client (and its true
+    incremental streaming) is exercised. A throwaway self-signed certificate is
+    generated at start-up and trusted through GRPC_DEFAULT_SSL_ROOTS_FILE_PATH.
+
+Each service has its own latency model (base + uniform jitter, in milliseconds),
+and Gemini streams its answer in chunks with a per-chunk delay. Point the app at
+the fakes with the environment from FakeUpstreams.app_env().
+
+Usage (standalone, from server-python/):
+    python benchmarks/fake_upstreams.py --port 9900 --gemini-latency-ms 300
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from concurrent import futures
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import grpc
+import google.ai.generativelanguage as glm
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+DEFAULT_ANSWER = (
+    "For a beginner, start a monthly SIP in a low-cost Nifty 50 index fund and add a flexi-cap fund "
+    "once you are comfortable. Keep six months of expenses in a liquid fund first, use ELSS if you "
+    "need 80C deductions, and review your allocation once a year rather than reacting to daily moves. "
+    "*This is not personalised financial advice.*\n\n"
+    "📈 How much should I invest each month?\n💰 Is ELSS better than PPF?\n🧾 How is SIP income taxed?"
+)
+GEMINI_SERVICE = "google.ai.generativelanguage.v1beta.GenerativeService"
+
+
+class Latency:
+    """Base delay plus uniform jitter, both in milliseconds"""
+
+    def __init__(self, base_ms=0.0, jitter_ms=0.0, error_rate=0.0):
+        self.base_ms = base_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+
+    def sleep(self):
+        delay = self.base_ms + random.uniform(0, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+
+def _gemini_chunk(text):
+    return glm.GenerateContentResponse(
+        candidates=[glm.Candidate(content=glm.Content(parts=[glm.Part(text=text)], role="model"), index=0)]
+    )
+
+
+def _self_signed_localhost_cert():
+    """PEM (key, certificate) pair valid for "localhost", for the fake gRPC server"""
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=7))
+        .add_extension(x509.SubjectAlternativeName([x509.DNSName("localhost")]), critical=False)
+        .sign(key, hashes.SHA256())
+    )
+    key_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                serialization.NoEncryption())
+    return key_pem, cert.public_bytes(serialization.Encoding.PEM)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        fakes = self.server.fakes
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/v2/aggs/ticker/"):
+            fakes.count("polygon")
+            fakes.polygon.sleep()
+            if fakes.polygon.should_fail():
+                return self._send_json(503, {"status": "ERROR"})
+            close = 22000 + random.uniform(-200, 200)
+            return self._send_json(200, {"results": [{"o": 22000.0, "c": round(close, 2)}], "status": "OK"})
+        if path == "/v6/latest/USD":
+            fakes.count("forex")
+            fakes.forex.sleep()
+            if fakes.forex.should_fail():
+                return self._send_json(503, {"result": "error"})
+            return self._send_json(200, {"result": "success", "rates": {"INR": round(83 + random.random(), 4)}})
+        self._send_json(404, {"error": "not found"})
+
+
+class FakeUpstreams:
+    """Fake polygon.io / er-api (HTTP) and Gemini (gRPC) servers running in the background"""
+
+    def __init__(self, port=0, polygon=None, forex=None, gemini=None, chunk_chars=40,
+                 chunk_delay_ms=20.0, answer=DEFAULT_ANSWER):
+        self.polygon = polygon or Latency()
+        self.forex = forex or Latency()
+        self.gemini = gemini or Latency()
+        self.chunk_chars = chunk_chars
+        self.chunk_delay_ms = chunk_delay_ms
+        self.answer = answer
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._server.fakes = self
+        self._thread = None
+
+        key_pem, cert_pem = _self_signed_localhost_cert()
+        with tempfile.NamedTemporaryFile("wb", suffix=".pem", prefix="finwise-fake-", delete=False) as f:
+            f.write(cert_pem)
+        self.cert_path = f.name
+        self._grpc_server = grpc.server(futures.ThreadPoolExecutor(max_workers=64))
+        self._grpc_server.add_generic_rpc_handlers((grpc.method_handlers_generic_handler(GEMINI_SERVICE, {
+            "GenerateContent": grpc.unary_unary_rpc_method_handler(
+                self._generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize),
+            "StreamGenerateContent": grpc.unary_stream_rpc_method_handler(
+                self._stream_generate_content,
+                request_deserializer=glm.GenerateContentRequest.deserialize,
+                response_serializer=glm.GenerateContentResponse.serialize),
+        }),))
+        self.gemini_port = self._grpc_server.add_secure_port(
+            "localhost:0", grpc.ssl_server_credentials([(key_pem, cert_pem)]))
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _gemini_call(self, context):
+        self.count("gemini")
+        # Time to first token
+        self.gemini.sleep()
+        if self.gemini.should_fail():
+            context.abort(grpc.StatusCode.UNAVAILABLE, "Service unavailable")
+
+    def _generate_content(self, request, context):
+        self._gemini_call(context)
+        time.sleep(self.chunk_delay_ms * (len(self.answer) // self.chunk_chars) / 1000)
+        return _gemini_chunk(self.answer)
+
+    def _stream_generate_content(self, request, context):
+        self._gemini_call(context)
+        answer = self.answer
+        for n, i in enumerate(range(0, len(answer), self.chunk_chars)):
+            if n:
+                time.sleep(self.chunk_delay_ms / 1000)
+            if not context.is_active():
+                self.count("gemini_cancelled")
+                return
+            yield _gemini_chunk(answer[i:i + self.chunk_chars])
+
+    def count(self, service):
+        with self._lock:
+            self.requests[service] = self.requests.get(service, 0) + 1
+
+    def start(self):
+        self._grpc_server.start()
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-upstreams", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._grpc_server.stop(grace=None)
+        os.unlink(self.cert_path)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def app_env(self):
+        """Environment variables that point the FinWise server at this fake"""
+        return {
+            "POLYGON_BASE_URL": self.url,
+            "FOREX_BASE_URL": self.url,
+            "GEMINI_API_ENDPOINT": f"localhost:{self.gemini_port}",
+            "GRPC_DEFAULT_SSL_ROOTS_FILE_PATH": self.cert_path,
+            "GOOGLE_API_KEY": "fake-key",
+            "POLYGON_API_KEY": "fake-key",
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=9900)
+    parser.add_argument("--market-latency-ms", type=float, default=50)
+    parser.add_argument("--market-jitter-ms", type=float, default=50)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300, help="time to first token")
+    parser.add_argument("--gemini-jitter-ms", type=float, default=200)
+    parser.add_argument("--chunk-delay-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that fail")
+    args = parser.parse_args()
+
+    fakes = FakeUpstreams(
+        port=args.port,
+        polygon=Latency(args.market_latency_ms, args.market_jitter_ms, args.error_rate),
+        forex=Latency(args.market_latency_ms, args.market_jitter_ms, args.error_rate),
+        gemini=Latency(args.gemini_latency_ms, args.gemini_jitter_ms, args.error_rate),
+        chunk_delay_ms=args.chunk_delay_ms,
+    )
+    fakes.start()
+    print(f"Fake market data on {fakes.url}, fake Gemini on localhost:{fakes.gemini_port}")
+    for key, value in fakes.app_env().items():
+        print(f"  export {key}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fakes.stop()
+
+
+if __name__ == "__main__":
+    main()
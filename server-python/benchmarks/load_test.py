@@ -0,0 +1,238 @@
+"""
+Offline load test for the FinWise server.
+
+Starts the local fake upstreams (benchmarks/fake_upstreams.py), launches the app in
+one or more worker processes pointed at them, drives /chat, /stream and
+/market-data at a fixed concurrency and reports throughput, latency percentiles,
+time-to-first-byte and memory per worker. Nothing leaves the machine.
+
+Usage (from server-python/):
+    python benchmarks/load_test.py --requests 200 --concurrency 20
+    python benchmarks/load_test.py --endpoints stream --gemini-latency-ms 800 --json results.json
+"""
+import argparse
+import itertools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from fake_upstreams import FakeUpstreams, Latency  # noqa: E402
+
+ENDPOINTS = ("market-data", "chat", "stream")
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def worker_memory_kb(pid):
+    """(current RSS, peak RSS) of a process in kB, from /proc on Linux"""
+    values = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    key, value = line.split(":", 1)
+                    values[key] = int(value.split()[0])
+    except OSError:
+        return None, None
+    return values.get("VmRSS"), values.get("VmHWM")
+
+
+def serve(port):
+    """Run the app on a threaded WSGI server (used for each worker subprocess)"""
+    sys.path.insert(0, SERVER_DIR)
+    from werkzeug.serving import make_server
+    from app import app
+    make_server("127.0.0.1", port, app, threaded=True).serve_forever()
+
+
+def start_workers(count, base_port, env):
+    procs = []
+    for i in range(count):
+        port = base_port + i
+        proc = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--serve-port", str(port)],
+            cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        procs.append((proc, f"http://127.0.0.1:{port}"))
+
+    deadline = time.time() + 30
+    for proc, url in procs:
+        while True:
+            try:
+                if requests.get(f"{url}/ping", timeout=1).status_code == 200:
+                    break
+            except requests.RequestException:
+                pass
+            if proc.poll() is not None or time.time() > deadline:
+                raise RuntimeError(f"Worker at {url} failed to start")
+            time.sleep(0.1)
+    return procs
+
+
+def run_endpoint(endpoint, urls, total, concurrency, unique_queries):
+    """Fire `total` requests at an endpoint; returns a dict of raw samples"""
+    samples = {"latency": [], "ttfb": [], "errors": 0, "bytes": 0}
+    lock = threading.Lock()
+    local = threading.local()
+    counter = itertools.count()
+
+    def one_request(_):
+        n = next(counter)
+        base = urls[n % len(urls)]
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        # Endpoint-specific wording keeps /chat answers from being served to /stream from cache
+        query = {"chat": f"What is a good monthly SIP amount for {endpoint} goal number {n % unique_queries}?"}
+        start = time.perf_counter()
+        ttfb = None
+        try:
+            if endpoint == "market-data":
+                response = session.get(f"{base}/market-data", timeout=30)
+                body = response.content
+            elif endpoint == "chat":
+                response = session.post(f"{base}/chat", json=query, timeout=60)
+                body = response.content
+            else:
+                response = session.post(f"{base}/stream", json=query, timeout=60, stream=True)
+                body = b""
+                for chunk in response.iter_content(chunk_size=None):
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - start
+                    body += chunk
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok, body = False, b""
+        elapsed = time.perf_counter() - start
+        with lock:
+            if not ok:
+                samples["errors"] += 1
+                return
+            samples["latency"].append(elapsed)
+            samples["bytes"] += len(body)
+            if ttfb is not None:
+                samples["ttfb"].append(ttfb)
+
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one_request, range(total)))
+    samples["wall_seconds"] = time.perf_counter() - wall_start
+    return samples
+
+
+def summarize(endpoint, samples):
+    latency = sorted(samples["latency"])
+    ttfb = sorted(samples["ttfb"])
+    ok = len(latency)
+    result = {
+        "endpoint": endpoint,
+        "ok": ok,
+        "errors": samples["errors"],
+        "throughput_rps": round(ok / samples["wall_seconds"], 2) if samples["wall_seconds"] else 0.0,
+        "bytes_per_response": round(samples["bytes"] / ok) if ok else 0,
+    }
+    for q in (0.5, 0.95, 0.99):
+        value = percentile(latency, q)
+        result[f"latency_p{int(q * 100)}_ms"] = round(value * 1000, 1) if value is not None else None
+    for q in (0.5, 0.95, 0.99):
+        value = percentile(ttfb, q)
+        result[f"ttfb_p{int(q * 100)}_ms"] = round(value * 1000, 1) if value is not None else None
+    return result
+
+
+def print_report(results, memory):
+    columns = ["endpoint", "ok", "errors", "throughput_rps", "latency_p50_ms", "latency_p95_ms",
+               "latency_p99_ms", "ttfb_p50_ms", "ttfb_p95_ms", "ttfb_p99_ms"]
+    print("  ".join(f"{c:>15}" for c in columns))
+    for result in results:
+        print("  ".join(f"{str(result[c] if result[c] is not None else '-'):>15}" for c in columns))
+    print()
+    for worker in memory:
+        print(f"worker {worker['url']}: rss={worker['rss_kb']} kB peak={worker['peak_rss_kb']} kB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="comma-separated subset of " +
+                        ", ".join(ENDPOINTS))
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=1, help="app server processes")
+    parser.add_argument("--base-port", type=int, default=9400)
+    parser.add_argument("--unique-queries", type=int, default=0,
+                        help="distinct questions to cycle through (default: all distinct)")
+    parser.add_argument("--no-response-cache", action="store_true")
+    parser.add_argument("--market-latency-ms", type=float, default=50)
+    parser.add_argument("--market-jitter-ms", type=float, default=50)
+    parser.add_argument("--gemini-latency-ms", type=float, default=300, help="fake Gemini time to first token")
+    parser.add_argument("--gemini-jitter-ms", type=float, default=200)
+    parser.add_argument("--chunk-delay-ms", type=float, default=20, help="delay between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls that fail")
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--serve-port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_port:
+        return serve(args.serve_port)
+
+    fakes = FakeUpstreams(
+        polygon=Latency(args.market_latency_ms, args.market_jitter_ms, args.error_rate),
+        forex=Latency(args.market_latency_ms, args.market_jitter_ms, args.error_rate),
+        gemini=Latency(args.gemini_latency_ms, args.gemini_jitter_ms, args.error_rate),
+        chunk_delay_ms=args.chunk_delay_ms,
+    ).start()
+    workdir = tempfile.mkdtemp(prefix="finwise-bench-")
+    env = dict(os.environ, **fakes.app_env())
+    env.update({
+        "MARKET_DATA_SNAPSHOT_PATH": os.path.join(workdir, "market_snapshot.json"),
+        "MARKET_HISTORY_DIR": os.path.join(workdir, "market_history"),
+        "RESPONSE_CACHE_ENABLED": "false" if args.no_response_cache else "true",
+        # One machine drives all the traffic; per-client limits would reject most of it
+        "RATE_LIMIT_ENABLED": "false",
+        "FLASK_ENV": "benchmark",
+    })
+
+    procs = start_workers(args.workers, args.base_port, env)
+    urls = [url for _, url in procs]
+    try:
+        results = []
+        for endpoint in args.endpoints.split(","):
+            samples = run_endpoint(endpoint.strip(), urls, args.requests, args.concurrency,
+                                   args.unique_queries or args.requests)
+            results.append(summarize(endpoint.strip(), samples))
+        memory = []
+        for proc, url in procs:
+            rss, peak = worker_memory_kb(proc.pid)
+            memory.append({"url": url, "rss_kb": rss, "peak_rss_kb": peak})
+    finally:
+        for proc, _ in procs:
+            proc.terminate()
+        for proc, _ in procs:
+            proc.wait()
+        fakes.stop()
+
+    print_report(results, memory)
+    print(f"upstream calls: {fakes.requests}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results, "workers": memory,
+                       "upstream_calls": fakes.requests}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
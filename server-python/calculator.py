@@ -0,0 +1,361 @@
+import os
+import re
+import time
+
+import numpy as np
+
+# Return assumed when a query does not give one (long-run equity mutual fund average)
+DEFAULT_ANNUAL_RETURN = float(os.getenv("CALCULATOR_DEFAULT_RETURN", 12))
+DEFAULT_VOLATILITY = float(os.getenv("CALCULATOR_DEFAULT_VOLATILITY", 15))
+# Monte Carlo simulations are capped at scenarios x months cells so that one
+# request stays within tens of milliseconds on a single core
+MONTE_CARLO_SCENARIOS = int(os.getenv("CALCULATOR_MONTE_CARLO_SCENARIOS", 2000))
+MONTE_CARLO_MAX_CELLS = int(os.getenv("CALCULATOR_MONTE_CARLO_MAX_CELLS", 1_000_000))
+# Longest horizon accepted; beyond this projections are meaningless and overflow
+MAX_YEARS = 100
+
+TAX_YEAR = "FY 2025-26"
+# (upper bound of slab, rate); the last slab is open-ended
+NEW_REGIME_SLABS = [(400000, 0.0), (800000, 0.05), (1200000, 0.10), (1600000, 0.15),
+                    (2000000, 0.20), (2400000, 0.25), (np.inf, 0.30)]
+OLD_REGIME_SLABS = [(250000, 0.0), (500000, 0.05), (1000000, 0.20), (np.inf, 0.30)]
+NEW_REGIME = {"slabs": NEW_REGIME_SLABS, "standard_deduction": 75000, "rebate_limit": 1200000, "rebate_max": 60000,
+              "max_surcharge": 0.25}
+OLD_REGIME = {"slabs": OLD_REGIME_SLABS, "standard_deduction": 50000, "rebate_limit": 500000, "rebate_max": 12500,
+              "max_surcharge": 0.37}
+SURCHARGE = [(5000000, 0.0), (10000000, 0.10), (20000000, 0.15), (50000000, 0.25), (np.inf, 0.37)]
+CESS = 0.04
+
+
+class CalculationError(ValueError):
+    """Raised for missing or out-of-range calculation inputs"""
+
+
+def _monthly_rate(annual_return_pct):
+    return np.asarray(annual_return_pct, dtype=float) / 100 / 12
+
+
+def sip_future_value(monthly, annual_return_pct, years):
+    """
+    Value of a monthly SIP invested at the start of each month. All arguments
+    broadcast, so a grid of amounts, returns and horizons is one call.
+    """
+    monthly = np.asarray(monthly, dtype=float)
+    i = _monthly_rate(annual_return_pct)
+    n = np.round(np.asarray(years, dtype=float) * 12)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = np.where(i == 0, n, ((1 + i) ** n - 1) / np.where(i == 0, 1, i) * (1 + i))
+    return monthly * growth
+
+
+def lumpsum_future_value(amount, annual_return_pct, years):
+    """Value of a one-time investment compounded annually"""
+    return np.asarray(amount, dtype=float) * (1 + np.asarray(annual_return_pct, dtype=float) / 100) ** \
+        np.asarray(years, dtype=float)
+
+
+def required_monthly_sip(target, annual_return_pct, years):
+    """Monthly SIP needed to reach target after years"""
+    return np.asarray(target, dtype=float) / sip_future_value(1.0, annual_return_pct, years)
+
+
+def monte_carlo_sip(monthly, years, annual_return_pct=DEFAULT_ANNUAL_RETURN, volatility_pct=DEFAULT_VOLATILITY,
+                    scenarios=MONTE_CARLO_SCENARIOS, target=None, seed=42):
+    """
+    Distribution of a SIP's final value over random monthly return paths
+    (lognormal, with the given expected annual return and volatility).
+    Returns percentiles and, with a target, the probability of reaching it.
+    """
+    months = int(round(years * 12))
+    if not 0 < months <= MAX_YEARS * 12:
+        raise CalculationError(f"years must be between one month and {MAX_YEARS} years")
+    if not volatility_pct >= 0:
+        raise CalculationError("volatility must not be negative")
+    scenarios = max(1, min(int(scenarios), MONTE_CARLO_MAX_CELLS // months))
+    sigma = volatility_pct / 100 / np.sqrt(12)
+    mu = np.log(1 + annual_return_pct / 100) / 12 - sigma ** 2 / 2
+    rng = np.random.default_rng(seed)
+    growth = np.exp(rng.normal(mu, sigma, size=(scenarios, months)))
+    # A contribution made in month t grows by every month's return from t to the end:
+    # the reversed cumulative product gives that factor for all t at once
+    factors = np.cumprod(growth[:, ::-1], axis=1)
+    final = monthly * factors.sum(axis=1)
+    p10, p50, p90 = np.percentile(final, [10, 50, 90])
+    result = {
+        "scenarios": scenarios,
+        "months": months,
+        "invested": monthly * months,
+        "p10": float(p10),
+        "median": float(p50),
+        "p90": float(p90),
+        "mean": float(final.mean()),
+    }
+    if target is not None:
+        result["probability_of_target"] = float((final >= target).mean())
+    return result
+
+
+def _slab_tax(taxable, slabs):
+    taxable = np.asarray(taxable, dtype=float)[..., None]
+    uppers = np.array([upper for upper, _ in slabs])
+    lowers = np.concatenate(([0.0], uppers[:-1]))
+    rates = np.array([rate for _, rate in slabs])
+    return (np.clip(taxable - lowers, 0, uppers - lowers) * rates).sum(axis=-1)
+
+
+def income_tax(income, regime="new", deductions=0.0):
+    """
+    Income tax for salaried individuals under 60 for TAX_YEAR, vectorised over
+    incomes: slab tax after the standard deduction (and, in the old regime, other
+    deductions such as 80C/80D), section 87A rebate, surcharge and 4% cess.
+    Marginal relief on the rebate and surcharge thresholds is not applied.
+    """
+    rules = NEW_REGIME if regime == "new" else OLD_REGIME
+    income = np.asarray(income, dtype=float)
+    deductions = 0.0 if regime == "new" else np.asarray(deductions, dtype=float)
+    taxable = np.maximum(income - rules["standard_deduction"] - deductions, 0)
+    tax = _slab_tax(taxable, rules["slabs"])
+    tax = np.where(taxable <= rules["rebate_limit"], np.maximum(tax - rules["rebate_max"], 0), tax)
+    surcharge_rate = np.minimum(_surcharge_rate(taxable), rules["max_surcharge"])
+    total = tax * (1 + surcharge_rate) * (1 + CESS)
+    return {"taxable_income": taxable, "tax": np.round(total)}
+
+
+def _surcharge_rate(taxable):
+    uppers = np.array([upper for upper, _ in SURCHARGE])
+    rates = np.array([rate for _, rate in SURCHARGE])
+    return rates[np.searchsorted(uppers, taxable, side="left")]
+
+
+def compare_regimes(income, deductions=0.0):
+    new = income_tax(income, "new")
+    old = income_tax(income, "old", deductions)
+    return {
+        "tax_year": TAX_YEAR,
+        "income": float(income),
+        "new_regime_tax": float(new["tax"]),
+        "old_regime_tax": float(old["tax"]),
+        "better": "new" if new["tax"] <= old["tax"] else "old",
+        "saving": float(abs(new["tax"] - old["tax"])),
+    }
+
+
+def _required(params, *names):
+    try:
+        values = [float(params[name]) for name in names]
+    except KeyError as e:
+        raise CalculationError(f"Missing parameter: {e.args[0]}")
+    except (TypeError, ValueError):
+        raise CalculationError(f"Parameters {', '.join(names)} must be numbers")
+    if not all(np.isfinite(values)):
+        raise CalculationError(f"Parameters {', '.join(names)} must be finite numbers")
+    return values
+
+
+def _check_finite(result):
+    """Reject results that overflowed, which JSON cannot represent"""
+    for value in result.values():
+        if isinstance(value, dict):
+            _check_finite(value)
+        elif isinstance(value, (int, float)) and not np.isfinite(value):
+            raise CalculationError("Inputs are too large to calculate")
+
+
+def _run(kind, params, rate):
+    if kind == "sip":
+        monthly, years = _required(params, "monthly", "years")
+        value = float(sip_future_value(monthly, rate, years))
+        result = {"invested": monthly * round(years * 12), "future_value": value}
+    elif kind == "lumpsum":
+        amount, years = _required(params, "amount", "years")
+        result = {"invested": amount, "future_value": float(lumpsum_future_value(amount, rate, years))}
+    elif kind == "compare":
+        # The same total invested either up front or spread over monthly SIPs
+        amount, years = _required(params, "amount", "years")
+        monthly = amount / round(years * 12)
+        result = {
+            "invested": amount,
+            "lumpsum_value": float(lumpsum_future_value(amount, rate, years)),
+            "sip_monthly": monthly,
+            "sip_value": float(sip_future_value(monthly, rate, years)),
+        }
+    elif kind == "goal":
+        target, years = _required(params, "target", "years")
+        result = {"target": target, "monthly_sip": float(required_monthly_sip(target, rate, years))}
+    elif kind == "monte_carlo":
+        monthly, years = _required(params, "monthly", "years")
+        options = {"volatility": DEFAULT_VOLATILITY, "scenarios": MONTE_CARLO_SCENARIOS}
+        options.update(params)
+        volatility, scenarios = _required(options, "volatility", "scenarios")
+        target = _required(params, "target")[0] if params.get("target") is not None else None
+        result = monte_carlo_sip(monthly, years, rate, volatility, scenarios, target)
+    elif kind == "tax":
+        income, deductions = _required(dict({"deductions": 0}, **params), "income", "deductions")
+        result = compare_regimes(income, deductions)
+    else:
+        raise CalculationError("type must be one of sip, lumpsum, compare, goal, monte_carlo, tax")
+    return result
+
+
+def calculate(params):
+    """Run one calculation described by a /calculate request body"""
+    if not isinstance(params, dict):
+        raise CalculationError("Request body must be a JSON object")
+    kind = params.get("type")
+    (rate,) = _required(dict(params, annual_return=params.get("annual_return", DEFAULT_ANNUAL_RETURN)),
+                        "annual_return")
+    # Horizons are counted in whole months; less than half a month rounds to none
+    if "years" in params and not 0 < round(_required(params, "years")[0] * 12) <= MAX_YEARS * 12:
+        raise CalculationError(f"years must be between one month and {MAX_YEARS} years")
+    start = time.perf_counter()
+    # Overflow is reported as a CalculationError below rather than as numpy warnings
+    with np.errstate(over="ignore", invalid="ignore"):
+        result = _run(kind, params, rate)
+    _check_finite(result)
+    if kind != "tax":
+        result["annual_return"] = rate
+    result["type"] = kind
+    result["compute_ms"] = round((time.perf_counter() - start) * 1000, 3)
+    return result
+
+
+# Parsing figures out of chat messages
+
+_UNITS = {"k": 1e3, "thousand": 1e3, "lakh": 1e5, "lakhs": 1e5, "lac": 1e5, "lacs": 1e5, "l": 1e5,
+          "crore": 1e7, "crores": 1e7, "cr": 1e7}
+_AMOUNT = re.compile(
+    r"(?:₹|rs\.?|inr)?\s*(\d[\d,]*(?:\.\d+)?)\s*(k|thousand|lakhs?|lacs?|l|crores?|cr)?\b(?!\s*(?:%|years?|yrs?))",
+    re.IGNORECASE
+)
+_RATE = re.compile(r"(\d+(?:\.\d+)?)\s*(?:%|percent)", re.IGNORECASE)
+_YEARS = re.compile(r"(\d+(?:\.\d+)?)\s*(?:years?|yrs?)\b", re.IGNORECASE)
+_MONTHLY = re.compile(r"\b(monthly|per month|a month|every month|pm)\b|/month", re.IGNORECASE)
+_SIP = re.compile(r"\bsips?\b", re.IGNORECASE)
+_GOAL = re.compile(r"\b(corpus|goal|target|accumulate|reach)\b", re.IGNORECASE)
+_TAX = re.compile(r"\b(tax|regime|slab)\b", re.IGNORECASE)
+_INCOME = re.compile(r"\b(income|salary|ctc|earn|earning|regime)\b", re.IGNORECASE)
+_LUMPSUM = re.compile(r"\b(lump\s?sum|one[- ]time|at once)\b", re.IGNORECASE)
+
+
+def _amounts(text):
+    amounts = []
+    for match in _AMOUNT.finditer(text):
+        value = float(match.group(1).replace(",", ""))
+        unit = (match.group(2) or "").lower()
+        value *= _UNITS.get(unit, 1)
+        # Bare small numbers are usually counts or ages, not rupee amounts
+        if value >= 500:
+            amounts.append(value)
+    return amounts
+
+
+def parse_query(text):
+    """
+    Pull the numbers a calculation needs out of a chat message. Returns a
+    /calculate request body, or None if the message is not a calculation.
+    """
+    rate_match = _RATE.search(text)
+    years_match = _YEARS.search(text)
+    amounts = _amounts(_RATE.sub(" ", _YEARS.sub(" ", text)))
+    params = {}
+    if rate_match:
+        params["annual_return"] = float(rate_match.group(1))
+
+    if _TAX.search(text) and _INCOME.search(text) and amounts:
+        return dict(params, type="tax", income=max(amounts))
+    if not amounts or not years_match:
+        return None
+    params["years"] = float(years_match.group(1))
+    if not 0 < params["years"] <= MAX_YEARS:
+        return None
+    monthly = _MONTHLY.search(text) or _SIP.search(text)
+    if _GOAL.search(text):
+        if monthly and len(amounts) >= 2:
+            # "I invest 10k a month, will I reach 1 crore in 20 years?"
+            return dict(params, type="monte_carlo", monthly=min(amounts), target=max(amounts))
+        return dict(params, type="goal", target=max(amounts))
+    if _LUMPSUM.search(text) and monthly:
+        return dict(params, type="compare", amount=max(amounts))
+    if monthly:
+        return dict(params, type="sip", monthly=amounts[0])
+    return dict(params, type="lumpsum", amount=amounts[0])
+
+
+def format_inr(value):
+    """Rupees with Indian digit grouping, e.g. 1161695.4 -> ₹11,61,695"""
+    digits = str(int(round(abs(value))))
+    if len(digits) > 3:
+        head, tail = digits[:-3], digits[-3:]
+        groups = []
+        while len(head) > 2:
+            groups.insert(0, head[-2:])
+            head = head[:-2]
+        digits = ",".join(([head] if head else []) + groups) + "," + tail
+    return ("-" if value < 0 else "") + "₹" + digits
+
+
+def describe(result):
+    """One-line summary of a calculate() result"""
+    kind = result["type"]
+    rate = result.get("annual_return")
+    if kind == "sip":
+        return (f"SIP at {rate}% p.a.: {format_inr(result['invested'])} invested grows to "
+                f"{format_inr(result['future_value'])}")
+    if kind == "lumpsum":
+        return (f"Lumpsum of {format_inr(result['invested'])} at {rate}% p.a. grows to "
+                f"{format_inr(result['future_value'])}")
+    if kind == "compare":
+        return (f"{format_inr(result['invested'])} at {rate}% p.a.: lumpsum grows to "
+                f"{format_inr(result['lumpsum_value'])}; the same amount as a SIP of "
+                f"{format_inr(result['sip_monthly'])}/month grows to {format_inr(result['sip_value'])}")
+    if kind == "goal":
+        return (f"To reach {format_inr(result['target'])} at {rate}% p.a. you need a monthly SIP of "
+                f"{format_inr(result['monthly_sip'])}")
+    if kind == "tax":
+        return (f"{result['tax_year']} tax on income of {format_inr(result['income'])} (salaried, standard "
+                f"deduction, no other deductions): new regime {format_inr(result['new_regime_tax'])}, old regime "
+                f"{format_inr(result['old_regime_tax'])}; the {result['better']} regime saves "
+                f"{format_inr(result['saving'])}")
+    if kind == "monte_carlo":
+        line = (f"Across {result['scenarios']} simulated markets ({rate}% p.a. expected return): "
+                f"{format_inr(result['invested'])} invested ends at a median of {format_inr(result['median'])}, "
+                f"10th-90th percentile {format_inr(result['p10'])} to {format_inr(result['p90'])}")
+        if "probability_of_target" in result:
+            line += f"; {result['probability_of_target']:.0%} chance of reaching the target"
+        return line
+    return ""
+
+
+def figure_lines(params):
+    """
+    Summary lines for a parsed query. Years-based SIP questions also get a Monte
+    Carlo range so one assumed return is not presented as certain.
+    """
+    try:
+        lines = [describe(calculate(params))]
+        if params["type"] == "sip":
+            lines.append(describe(calculate(dict(params, type="monte_carlo"))))
+    except (CalculationError, ValueError, ZeroDivisionError, OverflowError):
+        return []
+    return lines
+
+
+def assumed_return_note(params):
+    """Parenthetical naming the default return, if the query did not give one"""
+    if "annual_return" in params or params["type"] == "tax":
+        return ""
+    return f" ({DEFAULT_ANNUAL_RETURN}% p.a. return assumed)"
+
+
+def figures_for_query(text):
+    """
+    Exact figures for a numeric question, as a prompt section for the model, or ""
+    when the message is not a calculation.
+    """
+    params = parse_query(text)
+    lines = figure_lines(params) if params is not None else []
+    if not lines:
+        return ""
+    body = "\n".join(f"- {line}" for line in lines)
+    return (f"Precomputed figures{assumed_return_note(params)}. "
+            f"Use these exact numbers rather than recalculating:\n{body}\n\n")
@@ -0,0 +1,231 @@
+import os
+import logging
+import threading
+
+import metrics
+import response_cache
+
+logger = logging.getLogger(__name__)
+
+# Share one upstream generation between identical requests that arrive while it is running
+COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() == "true"
+
+metrics.COUNTERS["finwise_coalesced_requests_total"] = \
+    "Requests answered by joining an identical generation already in flight, by endpoint"
+
+_lock = threading.Lock()
+_flights = {}  # key -> Flight
+
+
+class FlightAbandoned(Exception):
+    """Raised to a waiter if every consumer left and the shared generation was cancelled"""
+
+
+class Flight:
+    """
+    One upstream generation fanned out to every request asking the same question.
+
+    The leader either publishes the whole answer itself (finish/fail) or hands over
+    a streaming source with set_source. Chunks are pulled from the source by
+    whichever consumer is furthest ahead, so the model is read no faster than the
+    fastest client, every consumer sees every chunk from the start, and when the
+    last consumer leaves early the upstream call is cancelled.
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.cancelled = False
+        self.consumers = 0
+        self._source = None
+        self._on_cancel = None
+        self._pulling = False
+        self._callbacks = []
+        self._cond = threading.Condition()
+
+    # Leader side
+
+    def set_source(self, chunks, on_cancel=None):
+        """Stream the answer from an iterator of text chunks; on_cancel aborts the upstream call"""
+        with self._cond:
+            self._source = iter(chunks)
+            self._on_cancel = on_cancel
+            self._cond.notify_all()
+
+    def add_done_callback(self, fn):
+        """Call fn(flight) once, when the flight finishes, fails or is cancelled"""
+        with self._cond:
+            if not (self.done or self.cancelled):
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def publish(self, chunk):
+        with self._cond:
+            self.chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self):
+        self._close(None)
+
+    def fail(self, error):
+        self._close(error)
+
+    def _close(self, error):
+        with self._cond:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+        _forget(self)
+        self._run_callbacks()
+
+    def _run_callbacks(self):
+        with self._cond:
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            try:
+                fn(self)
+            except Exception as e:
+                logger.error(f"Error in flight callback: {str(e)}", exc_info=True)
+
+    def text(self):
+        with self._cond:
+            return "".join(self.chunks)
+
+    # Consumer side
+
+    def detach(self):
+        """
+        Unregister a consumer. When the last one leaves before the generation is done,
+        the flight is cancelled and the upstream call aborted.
+        """
+        with _lock:
+            self.consumers -= 1
+            if self.consumers > 0 or self.done:
+                return
+            self.cancelled = True
+            if _flights.get(self.key) is self:
+                del _flights[self.key]
+        with self._cond:
+            on_cancel = self._on_cancel
+            self._cond.notify_all()
+        if on_cancel is not None:
+            on_cancel()
+        self._run_callbacks()
+
+    def wait_started(self, timeout):
+        """Block until a source or chunk is available, or the flight ends; returns False on timeout"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._source is not None or self.chunks or self.done or self.cancelled, timeout
+            )
+
+    def _pull(self):
+        # The caller set _pulling; only one consumer reads the source at a time
+        try:
+            chunk = next(self._source)
+        except StopIteration:
+            chunk = None
+            self.finish()
+        except Exception as e:
+            chunk = None
+            self.fail(e)
+        with self._cond:
+            if chunk is not None:
+                self.chunks.append(chunk)
+            self._pulling = False
+            self._cond.notify_all()
+
+    def subscribe(self):
+        """Yield every chunk from the start, then new ones as they arrive"""
+        sent = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self.chunks) > sent or self.done or self.cancelled or
+                                    (self._source is not None and not self._pulling))
+                pending = self.chunks[sent:]
+                done, error, cancelled = self.done, self.error, self.cancelled
+                pull = not pending and not done and not cancelled
+                if pull:
+                    self._pulling = True
+            if pull:
+                self._pull()
+                continue
+            for chunk in pending:
+                yield chunk
+            sent += len(pending)
+            if pending:
+                continue
+            if error is not None:
+                raise error
+            if cancelled and not done:
+                raise FlightAbandoned("Shared generation was cancelled")
+            if done:
+                return
+
+    def result(self, timeout):
+        """The whole answer, or None if it is not complete within timeout"""
+        if not self.wait_started(timeout):
+            return None
+        with self._cond:
+            streaming = self._source is not None
+        if streaming:
+            # Help read the stream; the upstream call carries its own deadline
+            return "".join(self.subscribe())
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.done or self.cancelled, timeout):
+                return None
+            if self.error is not None:
+                raise self.error
+            if not self.done:
+                raise FlightAbandoned("Shared generation was cancelled")
+            return "".join(self.chunks)
+
+
+def flight_key(query, version, variant):
+    """Requests with the same key would send the same prompt to the model"""
+    return f"{version}\0{variant}\0{response_cache.normalize_query(query)}"
+
+
+def join(key, endpoint):
+    """
+    Return (flight, is_leader). The leader must run the generation and finish, fail
+    or set_source on the flight; everyone else consumes it. The caller counts as a
+    consumer until it calls detach().
+    """
+    if not COALESCE_ENABLED:
+        flight = Flight(key)
+        flight.consumers = 1
+        return flight, True
+    with _lock:
+        flight = _flights.get(key)
+        if flight is not None and not flight.cancelled:
+            flight.consumers += 1
+            metrics.inc("finwise_coalesced_requests_total", endpoint=endpoint)
+            return flight, False
+        flight = _flights[key] = Flight(key)
+        flight.consumers = 1
+        return flight, True
+
+
+def _forget(flight):
+    with _lock:
+        if _flights.get(flight.key) is flight:
+            del _flights[flight.key]
+
+
+def in_flight():
+    with _lock:
+        return len(_flights)
+
+
+def _collect_metrics():
+    yield ("finwise_coalescing_flights", "gauge", "Distinct generations currently shared between requests",
+           {}, in_flight())
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,129 @@
+import os
+import zlib
+
+import metrics
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Negotiated response compression (Accept-Encoding), instead of shortening answers for mobile
+COMPRESSION_ENABLED = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+# Smaller bodies are sent as-is; headers and framing would eat the saving
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 512))
+GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", 6))
+# Brotli quality for whole bodies, and for streams where each chunk is flushed as it is written
+BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", 5))
+BROTLI_STREAM_QUALITY = int(os.getenv("COMPRESSION_BROTLI_STREAM_QUALITY", 4))
+
+_COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+metrics.COUNTERS["finwise_compression_input_bytes_total"] = "Response bytes before compression, by encoding"
+metrics.COUNTERS["finwise_compression_output_bytes_total"] = "Response bytes sent after compression, by encoding"
+
+
+def supported_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def negotiate(accept_encoding):
+    """
+    The encoding to use for a request's Accept-Encoding header: "br", "gzip" or
+    None. Brotli is preferred when the client accepts both with equal weight.
+    """
+    if not COMPRESSION_ENABLED or not accept_encoding:
+        return None
+    weights = {}
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    best, best_weight = None, 0.0
+    for encoding in supported_encodings():
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+def compress(data, encoding):
+    """Compress a whole body"""
+    if encoding == "br":
+        out = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        # wbits 31: gzip container
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        out = compressor.compress(data) + compressor.flush()
+    metrics.inc("finwise_compression_input_bytes_total", len(data), encoding=encoding)
+    metrics.inc("finwise_compression_output_bytes_total", len(out), encoding=encoding)
+    return out
+
+
+def compress_response(response, accept_encoding):
+    """
+    Compress a buffered response in place if the client accepts it and the body is
+    worth compressing. Streamed responses are left to compress_stream.
+    """
+    response.vary.add("Accept-Encoding")
+    if (response.is_streamed or response.direct_passthrough or response.status_code != 200 or
+            "Content-Encoding" in response.headers or not response.mimetype.startswith(_COMPRESSIBLE_TYPES)):
+        return response
+    encoding = negotiate(accept_encoding)
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_BYTES:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+def compress_stream(chunks, encoding):
+    """
+    Compress a chunk iterator for a streamed response. Every chunk is flushed as
+    soon as it is compressed, so the client sees each piece of the answer when it
+    is generated rather than when the compressor's buffer fills.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=BROTLI_STREAM_QUALITY)
+
+        def encode(data):
+            return compressor.process(data) + compressor.flush()
+
+        def finish():
+            return compressor.finish()
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+        def encode(data):
+            return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+        def finish():
+            return compressor.flush()
+
+    bytes_in = bytes_out = 0
+    try:
+        for chunk in chunks:
+            data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            out = encode(data)
+            bytes_in += len(data)
+            bytes_out += len(out)
+            yield out
+        out = finish()
+        bytes_out += len(out)
+        yield out
+    finally:
+        # Closing this generator (client disconnect) must reach the wrapped one
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+        metrics.inc("finwise_compression_input_bytes_total", bytes_in, encoding=encoding)
+        metrics.inc("finwise_compression_output_bytes_total", bytes_out, encoding=encoding)
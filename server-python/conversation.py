@@ -0,0 +1,164 @@
+import os
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Token budget for the whole conversation section of the prompt, of which at most
+# SUMMARY_TOKEN_BUDGET goes to the running summary of older turns
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 1024))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("HISTORY_SUMMARY_TOKEN_BUDGET", 256))
+# Most recent turns that are kept word for word while they fit the budget
+RECENT_TURNS = int(os.getenv("HISTORY_RECENT_TURNS", 6))
+# Number of conversations whose running summary is kept in memory
+MAX_CACHED_SUMMARIES = int(os.getenv("HISTORY_MAX_CACHED_SUMMARIES", 10000))
+# Longest single turn, in characters, that is read from the request
+MAX_TURN_CHARS = 4000
+SUMMARY_WORDS_PER_TURN = 25
+
+ROLE_LABELS = {"user": "User", "model": "FinWise"}
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+# conversation_id -> (turns summarized, digest of last summarized turn, summary lines)
+_summaries = OrderedDict()
+_summaries_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate (~4 characters per token for Gemini on English text)"""
+    return (len(text) + 3) // 4
+
+
+def turn_text(turn):
+    """Text of a history item in the Gemini {role, parts: [{text}]} format the client sends"""
+    if not isinstance(turn, dict):
+        return ""
+    if "parts" in turn:
+        text = " ".join(part.get("text", "") for part in turn["parts"] if isinstance(part, dict))
+    else:
+        text = turn.get("content", "")
+    return str(text)[:MAX_TURN_CHARS].strip()
+
+
+def history_error(history):
+    """Why a request's history is malformed, or None if it is usable"""
+    if history is None:
+        return None
+    if not isinstance(history, list):
+        return "history must be a list"
+    for turn in history:
+        if not isinstance(turn, dict):
+            return "history items must be objects"
+        if "parts" in turn:
+            parts = turn["parts"]
+            if not isinstance(parts, list) or not all(
+                    isinstance(part, dict) and isinstance(part.get("text", ""), str) for part in parts):
+                return "history parts must be a list of objects with a text string"
+        elif not isinstance(turn.get("content", ""), str):
+            return "history content must be a string"
+    return None
+
+
+def _turn_digest(turn):
+    return hashlib.sha1(f"{turn.get('role')}\0{turn_text(turn)}".encode("utf-8")).hexdigest()
+
+
+def conversation_key(history, conversation_id=None):
+    """
+    Identify a conversation across requests. Clients may send a conversation_id;
+    otherwise the first turn is used, since history only ever grows at the end.
+    """
+    if conversation_id:
+        return str(conversation_id)
+    return _turn_digest(history[0]) if history else None
+
+
+def _summarize_turn(turn):
+    """One-line extractive summary: the first sentence of the turn, capped in length"""
+    text = " ".join(turn_text(turn).split())
+    first_sentence = _SENTENCE_END.split(text, 1)[0]
+    words = first_sentence.split()
+    if len(words) > SUMMARY_WORDS_PER_TURN:
+        first_sentence = " ".join(words[:SUMMARY_WORDS_PER_TURN]) + "..."
+    label = ROLE_LABELS.get(turn.get("role"), "User")
+    return f"- {label}: {first_sentence}"
+
+
+def _fit_summary(lines):
+    """Drop the oldest summary lines until the summary fits SUMMARY_TOKEN_BUDGET"""
+    total = sum(estimate_tokens(line) + 1 for line in lines)
+    start = 0
+    while total > SUMMARY_TOKEN_BUDGET and start < len(lines):
+        total -= estimate_tokens(lines[start]) + 1
+        start += 1
+    return lines[start:]
+
+
+def _summary_for(key, older_turns):
+    """
+    Summary lines for older_turns, extending the cached summary for this conversation
+    with only the turns that have aged out since the previous request.
+    """
+    with _summaries_lock:
+        cached = _summaries.get(key)
+        if cached is not None:
+            _summaries.move_to_end(key)
+
+    count, lines = 0, []
+    if cached is not None:
+        cached_count, cached_digest, cached_lines = cached
+        # Reuse the cached summary only if the turn it ended on is still in the same
+        # place, i.e. the client has not deleted earlier messages since
+        if 0 < cached_count <= len(older_turns) and _turn_digest(older_turns[cached_count - 1]) == cached_digest:
+            count, lines = cached_count, list(cached_lines)
+
+    if count < len(older_turns):
+        lines.extend(_summarize_turn(turn) for turn in older_turns[count:])
+        lines = _fit_summary(lines)
+
+    if older_turns:
+        with _summaries_lock:
+            _summaries[key] = (len(older_turns), _turn_digest(older_turns[-1]), tuple(lines))
+            _summaries.move_to_end(key)
+            while len(_summaries) > MAX_CACHED_SUMMARIES:
+                _summaries.popitem(last=False)
+    return lines
+
+
+def build_history_section(history, conversation_id=None):
+    """
+    Render the conversation so far as a prompt section bounded by HISTORY_TOKEN_BUDGET.
+    Recent turns are kept verbatim; older turns are folded into a running summary.
+    Returns "" for a new conversation.
+    """
+    turns = [turn for turn in (history or []) if turn_text(turn)]
+    if not turns:
+        return ""
+
+    key = conversation_key(turns, conversation_id)
+    budget = HISTORY_TOKEN_BUDGET
+
+    # Walk back from the newest turn, keeping whole turns verbatim while they fit in
+    # what is left after reserving room for the summary
+    recent = []
+    remaining = budget - SUMMARY_TOKEN_BUDGET
+    for turn in reversed(turns[-RECENT_TURNS:]):
+        line = f"{ROLE_LABELS.get(turn.get('role'), 'User')}: {turn_text(turn)}"
+        cost = estimate_tokens(line) + 1
+        if cost > remaining:
+            break
+        recent.append(line)
+        remaining -= cost
+    recent.reverse()
+
+    older_turns = turns[:len(turns) - len(recent)]
+    summary = _summary_for(key, older_turns) if older_turns else []
+
+    section = ["Conversation so far:"]
+    if summary:
+        section.append("Summary of earlier messages:")
+        section.extend(summary)
+    if recent:
+        section.append("Most recent messages:")
+        section.extend(recent)
+    return "\n".join(section) + "\n\n"
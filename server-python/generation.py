@@ -0,0 +1,269 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from contextlib import contextmanager
+
+import metrics
+import upstream
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of concurrent generations per endpoint. A request that cannot get
+# a slot within ENDPOINT_QUEUE_WAIT_SECONDS is rejected instead of piling up.
+ENDPOINT_LIMITS = {
+    "chat": int(os.getenv("FINWISE_CHAT_CONCURRENCY", 16)),
+    "stream": int(os.getenv("FINWISE_STREAM_CONCURRENCY", 16)),
+}
+ENDPOINT_QUEUE_WAIT_SECONDS = float(os.getenv("FINWISE_QUEUE_WAIT_SECONDS", 2))
+# Requests allowed to wait for a slot per endpoint, and per client within that;
+# beyond these a request is turned away immediately
+ENDPOINT_MAX_WAITING = int(os.getenv("FINWISE_MAX_WAITING", 32))
+CLIENT_MAX_WAITING = int(os.getenv("FINWISE_CLIENT_MAX_WAITING", 2))
+
+# Priority classes for waiting requests, lowest value served first. Mobile requests
+# run on a shorter deadline, so they get free slots ahead of desktop ones.
+PRIORITY_CLASSES = {"mobile": 0, "desktop": 1}
+
+# Extra attempts for a non-streaming generation that failed with a transient server error
+GEMINI_RETRIES = int(os.getenv("GEMINI_RETRIES", 1))
+GEMINI_RETRY_MIN_SECONDS = 2.0  # not worth retrying with less of the deadline left
+
+metrics.COUNTERS["finwise_generation_retries_total"] = "Gemini generations retried after a transient error"
+
+# Shared by every request in the process; sized so each endpoint can use its full limit
+EXECUTOR_WORKERS = int(os.getenv("FINWISE_GENERATION_WORKERS", sum(ENDPOINT_LIMITS.values())))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class GenerationRejected(Exception):
+    """Raised when an endpoint is already running its maximum number of generations"""
+
+
+class ClientBusy(GenerationRejected):
+    """Raised when one client already has its share of requests waiting for a slot"""
+
+
+class GenerationTimeout(Exception):
+    """Raised when a generation does not finish within its deadline"""
+
+
+class ModelUnavailable(GenerationRejected):
+    """Raised without calling Gemini while its circuit breaker is open"""
+
+
+def get_executor():
+    """Return the process-wide generation executor, creating it on first use"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS,
+                                               thread_name_prefix="generation")
+    return _executor
+
+
+class FairSlots:
+    """
+    Bounded pool of generation slots with a fair wait queue. Waiting requests are
+    grouped by priority class, then by client; a freed slot goes to the highest
+    priority class and, within it, round-robin across clients, so one client
+    sending many requests cannot starve the others.
+    """
+
+    def __init__(self, limit, max_waiting=ENDPOINT_MAX_WAITING, client_max_waiting=CLIENT_MAX_WAITING):
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.client_max_waiting = client_max_waiting
+        self.active = 0
+        self.waiting = 0
+        self._lock = threading.Lock()
+        # priority -> OrderedDict(client -> deque of waiters); a waiter is [Event, granted]
+        self._queues = {}
+
+    def acquire(self, client=None, priority=0, timeout=ENDPOINT_QUEUE_WAIT_SECONDS):
+        """Take a slot, waiting up to timeout; raises GenerationRejected or ClientBusy"""
+        with self._lock:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return
+            if self.waiting >= self.max_waiting:
+                raise GenerationRejected("Wait queue is full")
+            clients = self._queues.setdefault(priority, OrderedDict())
+            queue = clients.setdefault(client, deque())
+            if len(queue) >= self.client_max_waiting:
+                if not queue:
+                    del clients[client]
+                raise ClientBusy("Too many queued requests from this client")
+            waiter = [threading.Event(), False]
+            queue.append(waiter)
+            self.waiting += 1
+
+        waiter[0].wait(timeout)
+        with self._lock:
+            if waiter[1]:
+                return
+            # Timed out: leave the queue
+            queue.remove(waiter)
+            self.waiting -= 1
+            if not queue and clients.get(client) is queue:
+                del clients[client]
+        raise GenerationRejected(f"No generation slot within {timeout} seconds")
+
+    def release(self):
+        with self._lock:
+            for priority in sorted(self._queues):
+                clients = self._queues[priority]
+                if not clients:
+                    continue
+                client, queue = next(iter(clients.items()))
+                waiter = queue.popleft()
+                # Round-robin: the client goes to the back of its class
+                del clients[client]
+                if queue:
+                    clients[client] = queue
+                self.waiting -= 1
+                # The slot passes straight to the waiter, so active is unchanged
+                waiter[1] = True
+                waiter[0].set()
+                return
+            self.active -= 1
+
+
+_slots = {endpoint: FairSlots(limit) for endpoint, limit in ENDPOINT_LIMITS.items()}
+
+
+def acquire_slot(endpoint, client=None, priority_class="desktop"):
+    """
+    Reserve a generation slot for an endpoint and return a callable that releases it.
+    Raises GenerationRejected if the wait queue is full or no slot frees up within
+    ENDPOINT_QUEUE_WAIT_SECONDS, and ClientBusy if this client already has
+    CLIENT_MAX_WAITING requests waiting.
+    """
+    slots = _slots[endpoint]
+    try:
+        slots.acquire(client, PRIORITY_CLASSES.get(priority_class, max(PRIORITY_CLASSES.values())))
+    except ClientBusy:
+        metrics.inc("finwise_generation_rejected_total", endpoint=endpoint, reason="client_busy")
+        raise
+    except GenerationRejected:
+        metrics.inc("finwise_generation_rejected_total", endpoint=endpoint, reason="busy")
+        raise
+
+    released = threading.Event()
+
+    def release():
+        # Safe to call more than once (e.g. from both an error path and on_close)
+        if released.is_set():
+            return
+        released.set()
+        slots.release()
+
+    return release
+
+
+@contextmanager
+def generation_slot(endpoint, client=None, priority_class="desktop"):
+    """Context manager form of acquire_slot"""
+    release = acquire_slot(endpoint, client, priority_class)
+    try:
+        yield
+    finally:
+        release()
+
+
+def in_flight():
+    """Snapshot of the number of running generations per endpoint"""
+    return {endpoint: slots.active for endpoint, slots in _slots.items()}
+
+
+def waiting():
+    """Snapshot of the number of requests waiting for a slot per endpoint"""
+    return {endpoint: slots.waiting for endpoint, slots in _slots.items()}
+
+
+def _collect_metrics():
+    queued = waiting()
+    for endpoint, count in in_flight().items():
+        yield ("finwise_generations_in_flight", "gauge", "Gemini generations currently running, by endpoint",
+               {"endpoint": endpoint}, count)
+        yield ("finwise_generation_slots", "gauge", "Concurrent generation limit, by endpoint",
+               {"endpoint": endpoint}, ENDPOINT_LIMITS[endpoint])
+        yield ("finwise_generation_waiting", "gauge", "Requests waiting for a generation slot, by endpoint",
+               {"endpoint": endpoint}, queued[endpoint])
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def run_with_timeout(fn, timeout_seconds):
+    """
+    Run fn on the shared executor and wait at most timeout_seconds for its result.
+    Unlike a per-request executor used as a context manager, this never blocks on
+    the worker after the deadline has passed.
+    """
+    future = get_executor().submit(fn)
+    try:
+        return future.result(timeout=timeout_seconds)
+    except TimeoutError:
+        # Drops the call if it has not started yet; a running call is bounded by the
+        # transport deadline passed to generate_content below
+        future.cancel()
+        raise GenerationTimeout(f"Generation timed out after {timeout_seconds} seconds")
+
+
+def _is_gemini_failure(error):
+    from google.api_core import exceptions as google_exceptions
+
+    # Bad requests and blocked prompts say nothing about Gemini's health; quota
+    # exhaustion, server errors, deadlines and transport errors do
+    if isinstance(error, (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)):
+        return True
+    return not isinstance(error, google_exceptions.ClientError)
+
+
+def generate_content(model, prompt, timeout_seconds, stream=False):
+    """
+    Call Gemini with a transport-level deadline so that a hung call is aborted upstream
+    and releases its worker thread, rather than running on after we stop waiting.
+    google-generativeai 0.3.2 does not accept request options on generate_content, so
+    the deadline is passed straight to the underlying API client.
+
+    Calls go through Gemini's circuit breaker, and fail fast with ModelUnavailable
+    while it is open. A non-streaming call that hits a transient server error is
+    retried while enough of the deadline is left.
+    """
+    # Imported on first use, like the model itself (see prompt_builder.get_model)
+    from google.api_core import exceptions as google_exceptions
+    from google.generativeai import client as genai_client
+    from google.generativeai.types import GenerateContentResponse
+
+    request = model._prepare_request(contents=prompt)
+    if model._client is None:
+        model._client = genai_client.get_default_generative_client()
+    breaker = upstream.breaker("gemini")
+
+    def call(timeout):
+        if stream:
+            iterator = model._client.stream_generate_content(request, timeout=timeout)
+            return GenerateContentResponse.from_iterator(iterator)
+        return GenerateContentResponse.from_response(model._client.generate_content(request, timeout=timeout))
+
+    deadline = time.monotonic() + timeout_seconds
+    attempt = 0
+    while True:
+        try:
+            timeout = timeout_seconds if not attempt else deadline - time.monotonic()
+            return breaker.call(lambda: call(timeout), _is_gemini_failure)
+        except upstream.CircuitOpen as e:
+            raise ModelUnavailable(str(e))
+        except (google_exceptions.ServiceUnavailable, google_exceptions.InternalServerError) as e:
+            attempt += 1
+            if stream or attempt > GEMINI_RETRIES or deadline - time.monotonic() < GEMINI_RETRY_MIN_SECONDS:
+                raise
+            logger.warning(f"Retrying Gemini generation after transient error: {str(e)}")
+            metrics.inc("finwise_generation_retries_total")
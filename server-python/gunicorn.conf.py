@@ -0,0 +1,93 @@
+"""
+Production server profile:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+The app is imported once in the master and workers are forked from it, so code
+and the Gemini client library are shared copy-on-write instead of loaded per
+worker. Each worker runs threads, since most of a request is spent waiting on
+Gemini. On SIGTERM (shutdown) or SIGHUP (reload) a worker reports itself as
+draining on /ready, stops accepting connections and lets in-flight streams
+finish for up to graceful_timeout.
+"""
+import os
+import time
+import signal
+import logging
+import multiprocessing
+
+_started = time.monotonic()
+
+bind = f"0.0.0.0:{os.getenv('PORT', 9000)}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Per-process state would be split between workers: a client would get a rate limit
+# bucket in each one, and a resumed SSE stream that lands on another worker would
+# answer 404. Share both through sqlite unless the backend is set explicitly.
+# This file is read before the app is imported, so rate_limit and stream_replay see it.
+if workers > 1:
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "sqlite")
+    os.environ.setdefault("STREAM_REPLAY_BACKEND", "sqlite")
+worker_class = "gthread"
+# Concurrent requests per worker; above the per-endpoint generation limits so that
+# cached, routed and health-check requests are never stuck behind generations
+threads = int(os.getenv("GUNICORN_THREADS", 48))
+# Import the app once in the master and fork workers from it
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+keepalive = 5
+# A worker that misses heartbeats this long is restarted. Streams do not block the
+# heartbeat with gthread, so this does not need to cover a whole stream.
+timeout = 30
+# Long enough for the longest /stream response to finish during a drain
+graceful_timeout = int(float(os.getenv("STREAM_TIMEOUT_SECONDS", 60))) + 5
+# Replace workers after this many requests (0 = never) to bound slow memory growth
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = max_requests // 10
+# Request and error logs already go through the app's structured logging
+accesslog = None
+
+# Import google-generativeai in the master so workers share it rather than each
+# paying the import on their first chat request
+GEMINI_PRELOAD = os.getenv("GEMINI_PRELOAD", "true").lower() == "true"
+
+
+def when_ready(server):
+    if preload_app and GEMINI_PRELOAD:
+        import prompt_builder
+
+        # Creates the model object only; gRPC channels are opened lazily in each worker
+        prompt_builder.get_model()
+    logging.getLogger("gunicorn.finwise").info(
+        f"Ready in {time.monotonic() - _started:.2f}s, starting {workers} workers x {threads} threads"
+    )
+
+
+def post_fork(server, worker):
+    # The log writer thread does not survive fork; give each worker its own
+    import structured_logging
+
+    structured_logging.configure_logging()
+
+
+def post_worker_init(worker):
+    import app
+
+    # gunicorn has installed its own SIGTERM handler by now; chain it so /ready
+    # turns 503 as soon as the drain starts
+    previous = signal.getsignal(signal.SIGTERM)
+
+    def on_term(signum, frame):
+        app.draining.set()
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, on_term)
+
+
+def worker_exit(server, worker):
+    import app
+    import structured_logging
+
+    interaction_log = app.app.extensions.get("interaction_log")
+    if interaction_log is not None:
+        interaction_log.close()
+    structured_logging.stop_logging()
@@ -0,0 +1,233 @@
+import os
+import re
+import time
+import logging
+
+import metrics
+import calculator
+
+logger = logging.getLogger(__name__)
+
+# Answer market quotes, definitions and plain calculations locally instead of calling the model
+INTENT_ROUTER_ENABLED = os.getenv("INTENT_ROUTER_ENABLED", "true").lower() == "true"
+# Longer messages are treated as open-ended and always go to the model
+INTENT_ROUTER_MAX_WORDS = int(os.getenv("INTENT_ROUTER_MAX_WORDS", 16))
+# Generation time assumed saved per routed request until real generations have been measured
+INTENT_ROUTER_DEFAULT_SAVING_SECONDS = float(os.getenv("INTENT_ROUTER_DEFAULT_SAVING_SECONDS", 3.0))
+
+MARKET_QUOTE = "market_quote"
+DEFINITION = "definition"
+CALCULATOR = "calculator"
+ADVICE = "advice"
+
+metrics.COUNTERS["finwise_routed_requests_total"] = "Chat requests by routing decision (intent), by endpoint"
+metrics.COUNTERS["finwise_router_saved_seconds_total"] = \
+    "Estimated model time saved by answering locally (median generation time minus local handling time)"
+
+# Anything asking for an opinion or a forecast needs the model
+_ADVICE_WORDS = re.compile(
+    r"\b(should|shall|recommend|suggest|advice|advise|best|good|bad|safe|risky|why|predict|forecast|outlook|"
+    r"expect|tomorrow|next|future|buy|sell|hold|fund|funds|stock|stocks|portfolio|compare|vs|versus)\b",
+    re.IGNORECASE
+)
+
+# Market quote entities: alias -> key in the market data snapshot
+_QUOTE_ENTITIES = {
+    "nifty": "nifty50", "nifty50": "nifty50", "nifty 50": "nifty50",
+    "sensex": "sensex", "bse sensex": "sensex",
+    "usd inr": "usd_inr", "usd/inr": "usd_inr", "usdinr": "usd_inr", "dollar": "usd_inr", "rupee": "usd_inr",
+    "top gainers": "top_gainers", "gainers": "top_gainers", "top losers": "top_losers", "losers": "top_losers",
+}
+_QUOTE_WORDS = re.compile(
+    r"\b(what|what's|whats|how|at|level|levels|price|quote|today|now|current|currently|value|rate|doing|"
+    r"trading|show|list|who|where|are|is|the|today's|me|of|and)\b|\?",
+    re.IGNORECASE
+)
+
+# Glossary for "what is X" questions: aliases -> answer
+GLOSSARY = [
+    (("sip", "systematic investment plan"),
+     "A SIP (Systematic Investment Plan) invests a fixed amount in a mutual fund at regular intervals, usually "
+     "monthly. It buys more units when prices are low and fewer when they are high (rupee cost averaging) and "
+     "builds the habit of investing regularly. SIPs can start from ₹100-₹500 a month."),
+    (("mutual fund", "mutual funds"),
+     "A mutual fund pools money from many investors and invests it in stocks, bonds or other assets according "
+     "to a stated objective, managed by a SEBI-registered asset management company. You own units whose value "
+     "(NAV) moves with the underlying investments."),
+    (("nav", "net asset value"),
+     "NAV (Net Asset Value) is the per-unit price of a mutual fund: the market value of its holdings minus "
+     "expenses, divided by the number of units. It is published after each trading day."),
+    (("elss", "equity linked savings scheme", "tax saving fund", "tax saving mutual fund"),
+     "ELSS (Equity Linked Savings Scheme) is an equity mutual fund with a 3-year lock-in. Investments of up to "
+     "₹1.5 lakh a year qualify for deduction under Section 80C in the old tax regime. Gains above ₹1.25 lakh a "
+     "year are taxed as long-term capital gains at 12.5%."),
+    (("ppf", "public provident fund"),
+     "PPF (Public Provident Fund) is a government-backed savings scheme with a 15-year term, extendable in blocks "
+     "of 5 years. You can invest ₹500 to ₹1.5 lakh a year; the interest rate is set quarterly by the government "
+     "and both interest and maturity are tax-free, with deposits eligible under Section 80C (old regime)."),
+    (("nps", "national pension system", "national pension scheme"),
+     "NPS (National Pension System) is a regulated, market-linked retirement scheme. Contributions are invested "
+     "in equity, corporate and government bonds; at 60 you can withdraw up to 60% tax-free and must use the rest "
+     "to buy an annuity. Extra deduction of ₹50,000 is available under Section 80CCD(1B) in the old regime."),
+    (("index fund", "index funds"),
+     "An index fund is a mutual fund that simply tracks a market index such as the Nifty 50 or Sensex, holding "
+     "the same stocks in the same weights. It has low costs because it is not actively managed."),
+    (("etf", "exchange traded fund", "exchange traded funds"),
+     "An ETF (Exchange Traded Fund) is a fund, usually tracking an index or a commodity like gold, whose units "
+     "trade on the stock exchange like shares. You need a demat account to buy one."),
+    (("expense ratio",),
+     "The expense ratio is the annual fee a mutual fund charges, as a percentage of your investment, deducted "
+     "from the NAV daily. Direct plans have lower expense ratios than regular plans."),
+    (("cagr", "compound annual growth rate"),
+     "CAGR (Compound Annual Growth Rate) is the constant yearly rate at which an investment would have grown "
+     "from its starting to its ending value: (end / start)^(1 / years) - 1."),
+    (("xirr",),
+     "XIRR is the annualised return for investments made at different dates, such as SIP instalments. It is "
+     "the rate that makes the present value of all cash flows zero, and is the right measure for SIP returns."),
+    (("nifty", "nifty 50", "nifty50"),
+     "The Nifty 50 is the NSE's benchmark index of 50 large, liquid Indian companies across sectors, weighted "
+     "by free-float market capitalisation."),
+    (("sensex",),
+     "The Sensex is the BSE's benchmark index of 30 large, established Indian companies, weighted by free-float "
+     "market capitalisation. It is the oldest Indian stock index."),
+    (("section 80c", "80c"),
+     "Section 80C lets you deduct up to ₹1.5 lakh a year for investments such as ELSS, PPF, EPF, life insurance "
+     "premiums, tax-saving FDs and home loan principal. It applies only under the old tax regime."),
+    (("fd", "fixed deposit", "fixed deposits"),
+     "A fixed deposit (FD) locks money with a bank or NBFC for a fixed term at a guaranteed interest rate. "
+     "Interest is taxed at your slab rate; bank deposits are insured up to ₹5 lakh per bank by DICGC."),
+    (("demat account", "demat"),
+     "A demat account holds shares, ETFs and bonds in electronic form. It is opened with a depository "
+     "participant (usually your broker) and is needed to buy listed securities."),
+]
+_DEFINITIONS = {alias: text for aliases, text in GLOSSARY for alias in aliases}
+
+
+def _alternation(aliases):
+    # Longest first, so "nifty 50" wins over "nifty"
+    return "|".join(re.escape(a).replace(r"\ ", r"\s+") for a in sorted(aliases, key=len, reverse=True))
+
+
+_DEFINITION_QUERY = re.compile(
+    r"^\s*(?:what\s+is|what's|whats|what\s+are|what\s+does|define|meaning\s+of|explain|tell\s+me\s+about)\s+"
+    r"(?:an?\s+|the\s+)?(?P<term>" + _alternation(_DEFINITIONS) + r")"
+    r"(?:\s+(?:mean|means|stand\s+for|meaning))?\s*[?.!]*\s*$",
+    re.IGNORECASE
+)
+_QUOTE_ENTITY = re.compile(r"\b(?P<entity>" + _alternation(_QUOTE_ENTITIES) + r")\b", re.IGNORECASE)
+
+
+def _normalize_term(term):
+    return " ".join(term.lower().split())
+
+
+def classify(msg):
+    """
+    Cheap local classification of a chat message: MARKET_QUOTE, DEFINITION,
+    CALCULATOR or ADVICE (everything that needs the model).
+    """
+    if len(msg.split()) > INTENT_ROUTER_MAX_WORDS:
+        return ADVICE
+    if _DEFINITION_QUERY.match(msg):
+        return DEFINITION
+    if _ADVICE_WORDS.search(msg):
+        # Which regime is cheaper is a calculation, not advice
+        params = calculator.parse_query(msg)
+        return CALCULATOR if params is not None and params["type"] == "tax" else ADVICE
+    if calculator.parse_query(msg) is not None:
+        return CALCULATOR
+    entities = _QUOTE_ENTITY.findall(msg)
+    if entities:
+        # Only the entity and question filler words, e.g. "where is nifty at now?"
+        rest = _QUOTE_ENTITY.sub(" ", msg)
+        if not _QUOTE_WORDS.sub(" ", rest).strip(" ,.!"):
+            return MARKET_QUOTE
+    return ADVICE
+
+
+def _format_index(name, quote):
+    change = quote.get("percent_change")
+    try:
+        return f"{name} is at {float(quote['c']):,.2f} ({float(change):+.2f}% today)"
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _format_movers(title, movers):
+    if not movers:
+        return None
+    items = ", ".join(f"{m['symbol'].replace('.NS', '')} {m['change_percent']:+.2f}%" for m in movers)
+    return f"{title}: {items}"
+
+
+def answer_market_quote(msg, market_data):
+    """The requested quotes from the market data snapshot, or None if it has none of them"""
+    wanted = {_QUOTE_ENTITIES[_normalize_term(e)] for e in _QUOTE_ENTITY.findall(msg)}
+    indices = market_data.get("indices", {})
+    lines = []
+    if "nifty50" in wanted:
+        lines.append(_format_index("Nifty 50", indices.get("nifty50", {})))
+    if "sensex" in wanted:
+        lines.append(_format_index("Sensex", indices.get("sensex", {})))
+    if "usd_inr" in wanted:
+        try:
+            lines.append(f"USD/INR is at {float(market_data.get('forex', {}).get('usd_inr')):.2f}")
+        except (TypeError, ValueError):
+            lines.append(None)
+    if "top_gainers" in wanted:
+        lines.append(_format_movers("Top gainers", market_data.get("top_gainers")))
+    if "top_losers" in wanted:
+        lines.append(_format_movers("Top losers", market_data.get("top_losers")))
+    if not lines or None in lines:
+        return None
+    return "\n".join(lines) + f"\n\n(As of {market_data.get('timestamp', 'the latest update')})"
+
+
+def answer_definition(msg):
+    match = _DEFINITION_QUERY.match(msg)
+    return _DEFINITIONS.get(_normalize_term(match.group("term"))) if match else None
+
+
+def answer_calculation(msg):
+    params = calculator.parse_query(msg)
+    lines = calculator.figure_lines(params) if params is not None else []
+    if not lines:
+        return None
+    note = calculator.assumed_return_note(params)
+    return ("\n".join(f"- {line}" for line in lines) +
+            f"\n\nThese are estimates{note}; actual market returns vary from year to year.")
+
+
+def _generation_estimate():
+    quantiles = metrics.quantiles("generation")
+    return quantiles[0.5] if quantiles else INTENT_ROUTER_DEFAULT_SAVING_SECONDS
+
+
+def route(msg, market_data, endpoint):
+    """
+    Return (intent, text). text is a locally produced answer, or None when the
+    message should go to the model. Records the decision and the time saved.
+    """
+    if not INTENT_ROUTER_ENABLED:
+        return ADVICE, None
+    start = time.perf_counter()
+    intent = classify(msg)
+    text = None
+    try:
+        if intent == MARKET_QUOTE:
+            text = answer_market_quote(msg, market_data)
+        elif intent == DEFINITION:
+            text = answer_definition(msg)
+        elif intent == CALCULATOR:
+            text = answer_calculation(msg)
+    except Exception as e:
+        logger.error(f"Local {intent} handler failed, falling back to the model: {str(e)}", exc_info=True)
+        text = None
+    elapsed = time.perf_counter() - start
+    if text is None:
+        metrics.inc("finwise_routed_requests_total", endpoint=endpoint, intent=ADVICE)
+        return intent, None
+    metrics.inc("finwise_routed_requests_total", endpoint=endpoint, intent=intent)
+    metrics.inc("finwise_router_saved_seconds_total", round(max(_generation_estimate() - elapsed, 0.0), 6),
+                endpoint=endpoint)
+    return intent, text
@@ -1,57 +1,308 @@
 import os
+import glob
+import gzip
 import json
+import time
+import atexit
+import logging
+import threading
+from collections import deque
 from datetime import datetime
-from flask import request, Flask, g
+from flask import request, Response, g
 from functools import wraps
 
-def setup_interaction_logging(app):
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Interaction logging is off unless a directory is configured
+INTERACTION_LOG_DIR = os.environ.get('FINWISE_INTERACTION_LOG_DIR')
+# Entries held in memory waiting to be written; when full, new entries are dropped
+INTERACTION_LOG_BUFFER_SIZE = int(os.getenv("FINWISE_INTERACTION_LOG_BUFFER_SIZE", 10000))
+INTERACTION_LOG_FLUSH_SECONDS = float(os.getenv("FINWISE_INTERACTION_LOG_FLUSH_SECONDS", 1))
+INTERACTION_LOG_BATCH_SIZE = int(os.getenv("FINWISE_INTERACTION_LOG_BATCH_SIZE", 500))
+# A new segment is started when the current one reaches this size or age
+INTERACTION_LOG_SEGMENT_BYTES = int(os.getenv("FINWISE_INTERACTION_LOG_SEGMENT_BYTES", 64 * 1024 * 1024))
+INTERACTION_LOG_SEGMENT_SECONDS = int(os.getenv("FINWISE_INTERACTION_LOG_SEGMENT_SECONDS", 3600))
+INTERACTION_LOG_COMPRESS = os.getenv("FINWISE_INTERACTION_LOG_COMPRESS", "false").lower() == "true"
+# "none": leave it to the OS, "batch": fsync after every write, "segment": fsync when a segment is closed
+INTERACTION_LOG_FSYNC = os.getenv("FINWISE_INTERACTION_LOG_FSYNC", "segment")
+
+FSYNC_POLICIES = ("none", "batch", "segment")
+SEGMENT_PREFIX = "interactions-"
+
+
+class InteractionLogWriter:
+    """
+    Append-only interaction log. Entries go into a bounded in-memory buffer and a
+    background thread writes them in batches to rotating JSONL segments
+    (interactions-<start time>-<pid>-<n>.jsonl[.gz]) in log_dir. Request threads never
+    touch the disk; if the writer falls behind, new entries are dropped and counted.
+    """
+
+    def __init__(self, log_dir, buffer_size=INTERACTION_LOG_BUFFER_SIZE,
+                 flush_seconds=INTERACTION_LOG_FLUSH_SECONDS, batch_size=INTERACTION_LOG_BATCH_SIZE,
+                 segment_bytes=INTERACTION_LOG_SEGMENT_BYTES, segment_seconds=INTERACTION_LOG_SEGMENT_SECONDS,
+                 compress=INTERACTION_LOG_COMPRESS, fsync=INTERACTION_LOG_FSYNC):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}, not {fsync!r}")
+        self.log_dir = log_dir
+        self.buffer_size = buffer_size
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.compress = compress
+        self.fsync = fsync
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._pid = None
+        self._closing = False
+        self._flush_requested = False
+        self._writing = False
+        self._segment = None  # (raw file, writer, path, opened_at)
+        self._segment_count = 0
+        self._segment_size = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+
+    def write(self, entry):
+        """Queue one entry (a JSON-serialisable dict); returns False if it was dropped"""
+        with self._cond:
+            if self._pid != os.getpid():
+                # First write in this process (or first after a fork): start a writer here
+                self._start()
+            if len(self._buffer) >= self.buffer_size:
+                self.dropped += 1
+                return False
+            self._buffer.append(entry)
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def _start(self):
+        # Caller holds the lock
+        self._buffer.clear()
+        self._segment = None
+        self._closing = False
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name="interaction-log", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # Write once a full batch is waiting, or every flush_seconds otherwise
+                self._cond.wait_for(
+                    lambda: len(self._buffer) >= self.batch_size or self._flush_requested or self._closing,
+                    self.flush_seconds
+                )
+                batch = list(self._buffer)
+                self._buffer.clear()
+                self._flush_requested = False
+                self._writing = bool(batch)
+                closing = self._closing
+            if batch:
+                self._write_batch(batch)
+            elif self._segment is not None and time.time() - self._segment[3] >= self.segment_seconds:
+                self._close_segment()
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+            if closing:
+                self._close_segment()
+                return
+
+    def _open_segment(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        self._segment_count += 1
+        name = f"{SEGMENT_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._segment_count}.jsonl"
+        if self.compress:
+            name += ".gz"
+        path = os.path.join(self.log_dir, name)
+        raw = open(path, "ab")
+        writer = gzip.GzipFile(fileobj=raw, mode="ab") if self.compress else raw
+        self._segment = (raw, writer, path, time.time())
+        self._segment_size = 0
+
+    def _close_segment(self):
+        if self._segment is None:
+            return
+        raw, writer, _, _ = self._segment
+        self._segment = None
+        try:
+            if writer is not raw:
+                writer.close()
+            raw.flush()
+            if self.fsync != "none":
+                os.fsync(raw.fileno())
+        except OSError as e:
+            self.errors += 1
+            logger.warning(f"Error closing interaction log segment: {str(e)}")
+        finally:
+            raw.close()
+
+    def _write_batch(self, batch):
+        data = "".join(json.dumps(entry, default=str, ensure_ascii=False) + "\n" for entry in batch).encode("utf-8")
+        try:
+            if self._segment is not None and (self._segment_size >= self.segment_bytes or
+                                              time.time() - self._segment[3] >= self.segment_seconds):
+                self._close_segment()
+            if self._segment is None:
+                self._open_segment()
+            raw, writer, _, _ = self._segment
+            writer.write(data)
+            # A sync flush keeps every written batch readable even if the process dies mid-segment
+            writer.flush()
+            if writer is not raw:
+                raw.flush()
+            if self.fsync == "batch":
+                os.fsync(raw.fileno())
+            self._segment_size += len(data)
+            self.written += len(batch)
+            self.batches += 1
+        except (OSError, ValueError) as e:
+            self.errors += 1
+            self.dropped += len(batch)
+            logger.warning(f"Could not write {len(batch)} interaction log entries: {str(e)}")
+            # Start a fresh segment on the next batch
+            if self._segment is not None:
+                self._segment[0].close()
+                self._segment = None
+
+    def flush(self, timeout=5.0):
+        """Write everything buffered so far now; returns False if that took longer than timeout"""
+        with self._cond:
+            if self._thread is None:
+                return True
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._buffer and not self._writing, timeout)
+
+    def close(self):
+        """Write out buffered entries, close the current segment and stop the writer thread"""
+        with self._cond:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            self._closing = True
+            self._cond.notify_all()
+            thread = self._thread
+        thread.join(timeout=10)
+        self._thread = None
+        self._pid = None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "buffered": len(self._buffer),
+                "written": self.written,
+                "dropped": self.dropped,
+                "batches": self.batches,
+                "errors": self.errors,
+            }
+
+
+def read_interactions(log_dir, since=None, until=None):
+    """
+    Iterate over logged interactions in log_dir, oldest segment first, for offline
+    analysis. since/until are optional epoch seconds bounds on the entry's
+    logged_at. A partially written last line (e.g. after a crash) is skipped.
+    """
+    paths = glob.glob(os.path.join(log_dir, f"{SEGMENT_PREFIX}*.jsonl")) + \
+        glob.glob(os.path.join(log_dir, f"{SEGMENT_PREFIX}*.jsonl.gz"))
+    for path in sorted(paths, key=lambda p: (os.path.getmtime(p), p)):
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue
+                    logged_at = entry.get("logged_at", 0)
+                    if since is not None and logged_at < since:
+                        continue
+                    if until is not None and logged_at >= until:
+                        continue
+                    yield entry
+        except (OSError, EOFError) as e:
+            # A compressed segment still being written ends without a gzip trailer
+            logger.debug(f"Stopped reading {path}: {str(e)}")
+
+
+def _response_text(result):
+    """Answer text of a view's return value, if it has one"""
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, dict):
+        return result.get("text", "")
+    if isinstance(result, Response):
+        if result.is_streamed:
+            return "Stream response"
+        body = result.get_json(silent=True)
+        if isinstance(body, dict):
+            return body.get("text", "")
+    return ""
+
+
+def setup_interaction_logging(app, log_dir=None):
+    """
+    Returns a decorator that appends one entry per request (query, response and
+    timing) to the interaction log. It is a no-op unless log_dir or
+    FINWISE_INTERACTION_LOG_DIR is set.
+    """
+    log_dir = log_dir or INTERACTION_LOG_DIR
+    writer = InteractionLogWriter(log_dir) if log_dir else None
+    if writer is not None:
+        atexit.register(writer.close)
+        app.extensions["interaction_log"] = writer
+        metrics.register_collector(lambda: _collect_metrics(writer))
+
     # Create a decorator for logging interactions
     def log_interaction(f):
+        if writer is None:
+            return f
+
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            client_ip = request.remote_addr
-            user_agent = request.headers.get('User-Agent', 'Unknown')
-            data = request.json
-            
-            # Log the request
+            if request.method == 'OPTIONS':
+                return f(*args, **kwargs)
+            start = time.perf_counter()
+            data = request.get_json(silent=True)
+            # Runs before the view validates the body, so a malformed history must not raise here
+            history = (data.get('history') or []) if isinstance(data, dict) else []
             log_entry = {
-                "timestamp": timestamp,
-                "client_ip": client_ip,
-                "user_agent": user_agent,
+                "timestamp": datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+                "logged_at": time.time(),
+                "client_ip": request.remote_addr,
+                "user_agent": request.headers.get('User-Agent', 'Unknown'),
                 "endpoint": request.path,
-                "query": data.get('chat', '') if data else '',
-                "history_length": len(data.get('history', [])) if data else 0,
+                "query": data.get('chat', '') if isinstance(data, dict) else '',
+                "history_length": len(history) if isinstance(history, list) else 0,
             }
-            
-            log_path = os.environ.get('FINWISE_INTERACTION_LOG_DIR', '/tmp')
-            log_file = f"{log_path}/{timestamp}_{client_ip.replace('.', '_')}.json"
-            
-            with open(log_file, 'w') as f:
-                json.dump(log_entry, f, indent=2)
-            
-            # Store for later use
             g.log_entry = log_entry
-            g.log_file = log_file
-            
+
             # Call the original handler
             result = f(*args, **kwargs)
-            
-            # Log the response if available
-            if hasattr(g, 'log_entry'):
-                if isinstance(result, dict):
-                    g.log_entry["response"] = result.get("text", "")
-                else:
-                    g.log_entry["response"] = "Stream response"
-                
-                with open(g.log_file, 'w') as f:
-                    json.dump(g.log_entry, f, indent=2)
-            
+
+            log_entry["response"] = _response_text(result)
+            log_entry["duration_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            writer.write(log_entry)
             return result
         return decorated_function
-    
-    # Add the decorator to all relevant routes
-    app.before_request(lambda: setattr(g, 'start_time', datetime.now()))
-    
+
     # Return the decorator for use in app.py
     return log_interaction
+
+
+def _collect_metrics(writer):
+    stats = writer.stats()
+    yield ("finwise_interaction_log_entries_total", "counter", "Interaction log entries, by result",
+           {"result": "written"}, stats["written"])
+    yield ("finwise_interaction_log_entries_total", "counter", "Interaction log entries, by result",
+           {"result": "dropped"}, stats["dropped"])
+    yield ("finwise_interaction_log_buffered", "gauge", "Interaction log entries waiting to be written",
+           {}, stats["buffered"])
@@ -0,0 +1,292 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+
+import metrics
+import upstream
+import market_history
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to per-process refresh coordination
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+POLYGON_BASE_URL = os.getenv("POLYGON_BASE_URL", "https://api.polygon.io")
+FOREX_BASE_URL = os.getenv("FOREX_BASE_URL", "https://open.er-api.com")
+
+# Data is considered fresh for CACHE_EXPIRY_SECONDS. Within REFRESH_AHEAD_SECONDS of
+# expiry a single background refresh is started while callers keep getting the
+# cached value, and stale data is served for up to MAX_STALE_SECONDS past expiry
+# while a refresh is running.
+CACHE_EXPIRY_SECONDS = int(os.getenv("MARKET_DATA_CACHE_SECONDS", 300))
+REFRESH_AHEAD_SECONDS = int(os.getenv("MARKET_DATA_REFRESH_AHEAD_SECONDS", 60))
+MAX_STALE_SECONDS = int(os.getenv("MARKET_DATA_MAX_STALE_SECONDS", 600))
+
+# (connect, read) timeouts for each upstream call, set per provider in upstream.PROVIDERS
+UPSTREAM_TIMEOUT = upstream.PROVIDERS["polygon"]["timeout"]
+
+# Snapshot shared by every worker process on the host, so N workers fetch once
+SNAPSHOT_PATH = os.getenv(
+    "MARKET_DATA_SNAPSHOT_PATH",
+    os.path.join(tempfile.gettempdir(), "finwise_market_snapshot.json")
+)
+
+FALLBACK_INDICES = {
+    "nifty50": {"c": 22000, "percent_change": 0.67},
+    "sensex": {"c": 72500, "percent_change": 0.58},
+}
+FALLBACK_USD_INR = 83.2
+
+# For demo, we simulate top gainers/losers - in a real app, you'd use appropriate APIs
+TOP_GAINERS = [
+    {"symbol": "RELIANCE.NS", "change_percent": 2.45},
+    {"symbol": "TCS.NS", "change_percent": 1.78},
+    {"symbol": "HDFCBANK.NS", "change_percent": 1.65}
+]
+TOP_LOSERS = [
+    {"symbol": "INFY.NS", "change_percent": -1.23},
+    {"symbol": "ICICIBANK.NS", "change_percent": -0.89},
+    {"symbol": "AXISBANK.NS", "change_percent": -0.72}
+]
+
+# Process-local copy of the snapshot
+_cache = {
+    "fetched_at": 0.0,
+    "data": None,
+    "snapshot_mtime": None,
+}
+_refresh_lock = threading.Lock()
+_refresh_done = threading.Event()
+_refresh_done.set()
+
+_fetch_executor = None
+_init_lock = threading.Lock()
+
+
+def _executor():
+    global _fetch_executor
+    if _fetch_executor is None:
+        with _init_lock:
+            if _fetch_executor is None:
+                _fetch_executor = ThreadPoolExecutor(max_workers=3, thread_name_prefix="market-data")
+    return _fetch_executor
+
+
+def _fetch_index(ticker, fallback):
+    """Fetch the previous close for an index from polygon.io as {"c", "percent_change"}"""
+    try:
+        response = upstream.get(
+            "polygon",
+            f"{POLYGON_BASE_URL}/v2/aggs/ticker/{ticker}/prev",
+            params={"adjusted": "true", "apiKey": os.getenv("POLYGON_API_KEY", "")}
+        )
+        if response.status_code != 200:
+            metrics.inc("finwise_upstream_errors_total", provider="polygon")
+            return fallback
+        bar = response.json()["results"][0]
+        return {
+            "c": bar["c"],
+            "percent_change": round((bar["c"] - bar["o"]) / bar["o"] * 100, 2) if bar.get("o") else 0.0
+        }
+    except upstream.CircuitOpen:
+        return fallback
+    except Exception as e:
+        metrics.inc("finwise_upstream_errors_total", provider="polygon")
+        logger.warning(f"Error fetching {ticker} from polygon.io: {str(e)}")
+        return fallback
+
+
+def _fetch_usd_inr():
+    try:
+        response = upstream.get("forex", f"{FOREX_BASE_URL}/v6/latest/USD")
+        if response.status_code != 200:
+            metrics.inc("finwise_upstream_errors_total", provider="forex")
+            return FALLBACK_USD_INR
+        return response.json()["rates"]["INR"]
+    except upstream.CircuitOpen:
+        return FALLBACK_USD_INR
+    except Exception as e:
+        metrics.inc("finwise_upstream_errors_total", provider="forex")
+        logger.warning(f"Error fetching USD/INR rate: {str(e)}")
+        return FALLBACK_USD_INR
+
+
+def fetch_market_data():
+    """Fetch a fresh snapshot, querying all upstream providers in parallel"""
+    current_time = datetime.now(pytz.timezone('Asia/Kolkata'))
+    executor = _executor()
+    nifty = executor.submit(_fetch_index, "NSEI", FALLBACK_INDICES["nifty50"])
+    sensex = executor.submit(_fetch_index, "SENSEX", FALLBACK_INDICES["sensex"])
+    usd_inr = executor.submit(_fetch_usd_inr)
+
+    return {
+        "indices": {
+            "nifty50": nifty.result(),
+            "sensex": sensex.result()
+        },
+        "top_gainers": TOP_GAINERS,
+        "top_losers": TOP_LOSERS,
+        "forex": {
+            "usd_inr": usd_inr.result()
+        },
+        "timestamp": current_time.strftime("%Y-%m-%d %H:%M:%S IST")
+    }
+
+
+def _is_live(data):
+    """True if every upstream answered, i.e. no fallback values are in the snapshot"""
+    indices = data.get("indices", {})
+    return (
+        indices.get("nifty50") not in (None, FALLBACK_INDICES["nifty50"]) and
+        indices.get("sensex") not in (None, FALLBACK_INDICES["sensex"]) and
+        data.get("forex", {}).get("usd_inr") not in (None, FALLBACK_USD_INR)
+    )
+
+
+def _with_last_known(data, previous):
+    """
+    Replace fallback values from failed providers with the last values they did
+    return, so an outage keeps serving real (if dated) figures
+    """
+    merged = dict(data, indices=dict(data.get("indices", {})), forex=dict(data.get("forex", {})))
+    for index, fallback in FALLBACK_INDICES.items():
+        last = previous.get("indices", {}).get(index)
+        if merged["indices"].get(index) == fallback and last is not None:
+            merged["indices"][index] = last
+    last_usd_inr = previous.get("forex", {}).get("usd_inr")
+    if merged["forex"].get("usd_inr") == FALLBACK_USD_INR and last_usd_inr is not None:
+        merged["forex"]["usd_inr"] = last_usd_inr
+    return merged
+
+
+def _load_snapshot():
+    """Pick up a snapshot written by another worker, if it is newer than ours"""
+    try:
+        mtime = os.stat(SNAPSHOT_PATH).st_mtime
+    except OSError:
+        return
+    if mtime == _cache["snapshot_mtime"]:
+        return
+    try:
+        with open(SNAPSHOT_PATH) as f:
+            snapshot = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable market data snapshot: {str(e)}")
+        return
+    _cache["snapshot_mtime"] = mtime
+    if snapshot.get("fetched_at", 0) > _cache["fetched_at"]:
+        _cache["fetched_at"] = snapshot["fetched_at"]
+        _cache["data"] = snapshot["data"]
+
+
+def _save_snapshot(fetched_at, data):
+    directory = os.path.dirname(SNAPSHOT_PATH) or "."
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".market_snapshot.")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"fetched_at": fetched_at, "data": data}, f)
+        os.replace(tmp_path, SNAPSHOT_PATH)
+        _cache["snapshot_mtime"] = os.stat(SNAPSHOT_PATH).st_mtime
+    except OSError as e:
+        logger.warning(f"Could not write market data snapshot: {str(e)}")
+
+
+def _refresh(blocking):
+    """
+    Refresh the snapshot unless another thread or worker process already is.
+    Returns False without fetching if the refresh is owned elsewhere.
+    """
+    lock_file = None
+    try:
+        if fcntl is not None:
+            lock_file = open(SNAPSHOT_PATH + ".lock", "a")
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                return False
+            # Another worker may have refreshed while we waited for the lock
+            _load_snapshot()
+            if time.time() - _cache["fetched_at"] < CACHE_EXPIRY_SECONDS - REFRESH_AHEAD_SECONDS:
+                return True
+
+        fetched_at = time.time()
+        data = fetch_market_data()
+        live = _is_live(data)
+        if not live and _cache["data"] is not None:
+            data = _with_last_known(data, _cache["data"])
+        _cache["fetched_at"] = fetched_at
+        _cache["data"] = data
+        _save_snapshot(fetched_at, data)
+        # Only the refreshing worker gets here, so history appends are never concurrent
+        if live:
+            market_history.record(fetched_at, data)
+        return True
+    except Exception as e:
+        logger.error(f"Error refreshing market data: {str(e)}", exc_info=True)
+        return False
+    finally:
+        if lock_file is not None:
+            lock_file.close()
+
+
+def _start_refresh(blocking):
+    """Single-flight within the process: returns True if this call owns the refresh"""
+    if not _refresh_lock.acquire(blocking=False):
+        return False
+    _refresh_done.clear()
+
+    def run():
+        try:
+            _refresh(blocking)
+        finally:
+            _refresh_done.set()
+            _refresh_lock.release()
+
+    if blocking:
+        run()
+    else:
+        threading.Thread(target=run, name="market-data-refresh", daemon=True).start()
+    return True
+
+
+def get_indian_market_data():
+    """Fetch live data from Indian stock markets (NSE/BSE)"""
+    _load_snapshot()
+    age = time.time() - _cache["fetched_at"]
+
+    if _cache["data"] is not None and age < CACHE_EXPIRY_SECONDS + MAX_STALE_SECONDS:
+        if age >= CACHE_EXPIRY_SECONDS - REFRESH_AHEAD_SECONDS:
+            # Serve what we have and let one background refresh run ahead of callers
+            metrics.inc("finwise_market_data_cache_total", result="stale")
+            _start_refresh(blocking=False)
+        else:
+            metrics.inc("finwise_market_data_cache_total", result="fresh")
+        return _cache["data"]
+
+    # Nothing usable yet: fetch synchronously, coalescing with any refresh in progress
+    metrics.inc("finwise_market_data_cache_total", result="miss")
+    if not _start_refresh(blocking=True):
+        _refresh_done.wait(sum(UPSTREAM_TIMEOUT) * 2)
+    _load_snapshot()
+
+    if _cache["data"] is None:
+        current_time = datetime.now(pytz.timezone('Asia/Kolkata'))
+        return {
+            "indices": dict(FALLBACK_INDICES),
+            "top_gainers": TOP_GAINERS,
+            "top_losers": TOP_LOSERS,
+            "forex": {
+                "usd_inr": FALLBACK_USD_INR
+            },
+            "timestamp": current_time.strftime("%Y-%m-%d %H:%M:%S IST")
+        }
+    return _cache["data"]
@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+MARKET_HISTORY_ENABLED = os.getenv("MARKET_HISTORY_ENABLED", "true").lower() == "true"
+MARKET_HISTORY_DIR = os.getenv("MARKET_HISTORY_DIR", os.path.join(tempfile.gettempdir(), "finwise_market_history"))
+# Upper bound on points returned by one history query; longer ranges are downsampled
+MARKET_HISTORY_MAX_POINTS = int(os.getenv("MARKET_HISTORY_MAX_POINTS", 500))
+
+MOVERS = 3  # top gainers/losers kept per snapshot
+
+# One file of fixed-width values per column; row i of every column is snapshot i
+COLUMNS = {
+    "timestamp": np.float64,
+    "nifty50": np.float64,
+    "nifty50_pct": np.float64,
+    "sensex": np.float64,
+    "sensex_pct": np.float64,
+    "usd_inr": np.float64,
+}
+for _kind in ("gainer", "loser"):
+    for _i in range(MOVERS):
+        COLUMNS[f"{_kind}{_i}_symbol"] = np.int32  # index into symbols.json, -1 if absent
+        COLUMNS[f"{_kind}{_i}_pct"] = np.float64
+
+# Series that get rolling aggregates, with their display names
+SERIES = {"nifty50": "Nifty 50", "sensex": "Sensex", "usd_inr": "USD/INR"}
+WINDOWS = {"1d": 86400, "1w": 7 * 86400}
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _json_values(array):
+    """Array to a JSON-safe list, NaN as None"""
+    return [None if v != v else round(float(v), 4) for v in array.tolist()]
+
+
+class MarketHistory:
+    """
+    Append-only time series of market snapshots stored column by column in flat
+    binary files. Reads memory-map the columns, so a range query touches only the
+    pages it needs and the history is never loaded into memory as a whole.
+    Appends come from the worker that owns the market data refresh, which is
+    already serialised across processes.
+    """
+
+    def __init__(self, directory=MARKET_HISTORY_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._maps = {}       # column -> (rows, memmap)
+        self._symbols = None  # list of symbols; position is the id stored in symbol columns
+        self._symbols_mtime = None
+
+    def _path(self, column):
+        return os.path.join(self.directory, f"{column}.bin")
+
+    def rows(self):
+        """Number of complete snapshots stored (a torn append is ignored)"""
+        counts = []
+        for column, dtype in COLUMNS.items():
+            try:
+                counts.append(os.path.getsize(self._path(column)) // np.dtype(dtype).itemsize)
+            except OSError:
+                return 0
+        return min(counts)
+
+    # Symbols
+
+    def _load_symbols(self):
+        path = os.path.join(self.directory, "symbols.json")
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            self._symbols, self._symbols_mtime = [], None
+            return self._symbols
+        if mtime != self._symbols_mtime:
+            try:
+                with open(path) as f:
+                    self._symbols = json.load(f)
+                self._symbols_mtime = mtime
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring unreadable market history symbols: {str(e)}")
+                self._symbols = self._symbols or []
+        return self._symbols
+
+    def _symbol_id(self, symbol, symbols):
+        if symbol in symbols:
+            return symbols.index(symbol)
+        symbols.append(symbol)
+        return len(symbols) - 1
+
+    def _save_symbols(self, symbols):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".symbols.")
+        with os.fdopen(fd, "w") as f:
+            json.dump(symbols, f)
+        os.replace(tmp_path, os.path.join(self.directory, "symbols.json"))
+
+    # Writing
+
+    def append(self, fetched_at, data):
+        """Add one snapshot; ignored if it is not newer than the last one stored"""
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            rows = self.rows()
+            if rows:
+                last = self._column("timestamp", rows)[-1]
+                if fetched_at <= last:
+                    return False
+
+            indices = data.get("indices", {})
+            row = {
+                "timestamp": fetched_at,
+                "nifty50": _number(indices.get("nifty50", {}).get("c")),
+                "nifty50_pct": _number(indices.get("nifty50", {}).get("percent_change")),
+                "sensex": _number(indices.get("sensex", {}).get("c")),
+                "sensex_pct": _number(indices.get("sensex", {}).get("percent_change")),
+                "usd_inr": _number(data.get("forex", {}).get("usd_inr")),
+            }
+            symbols = list(self._load_symbols())
+            known = len(symbols)
+            for kind, movers in (("gainer", data.get("top_gainers", [])), ("loser", data.get("top_losers", []))):
+                for i in range(MOVERS):
+                    mover = movers[i] if i < len(movers) else None
+                    row[f"{kind}{i}_symbol"] = self._symbol_id(mover["symbol"], symbols) if mover else -1
+                    row[f"{kind}{i}_pct"] = _number(mover.get("change_percent")) if mover else np.nan
+            if len(symbols) != known:
+                self._save_symbols(symbols)
+                self._symbols = symbols
+
+            for column, dtype in COLUMNS.items():
+                with open(self._path(column), "ab") as f:
+                    # Drop the tail of an earlier append that was interrupted part way
+                    f.truncate(rows * np.dtype(dtype).itemsize)
+                    f.write(np.array([row[column]], dtype=dtype).tobytes())
+            return True
+
+    # Reading
+
+    def _column(self, column, rows):
+        """Read-only memory map of the first `rows` values of a column"""
+        cached = self._maps.get(column)
+        if cached is not None and cached[0] == rows:
+            return cached[1]
+        values = np.memmap(self._path(column), dtype=COLUMNS[column], mode="r", shape=(rows,))
+        self._maps[column] = (rows, values)
+        return values
+
+    def _snapshot(self):
+        """(rows, timestamp column) as of now; appends after this are not seen by the caller"""
+        with self._lock:
+            rows = self.rows()
+            return rows, (self._column("timestamp", rows) if rows else None)
+
+    def query(self, start=None, end=None, max_points=MARKET_HISTORY_MAX_POINTS, include_movers=False):
+        """
+        Snapshots with start <= timestamp < end (epoch seconds), downsampled to at
+        most max_points by keeping evenly spaced rows plus the latest one.
+        """
+        rows, timestamps = self._snapshot()
+        result = {"points": 0, "series": {}}
+        if not rows:
+            return result
+        lo = 0 if start is None else int(np.searchsorted(timestamps, start, side="left"))
+        hi = rows if end is None else int(np.searchsorted(timestamps, end, side="left"))
+        if hi <= lo:
+            return result
+
+        picked = np.arange(lo, hi)
+        if max_points and len(picked) > max_points:
+            step = -(-len(picked) // max_points)
+            picked = np.unique(np.append(picked[::step], hi - 1))
+
+        with self._lock:
+            columns = {name: self._column(name, rows)[picked]
+                       for name in ("timestamp", "nifty50", "nifty50_pct", "sensex", "sensex_pct", "usd_inr")}
+        result["points"] = len(picked)
+        result["series"] = {name: _json_values(values) for name, values in columns.items()}
+        if include_movers:
+            result["series"].update(self._movers(rows, picked))
+        return result
+
+    def _movers(self, rows, picked):
+        symbols = self._load_symbols()
+        movers = {}
+        for kind in ("gainer", "loser"):
+            with self._lock:
+                ids = [self._column(f"{kind}{i}_symbol", rows)[picked] for i in range(MOVERS)]
+                pcts = [self._column(f"{kind}{i}_pct", rows)[picked] for i in range(MOVERS)]
+            movers[f"top_{kind}s"] = [
+                [{"symbol": symbols[int(ids[i][n])], "change_percent": round(float(pcts[i][n]), 2)}
+                 for i in range(MOVERS) if 0 <= ids[i][n] < len(symbols)]
+                for n in range(len(picked))
+            ]
+        return movers
+
+    def aggregates(self, now=None):
+        """
+        For each series and window (1d, 1w): change in percent against the last value
+        at or before the window start, high, low and realized volatility (root sum of
+        squared log returns, in percent). None where the history is too short.
+        """
+        rows, timestamps = self._snapshot()
+        if not rows:
+            return {}
+        now = time.time() if now is None else now
+        end = int(np.searchsorted(timestamps, now, side="right"))
+        if not end:
+            return {}
+        result = {}
+        for series in SERIES:
+            with self._lock:
+                values = self._column(series, rows)
+            stats = {"latest": _json_values(values[end - 1:end])[0]}
+            for window, seconds in WINDOWS.items():
+                base = int(np.searchsorted(timestamps, now - seconds, side="right")) - 1
+                window_values = values[max(base, 0):end]
+                window_values = window_values[~np.isnan(window_values)]
+                entry = {"change_pct": None, "high": None, "low": None, "volatility_pct": None}
+                if len(window_values):
+                    entry["high"] = round(float(window_values.max()), 4)
+                    entry["low"] = round(float(window_values.min()), 4)
+                if base >= 0 and len(window_values) >= 2:
+                    entry["change_pct"] = round(float((window_values[-1] / window_values[0] - 1) * 100), 2)
+                    returns = np.diff(np.log(window_values))
+                    entry["volatility_pct"] = round(float(np.sqrt(np.sum(returns ** 2)) * 100), 2)
+                stats[window] = entry
+            result[series] = stats
+        return result
+
+    def trend_summary(self, now=None):
+        """Short text block of rolling changes for the model's market context, or "" without history"""
+        lines = []
+        for series, stats in self.aggregates(now).items():
+            parts = []
+            for window in WINDOWS:
+                entry = stats[window]
+                if entry["change_pct"] is not None:
+                    parts.append(f"{window} {entry['change_pct']:+.2f}% (volatility {entry['volatility_pct']}%)")
+            if parts:
+                lines.append(f"- {SERIES[series]}: " + ", ".join(parts))
+        if not lines:
+            return ""
+        return "Recent Trends:\n" + "\n".join(lines) + "\n"
+
+
+history = MarketHistory()
+
+
+def record(fetched_at, data):
+    """Append a freshly fetched snapshot to the history, if enabled"""
+    if not MARKET_HISTORY_ENABLED:
+        return
+    try:
+        history.append(fetched_at, data)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not append to market history: {str(e)}")
+
+
+def trend_summary():
+    if not MARKET_HISTORY_ENABLED:
+        return ""
+    try:
+        return history.trend_summary()
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read market history: {str(e)}")
+        return ""
@@ -0,0 +1,138 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+# Number of most recent observations per stage used to compute quantiles
+QUANTILE_WINDOW = int(os.getenv("METRICS_QUANTILE_WINDOW", 2048))
+QUANTILES = (0.5, 0.95, 0.99)
+
+STAGE_METRIC = "finwise_stage_duration_seconds"
+
+# name -> help text for the counters incremented through inc()
+COUNTERS = {
+    "finwise_requests_total": "Requests handled, by endpoint and outcome",
+    "finwise_generation_timeouts_total": "Gemini generations that hit their deadline, by endpoint",
+    "finwise_generation_rejected_total": "Requests rejected because an endpoint had no free generation slot",
+    "finwise_upstream_errors_total": "Failed calls to upstream providers, by provider",
+    "finwise_market_data_cache_total": "Market data lookups, by result (fresh, stale, miss)",
+    "finwise_market_data_conditional_total": "Conditional /market-data requests, by result (not_modified, modified)",
+}
+
+_lock = threading.Lock()
+_stages = {}      # stage -> {"window": deque, "count": int, "sum": float}
+_counters = {}    # (name, labels) -> value
+_collectors = []  # callables yielding (name, type, help, labels, value) at scrape time
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def observe(stage, seconds):
+    """Record the duration of one request stage"""
+    with _lock:
+        summary = _stages.get(stage)
+        if summary is None:
+            summary = _stages[stage] = {"window": deque(maxlen=QUANTILE_WINDOW), "count": 0, "sum": 0.0}
+        summary["window"].append(seconds)
+        summary["count"] += 1
+        summary["sum"] += seconds
+
+
+def inc(name, amount=1, **labels):
+    """Increment a counter declared in COUNTERS"""
+    key = (name, _labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def register_collector(collector):
+    """
+    Add a callable evaluated on every scrape, for values owned by other modules
+    (cache sizes, in-flight generations, breaker states). It yields
+    (name, type, help, labels, value) tuples.
+    """
+    _collectors.append(collector)
+
+
+def _quantile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def quantiles(stage):
+    """p50/p95/p99 of the recent window for a stage, or None if nothing was recorded"""
+    with _lock:
+        summary = _stages.get(stage)
+        values = sorted(summary["window"]) if summary else None
+    if not values:
+        return None
+    return {q: _quantile(values, q) for q in QUANTILES}
+
+
+class RequestTimings:
+    """Per-request stage timings, also fed into the process-wide stage summaries"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def record(self, stage, seconds):
+        # A stage entered more than once in a request (e.g. prompt building) accumulates
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+        observe(stage, seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def as_dict(self):
+        return {stage: round(seconds, 4) for stage, seconds in self.stages.items()}
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    items = labels.items() if isinstance(labels, dict) else labels
+    body = ",".join(f'{k}="{str(v)}"' for k, v in items)
+    return "{" + body + "}"
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+
+    with _lock:
+        stages = {stage: (sorted(s["window"]), s["count"], s["sum"]) for stage, s in _stages.items()}
+        counters = dict(_counters)
+
+    lines.append(f"# HELP {STAGE_METRIC} Duration of each request stage (quantiles over the recent window)")
+    lines.append(f"# TYPE {STAGE_METRIC} summary")
+    for stage, (values, count, total) in sorted(stages.items()):
+        for q in QUANTILES:
+            if values:
+                lines.append(f'{STAGE_METRIC}{{stage="{stage}",quantile="{q}"}} {_quantile(values, q):.6f}')
+        lines.append(f'{STAGE_METRIC}_sum{{stage="{stage}"}} {total:.6f}')
+        lines.append(f'{STAGE_METRIC}_count{{stage="{stage}"}} {count}')
+
+    for name, help_text in COUNTERS.items():
+        series = [(labels, value) for (n, labels), value in counters.items() if n == name]
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for labels, value in sorted(series):
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    described = set()
+    for collector in _collectors:
+        for name, metric_type, help_text, labels, value in collector():
+            if name not in described:
+                described.add(name)
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,116 @@
+import os
+import threading
+from collections import namedtuple
+
+import market_history
+import response_cache
+
+GEMINI_MODEL_NAME = os.getenv("GEMINI_MODEL_NAME", "gemini-1.5-flash")
+
+# First, get a detailed response
+DETAILED_PROMPT = """
+You are an ethical financial advisor specializing in Indian markets. Your name is FinWise.
+Provide clear, direct financial advice based on real financial data and best practices.
+
+IMPORTANT RULES:
+1. Keep your response to a maximum of 200 words
+2. Write in a conversational, easy-to-understand style
+3. Focus on actionable advice
+4. End with a brief one-line disclaimer in italics
+5. Add 3 natural follow-up questions with emojis on new lines
+
+Focus on:
+- Long-term investment strategies aligned with the client's goals
+- Ethical investment considerations
+- Risk management and diversification
+- Indian tax implications and regulations
+- Market trends in BSE/NSE
+"""
+
+MOBILE_PROMPT_SUFFIX = "\n\nKeep your response very brief."
+
+# Everything in a prompt except the user's query, rendered once per market snapshot.
+# version identifies the context for response caching.
+PromptContext = namedtuple("PromptContext", ["market_context", "prefix", "version"])
+
+_model = None
+_model_lock = threading.Lock()
+# (market_data, PromptContext) for the most recently rendered snapshot
+_last_context = (None, None)
+
+
+def render_market_context(market_data):
+    """Format a market data snapshot as the context block given to the model"""
+    gainers = ", ".join(f"{g['symbol']}: +{g['change_percent']}%" for g in market_data['top_gainers'])
+    losers = ", ".join(f"{loser['symbol']}: {loser['change_percent']}%" for loser in market_data['top_losers'])
+    return f"""
+Current Indian Market Data ({market_data['timestamp']}):
+- Nifty 50: {market_data['indices']['nifty50']['c']} ({market_data['indices']['nifty50']['percent_change']}%)
+- Sensex: {market_data['indices']['sensex']['c']} ({market_data['indices']['sensex']['percent_change']}%)
+- USD/INR: {market_data['forex']['usd_inr']}
+
+Top Gainers:
+{gainers}
+
+Top Losers:
+{losers}
+"""
+
+
+def get_prompt_context(market_data):
+    """
+    Return the PromptContext for a market snapshot. The market data cache hands out
+    the same dict until it refreshes, so rendering happens once per refresh.
+    """
+    global _last_context
+    last_market_data, context = _last_context
+    if last_market_data is market_data and context is not None:
+        return context
+
+    market_context = render_market_context(market_data)
+    # Rolling changes from the stored history; only changes when a new snapshot is appended
+    trends = market_history.trend_summary()
+    if trends:
+        market_context += f"\n{trends}"
+    context = PromptContext(
+        market_context=market_context,
+        prefix=f"{DETAILED_PROMPT}\n\n{market_context}\n\n",
+        version=response_cache.content_version(DETAILED_PROMPT, market_context)
+    )
+    # A single assignment, so concurrent readers never see a mismatched pair
+    _last_context = (market_data, context)
+    return context
+
+
+def build_prompt(context, msg, suffix="", history_section="", figures=""):
+    """Assemble the full prompt for a query in a single concatenation"""
+    return "".join((context.prefix, history_section, figures, "Query: ", msg, suffix))
+
+
+def get_model():
+    """
+    Return the process-wide Gemini model client. google-generativeai is imported
+    and configured here rather than at startup: the import alone takes about half
+    a second, which health checks and cold starts should not wait for.
+    """
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                import google.generativeai as genai
+
+                # GEMINI_API_ENDPOINT/GEMINI_TRANSPORT point the client elsewhere, e.g. at the
+                # gRPC server in benchmarks/fake_upstreams.py (default transport). Keep gRPC
+                # for /stream: the "rest" transport cannot stream in google-generativeai 0.3.2
+                genai.configure(
+                    api_key=os.getenv("GOOGLE_API_KEY"),
+                    transport=os.getenv("GEMINI_TRANSPORT") or None,
+                    client_options={"api_endpoint": os.getenv("GEMINI_API_ENDPOINT")}
+                    if os.getenv("GEMINI_API_ENDPOINT") else None
+                )
+                _model = genai.GenerativeModel(model_name=GEMINI_MODEL_NAME)
+    return _model
+
+
+def model_loaded():
+    return _model is not None
@@ -0,0 +1,172 @@
+import os
+import time
+import random
+import hashlib
+import logging
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# Sustained requests per minute per client, and how many may be sent in a burst
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", 20))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", 10))
+# "memory" keeps buckets per process; "sqlite" shares them between workers on the host
+# (gunicorn.conf.py picks sqlite when it runs more than one worker)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", os.path.join(tempfile.gettempdir(), "finwise_rate_limit.db"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", 100000))
+# Use the first X-Forwarded-For address as the client IP (only behind a trusted proxy)
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+
+
+def key_digest(credential):
+    return hashlib.sha256(credential.encode("utf-8")).hexdigest()[:16]
+
+
+# API keys (comma separated) that get a rate limit bucket of their own. Any other
+# X-API-Key or Authorization value is ignored and the caller is limited by IP.
+API_KEY_DIGESTS = {key_digest(k.strip()) for k in os.getenv("FINWISE_API_KEYS", "").split(",") if k.strip()}
+
+metrics.COUNTERS["finwise_rate_limited_total"] = "Requests rejected by the per-client rate limit, by endpoint"
+
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + (now - updated) * rate)
+
+
+class MemoryBucketStore:
+    """Token buckets held in this process, least recently used clients evicted first"""
+
+    def __init__(self, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst, now):
+        """Spend one token; returns 0 if allowed, else seconds until a token is available"""
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = _refill(tokens, updated, now, rate, burst)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return 0.0 if allowed else (1 - tokens) / rate
+
+
+class SqliteBucketStore:
+    """
+    Token buckets in a SQLite file, so every worker process on the host draws from
+    the same bucket. Each check is one short IMMEDIATE transaction.
+    """
+
+    def __init__(self, path=RATE_LIMIT_DB_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)"
+        )
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def take(self, key, rate, burst, now):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens = _refill(row[0], row[1], now, rate, burst) if row else burst
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                         (key, tokens, now))
+            # Now and then forget clients whose bucket has long been full again
+            if random.random() < 0.001:
+                conn.execute("DELETE FROM buckets WHERE updated < ?", (now - burst / rate * 2,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return 0.0 if allowed else (1 - tokens) / rate
+
+
+class RateLimiter:
+    """Per-client token bucket: rate_per_minute sustained, up to burst at once"""
+
+    def __init__(self, store, rate_per_minute=RATE_LIMIT_PER_MINUTE, burst=RATE_LIMIT_BURST):
+        self.store = store
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+
+    def check(self, key):
+        """Returns 0 if the request may proceed, otherwise the seconds to wait before retrying"""
+        try:
+            return self.store.take(key, self.rate, self.burst, time.time())
+        except sqlite3.Error as e:
+            # Fail open: a broken limiter store must not take the API down
+            logger.warning(f"Rate limiter unavailable, allowing request: {str(e)}")
+            return 0.0
+
+
+def api_key_id(request):
+    """Digest of the caller's API key (X-API-Key or bearer token) if it is one of FINWISE_API_KEYS, else None"""
+    credential = request.headers.get("X-API-Key") or request.headers.get("Authorization", "")
+    if credential.startswith("Bearer "):
+        credential = credential[len("Bearer "):]
+    credential = credential.strip()
+    if not credential:
+        return None
+    digest = key_digest(credential)
+    return digest if digest in API_KEY_DIGESTS else None
+
+
+def client_key(request):
+    """
+    Identify the caller: its API key if it sends a configured one, else its IP. An
+    unrecognised credential is not trusted, so rotating it cannot reset the limit.
+    """
+    key_id = api_key_id(request)
+    if key_id:
+        return "key:" + key_id
+    ip = request.remote_addr or "unknown"
+    if RATE_LIMIT_TRUST_FORWARDED and request.headers.get("X-Forwarded-For"):
+        ip = request.headers["X-Forwarded-For"].split(",")[0].strip()
+    return "ip:" + ip
+
+
+def _make_limiter():
+    if RATE_LIMIT_BACKEND == "sqlite":
+        try:
+            return RateLimiter(SqliteBucketStore())
+        except sqlite3.Error as e:
+            logger.warning(f"Could not open rate limit database {RATE_LIMIT_DB_PATH}, using memory: {str(e)}")
+    return RateLimiter(MemoryBucketStore())
+
+
+limiter = _make_limiter()
+
+
+def check(request, endpoint):
+    """Returns 0 if the request is within its client's rate limit, else seconds until it may retry"""
+    if not RATE_LIMIT_ENABLED:
+        return 0.0
+    retry_after = limiter.check(client_key(request))
+    if retry_after:
+        metrics.inc("finwise_rate_limited_total", endpoint=endpoint)
+    return retry_after
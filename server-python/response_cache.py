@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import time
+import atexit
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 3600))
+# Optional file the cache is loaded from at startup and saved to periodically
+RESPONSE_CACHE_PATH = os.getenv("RESPONSE_CACHE_PATH")
+RESPONSE_CACHE_SAVE_INTERVAL_SECONDS = int(os.getenv("RESPONSE_CACHE_SAVE_INTERVAL_SECONDS", 60))
+
+# Words that don't change what is being asked, so "Hi, what is the best SIP for
+# beginners?" and "best sip for beginners" share an entry
+FILLER_WORDS = {
+    "hi", "hello", "hey", "please", "pls", "kindly", "thanks", "thank", "you",
+    "can", "could", "would", "tell", "me", "what", "whats", "is", "are", "the", "a", "an",
+}
+# Punctuation is dropped, but "%" and decimal points are kept: "at 8%" and "at 8.5" are
+# different questions from "at 8"
+_NON_WORD = re.compile(r"(?!(?<=\d)\.(?=\d))[^\w\s%]")
+
+
+def normalize_query(query):
+    """Reduce a query to a canonical form for exact-match caching"""
+    words = _NON_WORD.sub(" ", query.lower()).split()
+    meaningful = [w for w in words if w not in FILLER_WORDS]
+    # A query made only of filler words is kept as-is rather than collapsing to ""
+    return " ".join(meaningful or words)
+
+
+def content_version(*parts):
+    """Short digest identifying the prompt context a response was generated from"""
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+class ResponseCache:
+    """
+    LRU cache of generated answers keyed by normalized query. Entries expire after
+    ttl_seconds, total size is bounded by max_bytes, and every entry is dropped when
+    the context version (market snapshot + system prompt) changes.
+    """
+
+    def __init__(self, max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl_seconds=RESPONSE_CACHE_TTL_SECONDS,
+                 persist_path=None, save_interval_seconds=RESPONSE_CACHE_SAVE_INTERVAL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.save_interval_seconds = save_interval_seconds
+        self._entries = OrderedDict()  # key -> (expires_at, text, size)
+        self._bytes = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self._last_save = time.time()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        if persist_path:
+            self.load()
+            atexit.register(self.save)
+
+    @staticmethod
+    def _key(query, variant):
+        return f"{variant}\0{normalize_query(query)}"
+
+    def _check_version(self, version):
+        # Caller holds the lock
+        if version != self._version:
+            if self._entries:
+                self.invalidations += 1
+                logger.info(f"Context version changed, dropping {len(self._entries)} cached responses")
+            self._entries.clear()
+            self._bytes = 0
+            self._version = version
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def get(self, query, version, variant=""):
+        """Return the cached answer for query under this context version, or None"""
+        key = self._key(query, variant)
+        with self._lock:
+            self._check_version(version)
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query, version, text, variant=""):
+        key = self._key(query, variant)
+        size = len(key.encode("utf-8")) + len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(version)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time() + self.ttl_seconds, text, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._dirty = True
+            save_due = self.persist_path and time.time() - self._last_save >= self.save_interval_seconds
+        if save_due:
+            self.save()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._dirty = True
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": RESPONSE_CACHE_ENABLED,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "version": self._version,
+            }
+
+    def save(self):
+        """Write unexpired entries to persist_path atomically"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            snapshot = {
+                "version": self._version,
+                "entries": [[key, expires_at, text] for key, (expires_at, text, _) in self._entries.items()
+                            if expires_at > now],
+            }
+            self._dirty = False
+            self._last_save = now
+        directory = os.path.dirname(self.persist_path) or "."
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".response_cache.")
+            with os.fdopen(fd, "w") as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, self.persist_path)
+        except OSError as e:
+            logger.warning(f"Could not persist response cache: {str(e)}")
+
+    def load(self):
+        try:
+            with open(self.persist_path) as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable response cache file: {str(e)}")
+            return
+        now = time.time()
+        with self._lock:
+            self._version = snapshot.get("version")
+            for key, expires_at, text in snapshot.get("entries", []):
+                if expires_at <= now:
+                    continue
+                size = len(key.encode("utf-8")) + len(text.encode("utf-8"))
+                self._entries[key] = (expires_at, text, size)
+                self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        logger.info(f"Loaded {len(self._entries)} cached responses from {self.persist_path}")
+
+
+cache = ResponseCache(persist_path=RESPONSE_CACHE_PATH)
+
+
+def _collect_metrics():
+    stats = cache.stats()
+    yield ("finwise_response_cache_lookups_total", "counter", "Response cache lookups, by result",
+           {"result": "hit"}, stats["hits"])
+    yield ("finwise_response_cache_lookups_total", "counter", "Response cache lookups, by result",
+           {"result": "miss"}, stats["misses"])
+    yield ("finwise_response_cache_hit_ratio", "gauge", "Share of response cache lookups that hit",
+           {}, stats["hit_rate"])
+    yield ("finwise_response_cache_entries", "gauge", "Answers currently cached", {}, stats["entries"])
+    yield ("finwise_response_cache_bytes", "gauge", "Size of cached answers in bytes", {}, stats["bytes"])
+    yield ("finwise_response_cache_evictions_total", "counter", "Answers evicted to stay under the size bound",
+           {}, stats["evictions"])
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,308 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Finished streams stay replayable this long
+STREAM_REPLAY_TTL_SECONDS = int(os.getenv("STREAM_REPLAY_TTL_SECONDS", 300))
+# Unfinished streams older than this were abandoned (e.g. their worker died mid-answer)
+STREAM_REPLAY_STALE_SECONDS = int(os.getenv("STREAM_REPLAY_STALE_SECONDS", 900))
+# How often the sqlite store deletes expired and over-budget streams, per process
+STREAM_REPLAY_EVICT_INTERVAL_SECONDS = float(os.getenv("STREAM_REPLAY_EVICT_INTERVAL_SECONDS", 30))
+# Bound on buffered answer text; the oldest streams are evicted first
+STREAM_REPLAY_MAX_BYTES = int(os.getenv("STREAM_REPLAY_MAX_BYTES", 16 * 1024 * 1024))
+# "memory" keeps buffers per process, so a reconnect must reach the same worker;
+# "sqlite" shares them between every worker on the host
+STREAM_REPLAY_BACKEND = os.getenv("STREAM_REPLAY_BACKEND", "memory")
+STREAM_REPLAY_DB_PATH = os.getenv("STREAM_REPLAY_DB_PATH",
+                                  os.path.join(tempfile.gettempdir(), "finwise_stream_replay.db"))
+# Comment line sent when no chunk arrived for this long, so proxies and mobile
+# networks do not drop an idle connection
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+# How long a dropped client waits before reconnecting (the SSE retry field). Short,
+# since the answer keeps arriving while it is away
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", 1500))
+# How often a reader polls the sqlite store for new chunks
+SQLITE_POLL_SECONDS = 0.05
+
+metrics.COUNTERS["finwise_stream_resumes_total"] = "Reconnects to a buffered stream, by result (hit, miss)"
+
+
+class _Stream:
+    __slots__ = ("chunks", "bytes", "finished_at", "error", "created")
+
+    def __init__(self, now):
+        self.chunks = []
+        self.bytes = 0
+        self.finished_at = None
+        self.error = None
+        self.created = now
+
+
+class MemoryReplayStore:
+    """
+    Chunks of recent streams held in this process. Total size is bounded by
+    max_bytes (oldest streams evicted first), finished streams expire after
+    ttl_seconds and unfinished ones after stale_seconds.
+    """
+
+    def __init__(self, max_bytes=STREAM_REPLAY_MAX_BYTES, ttl_seconds=STREAM_REPLAY_TTL_SECONDS,
+                 stale_seconds=STREAM_REPLAY_STALE_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self._streams = OrderedDict()  # request_id -> _Stream, oldest first
+        self._bytes = 0
+        self._cond = threading.Condition()
+
+    def _evict(self, now):
+        # Caller holds the lock
+        for request_id, stream in list(self._streams.items()):
+            if stream.finished_at is None:
+                expired = now - stream.created > self.stale_seconds
+            else:
+                expired = now - stream.finished_at > self.ttl_seconds
+            if not expired and self._bytes <= self.max_bytes:
+                break
+            del self._streams[request_id]
+            self._bytes -= stream.bytes
+        self._cond.notify_all()
+
+    def open(self, request_id):
+        with self._cond:
+            self._streams[request_id] = _Stream(time.time())
+            self._evict(time.time())
+
+    def append(self, request_id, seq, text):
+        size = len(text.encode("utf-8"))
+        with self._cond:
+            stream = self._streams.get(request_id)
+            if stream is None:
+                return  # evicted
+            stream.chunks.append((seq, text))
+            stream.bytes += size
+            self._bytes += size
+            if self._bytes > self.max_bytes:
+                self._evict(time.time())
+            self._cond.notify_all()
+
+    def close(self, request_id, error=None):
+        with self._cond:
+            stream = self._streams.get(request_id)
+            if stream is not None:
+                stream.finished_at = time.time()
+                stream.error = error
+            self._cond.notify_all()
+
+    def read(self, request_id, after, timeout):
+        """
+        Chunks with seq > after as [(seq, text)], plus (finished, error). Waits up to
+        timeout for something new. Returns None for an unknown or evicted stream.
+        """
+        with self._cond:
+            deadline = time.monotonic() + timeout
+            while True:
+                stream = self._streams.get(request_id)
+                if stream is None:
+                    return None
+                chunks = [chunk for chunk in stream.chunks if chunk[0] > after]
+                remaining = deadline - time.monotonic()
+                if chunks or stream.finished_at is not None or remaining <= 0:
+                    return chunks, stream.finished_at is not None, stream.error
+                self._cond.wait(remaining)
+
+    def stats(self):
+        with self._cond:
+            return {"streams": len(self._streams), "bytes": self._bytes}
+
+
+class SqliteReplayStore:
+    """
+    Stream chunks in a SQLite file, so a client can reconnect to any worker on the
+    host. Readers poll for new rows. Expired, stale and over-budget streams are
+    deleted when a stream is opened, at most once per evict_interval_seconds.
+    """
+
+    def __init__(self, path=STREAM_REPLAY_DB_PATH, max_bytes=STREAM_REPLAY_MAX_BYTES,
+                 ttl_seconds=STREAM_REPLAY_TTL_SECONDS, stale_seconds=STREAM_REPLAY_STALE_SECONDS,
+                 evict_interval_seconds=STREAM_REPLAY_EVICT_INTERVAL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.evict_interval_seconds = evict_interval_seconds
+        self._last_evict = 0.0
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS streams (request_id TEXT PRIMARY KEY, created REAL, "
+                     "finished REAL, error TEXT, bytes INTEGER DEFAULT 0)")
+        conn.execute("CREATE TABLE IF NOT EXISTS chunks (request_id TEXT, seq INTEGER, text TEXT, "
+                     "PRIMARY KEY (request_id, seq))")
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _evict(self, conn, now):
+        expired = [row[0] for row in conn.execute(
+            "SELECT request_id FROM streams WHERE finished < ? OR (finished IS NULL AND created < ?)",
+            (now - self.ttl_seconds, now - self.stale_seconds))]
+        total = conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM streams").fetchone()[0]
+        if total > self.max_bytes:
+            for request_id, size in conn.execute("SELECT request_id, bytes FROM streams ORDER BY created"):
+                if total <= self.max_bytes:
+                    break
+                expired.append(request_id)
+                total -= size
+        for request_id in expired:
+            conn.execute("DELETE FROM chunks WHERE request_id = ?", (request_id,))
+            conn.execute("DELETE FROM streams WHERE request_id = ?", (request_id,))
+
+    def open(self, request_id):
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO streams (request_id, created) VALUES (?, ?)", (request_id, now))
+            if now - self._last_evict >= self.evict_interval_seconds:
+                self._last_evict = now
+                self._evict(conn, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def append(self, request_id, seq, text):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("INSERT OR REPLACE INTO chunks (request_id, seq, text) VALUES (?, ?, ?)",
+                         (request_id, seq, text))
+            conn.execute("UPDATE streams SET bytes = bytes + ? WHERE request_id = ?",
+                         (len(text.encode("utf-8")), request_id))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self, request_id, error=None):
+        self._connection().execute("UPDATE streams SET finished = ?, error = ? WHERE request_id = ?",
+                                   (time.time(), error, request_id))
+
+    def read(self, request_id, after, timeout):
+        conn = self._connection()
+        deadline = time.monotonic() + timeout
+        while True:
+            row = conn.execute("SELECT finished, error FROM streams WHERE request_id = ?", (request_id,)).fetchone()
+            if row is None:
+                return None
+            chunks = conn.execute("SELECT seq, text FROM chunks WHERE request_id = ? AND seq > ? ORDER BY seq",
+                                  (request_id, after)).fetchall()
+            if chunks or row[0] is not None or time.monotonic() >= deadline:
+                return chunks, row[0] is not None, row[1]
+            time.sleep(SQLITE_POLL_SECONDS)
+
+    def stats(self):
+        row = self._connection().execute("SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM streams").fetchone()
+        return {"streams": row[0], "bytes": row[1]}
+
+
+def _make_store():
+    if STREAM_REPLAY_BACKEND == "sqlite":
+        try:
+            return SqliteReplayStore()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not open stream replay database {STREAM_REPLAY_DB_PATH}, using memory: {str(e)}")
+    return MemoryReplayStore()
+
+
+store = _make_store()
+
+
+def format_event(data, event=None, event_id=None):
+    """One Server-Sent Event; data is sent as JSON so newlines in answers are safe"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False))
+    return "\n".join(lines) + "\n\n"
+
+
+def record(request_id, chunks, on_error=None):
+    """
+    Buffer a stream's chunks under request_id on a background thread, so the
+    answer keeps arriving while its client is disconnected. on_error(exception)
+    returns the message stored for a failed stream.
+    """
+    store.open(request_id)
+
+    def run():
+        seq = 0
+        error = None
+        try:
+            for chunk in chunks:
+                seq += 1
+                store.append(request_id, seq, chunk)
+        except Exception as e:
+            error = on_error(e) if on_error else str(e)
+        finally:
+            try:
+                store.close(request_id, error)
+            except sqlite3.Error as e:
+                logger.warning(f"Could not close replay buffer for {request_id}: {str(e)}")
+
+    threading.Thread(target=run, name=f"stream-replay-{request_id}", daemon=True).start()
+
+
+def events(request_id, after=0, heartbeat_seconds=SSE_HEARTBEAT_SECONDS, retry_ms=SSE_RETRY_MS):
+    """
+    SSE for a buffered stream, starting after event id `after`: the reconnect delay,
+    one `message` event per chunk (id = chunk number), a comment line as heartbeat
+    while waiting, and a final `done` or `error` event.
+    """
+    yield f"retry: {retry_ms}\n\n"
+    while True:
+        result = store.read(request_id, after, heartbeat_seconds)
+        if result is None:
+            yield format_event({"error": "Stream not found or expired", "request_id": request_id}, "error")
+            return
+        chunks, finished, error = result
+        for seq, text in chunks:
+            yield format_event({"text": text}, event_id=seq)
+            after = seq
+        if finished:
+            if error is not None:
+                yield format_event({"error": error, "request_id": request_id}, "error")
+            else:
+                yield format_event({"request_id": request_id, "chunks": after}, "done")
+            return
+        if not chunks:
+            yield ": heartbeat\n\n"
+
+
+def _collect_metrics():
+    try:
+        stats = store.stats()
+    except sqlite3.Error:
+        return
+    yield ("finwise_stream_replay_buffers", "gauge", "Streams held in the replay buffer", {}, stats["streams"])
+    yield ("finwise_stream_replay_bytes", "gauge", "Answer text held in the replay buffer", {}, stats["bytes"])
+
+
+metrics.register_collector(_collect_metrics)
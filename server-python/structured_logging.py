@@ -0,0 +1,209 @@
+import os
+import sys
+import json
+import queue
+import random
+import atexit
+import logging
+import contextvars
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+import metrics
+
+# "json" for one JSON object per line, "text" for the classic human-readable format
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Records waiting for the writer thread; beyond this new records are dropped, never blocking a request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+# Below WARNING, at most this many records are emitted per request
+LOG_MAX_RECORDS_PER_REQUEST = int(os.getenv("LOG_MAX_RECORDS_PER_REQUEST", 50))
+# Share of high-volume records (logged with extra=SAMPLED) kept at each level, e.g. "DEBUG=0.01,INFO=0.1"
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "DEBUG=0.01,INFO=0.1")
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Pass as extra= to mark a record as a high-volume event subject to sampling
+SAMPLED = {"sampled": True}
+
+metrics.COUNTERS["finwise_log_records_dropped_total"] = \
+    "Log records not written, by reason (sampled, request_cap, queue_full)"
+
+# Attributes every LogRecord has; anything else was passed through extra= and is emitted as a field
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "sampled"}
+
+_request = contextvars.ContextVar("finwise_log_request", default=None)
+_queue = None
+_listener = None
+_listener_pid = None
+
+
+class RequestLogState:
+    """Request ID and logging budget of one request"""
+    __slots__ = ("request_id", "records", "dropped")
+
+    def __init__(self, request_id):
+        self.request_id = request_id
+        self.records = 0
+        self.dropped = 0
+
+
+def start_request(request_id):
+    """Tag records logged from this context with request_id and give it a fresh record budget"""
+    state = RequestLogState(request_id)
+    _request.set(state)
+    return state
+
+
+def bind(state):
+    """Continue a request's logging context elsewhere, e.g. inside a streaming generator"""
+    _request.set(state)
+
+
+def current_request_id():
+    state = _request.get()
+    return state.request_id if state else None
+
+
+def parse_sample_rates(spec):
+    rates = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        level, rate = item.split("=", 1)
+        rates[logging.getLevelName(level.strip().upper())] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps a random share of records marked with extra=SAMPLED, per level; WARNING and above always pass"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if not getattr(record, "sampled", False) or record.levelno >= logging.WARNING:
+            return True
+        if random.random() < self.rates.get(record.levelno, 1.0):
+            return True
+        metrics.inc("finwise_log_records_dropped_total", reason="sampled")
+        return False
+
+
+class RequestCapFilter(logging.Filter):
+    """Attaches the request ID and drops records beyond the per-request cap (WARNING and above always pass)"""
+
+    def __init__(self, max_records):
+        super().__init__()
+        self.max_records = max_records
+
+    def filter(self, record):
+        state = _request.get()
+        if state is None:
+            record.request_id = None
+            return True
+        record.request_id = state.request_id
+        if record.levelno >= logging.WARNING:
+            return True
+        if state.records >= self.max_records:
+            state.dropped += 1
+            metrics.inc("finwise_log_records_dropped_total", reason="request_cap")
+            return False
+        state.records += 1
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: ts, level, logger, message, request_id and any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["request_id"] = record.request_id
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key != "request_id":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread. Formatting and I/O happen on that thread;
+    the request thread only merges the message arguments and enqueues, and drops the
+    record if the queue is full rather than waiting.
+    """
+
+    def prepare(self, record):
+        # The queue never leaves the process, so the record (and its exc_info) can
+        # be passed as-is instead of being pre-formatted as the base class does
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("finwise_log_records_dropped_total", reason="queue_full")
+
+
+def _collect_metrics():
+    if _queue is not None:
+        yield ("finwise_log_queue_depth", "gauge", "Log records waiting to be written", {}, _queue.qsize())
+
+
+metrics.register_collector(_collect_metrics)
+
+
+def configure_logging(level=None, fmt=None, stream=None):
+    """
+    Route every log record through a bounded queue to a single writer thread.
+    Safe to call again (e.g. after fork); the previous writer is flushed and replaced.
+    """
+    global _queue, _listener, _listener_pid
+    stop_logging()
+
+    output = logging.StreamHandler(stream or sys.stderr)
+    if (fmt or LOG_FORMAT) == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    _queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    handler = NonBlockingQueueHandler(_queue)
+    handler.addFilter(SamplingFilter(parse_sample_rates(LOG_SAMPLE_RATES)))
+    handler.addFilter(RequestCapFilter(LOG_MAX_RECORDS_PER_REQUEST))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level or LOG_LEVEL)
+
+    _listener = QueueListener(_queue, output, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+
+def stop_logging():
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    if _listener is not None:
+        # In a forked child the writer thread does not exist and the queue's lock
+        # may have been copied while held, so the parent's listener is just dropped
+        if _listener_pid == os.getpid():
+            _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
@@ -1,11 +1,61 @@
 import unittest
 import json
+import zlib
+import tempfile
+import threading
+import time
+from unittest import mock
+import google.ai.generativelanguage as glm
+import google.generativeai as genai
+from google.generativeai.types import GenerateContentResponse
+import batch
+import coalescing
+import generation
+import market_history
+import rate_limit
+import response_cache
+import app as app_module
 from app import app
 
+SAMPLE_MARKET_DATA = {
+    "indices": {"nifty50": {"c": 22000, "percent_change": 0.5}, "sensex": {"c": 72500, "percent_change": 0.4}},
+    "forex": {"usd_inr": 83.2},
+    "top_gainers": [],
+    "top_losers": [],
+    "timestamp": "2025-03-23 10:00:00 IST"
+}
+
+
+def make_chunk(text):
+    return glm.GenerateContentResponse(
+        candidates=[glm.Candidate(content=glm.Content(parts=[glm.Part(text=text)]))]
+    )
+
+
+class FakeStreamIterator:
+    """Stands in for the SDK's upstream stream so tests can observe cancellation"""
+    def __init__(self, texts):
+        self._chunks = iter([make_chunk(t) for t in texts])
+        self.cancelled = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.cancelled:
+            raise StopIteration
+        return next(self._chunks)
+
+    def cancel(self):
+        self.cancelled = True
+
+
 class TestApp(unittest.TestCase):
     def setUp(self):
         app.config['TESTING'] = True
         self.client = app.test_client()
+        response_cache.cache.clear()
+        rate_limit.limiter = rate_limit.RateLimiter(rate_limit.MemoryBucketStore())
 
     def test_ping(self):
         response = self.client.get('/ping')
@@ -24,5 +74,384 @@ class TestApp(unittest.TestCase):
         self.assertIn('top_gainers', data)
         self.assertIn('top_losers', data)
 
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_stream_forwards_chunks_incrementally(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        upstream = FakeStreamIterator(["Hello ", "from ", "FinWise"])
+        generate_content.return_value = GenerateContentResponse.from_iterator(upstream)
+
+        response = self.client.post('/stream', json={"chat": "hi"})
+        chunks = list(response.response)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(c if isinstance(c, bytes) else c.encode() for c in chunks), b"Hello from FinWise")
+        self.assertEqual(len(chunks), 3)
+        _, kwargs = generate_content.call_args
+        self.assertTrue(kwargs["stream"])
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_stream_cancels_upstream_on_disconnect(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        upstream = FakeStreamIterator(["a", "b", "c", "d"])
+        generate_content.return_value = GenerateContentResponse.from_iterator(upstream)
+
+        response = self.client.post('/stream', json={"chat": "hi"}, buffered=False)
+        body = iter(response.response)
+        next(body)
+        response.close()
+
+        self.assertTrue(upstream.cancelled)
+
+    def test_sdk_internals_used_for_streaming_are_present(self):
+        # iter_response_text and cancel_response read private attributes of this SDK
+        # version; upgrading must re-check them rather than silently lose cancellation
+        self.assertEqual(genai.__version__, "0.3.2", "re-check app.iter_response_text and cancel_response")
+        upstream = FakeStreamIterator(["a", "b"])
+        response = GenerateContentResponse.from_iterator(upstream)
+
+        self.assertIsNone(response._error)
+        self.assertIsInstance(response._chunks, list)
+        self.assertIs(response._iterator, upstream)
+        app_module.cancel_response(response)
+        self.assertTrue(upstream.cancelled)
+
+    def test_response_text_falls_back_to_plain_iteration(self):
+        # Stands in for an SDK response without the private attributes
+        chunks = [GenerateContentResponse.from_response(make_chunk(text)) for text in ("Hello ", "there")]
+
+        self.assertEqual(list(app_module.iter_response_text(chunks)), ["Hello ", "there"])
+        app_module.cancel_response(chunks)
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_repeated_stream_query_is_served_from_cache(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        generate_content.return_value = GenerateContentResponse.from_iterator(FakeStreamIterator(["SIP ", "tips"]))
+
+        with self.client.post('/stream', json={"chat": "Best SIP for beginners?"}) as first:
+            self.assertEqual(first.data, b"SIP tips")
+        with self.client.post('/stream', json={"chat": "best sip for beginners"}) as second:
+            self.assertEqual(second.data, b"SIP tips")
+        self.assertEqual(generate_content.call_count, 1)
+        stats = json.loads(self.client.get('/cache/stats').data)
+        self.assertEqual(stats['hits'], 1)
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_history_reaches_the_model(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        generate_content.return_value = GenerateContentResponse.from_iterator(FakeStreamIterator(["ok"]))
+        history = [
+            {"role": "user", "parts": [{"text": "I earn 12 lakh a year."}]},
+            {"role": "model", "parts": [{"text": "Noted, thanks."}]}
+        ]
+
+        with self.client.post('/stream', json={"chat": "Which tax regime suits me?", "history": history}) as resp:
+            self.assertEqual(resp.data, b"ok")
+        prompt = generate_content.call_args[0][1]
+        self.assertIn("User: I earn 12 lakh a year.", prompt)
+        self.assertLess(prompt.index("FinWise: Noted, thanks."), prompt.index("Query: Which tax regime suits me?"))
+
+    def test_malformed_history_returns_400(self):
+        bad_part = [{"role": "user", "parts": [{"text": 5}]}]
+        for endpoint in ('/chat', '/stream'):
+            for history in (5, bad_part):
+                resp = self.client.post(endpoint, json={"chat": "Which tax regime suits me?", "history": history})
+                self.assertEqual(resp.status_code, 400, (endpoint, history))
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_metrics_include_stage_timings(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        generate_content.return_value = GenerateContentResponse.from_iterator(FakeStreamIterator(["ok"]))
+        with self.client.post('/stream', json={"chat": "nifty outlook"}) as resp:
+            self.assertEqual(resp.data, b"ok")
+
+        response = self.client.get('/metrics')
+        body = response.data.decode()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('finwise_stage_duration_seconds{stage="time_to_first_token",quantile="0.95"}', body)
+        self.assertIn('finwise_stage_duration_seconds_count{stage="stream_duration"}', body)
+        self.assertIn('finwise_requests_total{endpoint="stream",outcome="ok"}', body)
+        self.assertIn('finwise_generations_in_flight{endpoint="stream"} 0', body)
+        self.assertIn('finwise_response_cache_lookups_total{result="miss"}', body)
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_identical_concurrent_chats_share_one_generation(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        release = threading.Event()
+
+        def slow_generation(*args, **kwargs):
+            release.wait(5)
+            return mock.Mock(text="Index funds suit beginners")
+
+        generate_content.side_effect = slow_generation
+        responses = []
+
+        def ask(n):
+            client = app.test_client()
+            responses.append(client.post('/chat', json={"chat": "Best fund for a beginner?"},
+                                         headers={"X-API-Key": f"client-{n}"}))
+
+        threads = [threading.Thread(target=ask, args=(n,)) for n in range(3)]
+        for thread in threads:
+            thread.start()
+        # Hold the generation until every request has joined it
+        while sum(f.consumers for f in list(coalescing._flights.values())) < 3:
+            time.sleep(0.005)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual([r.status_code for r in responses], [200, 200, 200])
+        self.assertEqual({json.loads(r.data)["text"] for r in responses}, {"Index funds suit beginners"})
+        self.assertEqual(generate_content.call_count, 1)
+
+    def test_market_data_history_window(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            history = market_history.MarketHistory(tmp)
+            now = time.time()
+            for n in range(5):
+                history.append(now - 3600 * (4 - n), dict(SAMPLE_MARKET_DATA, top_gainers=[], top_losers=[]))
+            with mock.patch('app.market_history.history', history):
+                response = self.client.get('/market-data/history?window=2h')
+                bad = self.client.get('/market-data/history?window=soon')
+                no_points = self.client.get('/market-data/history?window=2h&max_points=0')
+
+        data = json.loads(response.data)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(data["points"], 2)
+        self.assertEqual(data["series"]["nifty50"], [22000.0, 22000.0])
+        self.assertEqual(data["aggregates"]["nifty50"]["latest"], 22000.0)
+        self.assertEqual(bad.status_code, 400)
+        self.assertEqual(no_points.status_code, 400)
+
+    @mock.patch('app.get_indian_market_data')
+    def test_client_over_rate_limit_gets_429(self, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        rate_limit.limiter = rate_limit.RateLimiter(rate_limit.MemoryBucketStore(), rate_per_minute=1, burst=1)
+
+        with mock.patch('app.response_cache.cache.get', return_value="Start with an index fund"), \
+                mock.patch('rate_limit.API_KEY_DIGESTS', {rate_limit.key_digest("another-client")}):
+            first = self.client.post('/chat', json={"chat": "sip for beginners"})
+            second = self.client.post('/chat', json={"chat": "sip for beginners"})
+            made_up_key = self.client.post('/chat', json={"chat": "sip for beginners"},
+                                           headers={"X-API-Key": "made-up"})
+            other_client = self.client.post('/chat', json={"chat": "sip for beginners"},
+                                            headers={"Authorization": "Bearer another-client"})
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 429)
+        self.assertGreaterEqual(int(second.headers['Retry-After']), 1)
+        # An unknown key does not get a fresh bucket
+        self.assertEqual(made_up_key.status_code, 429)
+        self.assertEqual(other_client.status_code, 200)
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_market_quote_is_answered_without_the_model(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+
+        chat = self.client.post('/chat', json={"chat": "What is Nifty at?"})
+        with self.client.post('/stream', json={"chat": "sensex today"}) as stream:
+            self.assertIn(b"Sensex is at 72,500.00", stream.data)
+
+        data = json.loads(chat.data)
+        self.assertEqual(data["routed"], "market_quote")
+        self.assertIn("Nifty 50 is at 22,000.00", data["text"])
+        generate_content.assert_not_called()
+        body = self.client.get('/metrics').data.decode()
+        self.assertIn('finwise_routed_requests_total{endpoint="chat",intent="market_quote"} 1', body)
+        self.assertIn('finwise_router_saved_seconds_total{endpoint="stream"}', body)
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_open_gemini_circuit_returns_503(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        generate_content.side_effect = generation.ModelUnavailable("gemini is unavailable (circuit open)")
+
+        chat = self.client.post('/chat', json={"chat": "how should I plan for retirement"})
+        stream = self.client.post('/stream', json={"chat": "how should I plan for retirement"})
+
+        self.assertEqual(chat.status_code, 503)
+        self.assertEqual(stream.status_code, 503)
+
+    def test_ready_reports_draining(self):
+        self.assertEqual(self.client.get('/ready').status_code, 200)
+        app_module.draining.set()
+        self.addCleanup(app_module.draining.clear)
+        self.assertEqual(self.client.get('/ready').status_code, 503)
+
+    def test_calculate(self):
+        resp = self.client.post('/calculate', json={"type": "sip", "monthly": 5000, "years": 10, "annual_return": 12})
+        bad = [self.client.post('/calculate', json=params).status_code for params in (
+            {"type": "sip"},
+            {"type": "compare", "amount": 100000, "years": 0.01},
+            {"type": "monte_carlo", "monthly": 5000, "years": 10, "volatility": -5},
+        )]
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertAlmostEqual(json.loads(resp.data)["future_value"], 1161695, delta=1)
+        self.assertEqual(bad, [400, 400, 400])
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_calculated_figures_reach_the_model(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        generate_content.return_value = GenerateContentResponse.from_iterator(FakeStreamIterator(["ok"]))
+
+        query = "Should I start a 5000 per month SIP for 10 years at 12%?"
+        with self.client.post('/stream', json={"chat": query}) as resp:
+            self.assertEqual(resp.data, b"ok")
+        prompt = generate_content.call_args[0][1]
+        self.assertLess(prompt.index("grows to ₹11,61,695"), prompt.index("Query: "))
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_sse_stream_can_be_resumed(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        generate_content.return_value = GenerateContentResponse.from_iterator(
+            FakeStreamIterator(["Start ", "with ", "an index fund"]))
+
+        with self.client.post('/stream', json={"chat": "how do I begin investing"},
+                              headers={"Accept": "text/event-stream"}) as first:
+            body = first.get_data(as_text=True)
+            request_id = first.headers["X-Request-ID"]
+        with self.client.get(f'/stream/{request_id}', headers={"Last-Event-ID": "1"}) as resumed:
+            replay = resumed.get_data(as_text=True)
+
+        self.assertEqual(first.mimetype, "text/event-stream")
+        self.assertIn('id: 3\ndata: {"text": "an index fund"}', body)
+        self.assertIn("event: done", body)
+        self.assertNotIn('"Start "', replay)
+        self.assertIn('id: 2\ndata: {"text": "with "}', replay)
+        self.assertIn("event: done", replay)
+        self.assertEqual(generate_content.call_count, 1)
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_sse_replay_failure_releases_flight_and_slot(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        upstream = FakeStreamIterator(["never ", "sent"])
+        generate_content.return_value = GenerateContentResponse.from_iterator(upstream)
+
+        with mock.patch('app.stream_replay.store.open', side_effect=RuntimeError("replay store unavailable")):
+            resp = self.client.post('/stream', json={"chat": "how do I begin investing"},
+                                    headers={"Accept": "text/event-stream"})
+
+        self.assertEqual(resp.status_code, 500)
+        self.assertTrue(upstream.cancelled)
+        self.assertEqual(coalescing.in_flight(), 0)
+        self.assertEqual(generation.in_flight()['stream'], 0)
+
+    def test_resuming_an_unknown_stream_returns_404(self):
+        self.assertEqual(self.client.get('/stream/nope').status_code, 404)
+        self.assertEqual(self.client.get('/stream/nope?last_event_id=x').status_code, 400)
+
+    @mock.patch('app.get_indian_market_data')
+    def test_market_data_revalidates_with_etag(self, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+
+        first = self.client.get('/market-data')
+        again = self.client.get('/market-data', headers={"If-None-Match": first.headers["ETag"]})
+        market_data.return_value = dict(SAMPLE_MARKET_DATA, timestamp="2025-03-23 10:05:00 IST")
+        refreshed = self.client.get('/market-data', headers={"If-None-Match": first.headers["ETag"]})
+
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.data, b"")
+        self.assertEqual(refreshed.status_code, 200)
+        self.assertNotEqual(refreshed.headers["ETag"], first.headers["ETag"])
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_long_mobile_answers_are_compressed_not_truncated(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        answer = "Spread your savings across equity and debt funds. " * 60
+        generate_content.return_value = mock.Mock(text=answer)
+
+        resp = self.client.post('/chat', json={"chat": "How should I plan for retirement? " * 10},
+                                headers={"User-Agent": "Mozilla/5.0 (iPhone)", "Accept-Encoding": "gzip"})
+
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(json.loads(zlib.decompress(resp.data, 31))["text"], answer)
+        self.assertIn("How should I plan for retirement? " * 10, generate_content.call_args[0][1])
+
+    @mock.patch('app.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_stream_is_compressed_chunk_by_chunk(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        generate_content.return_value = GenerateContentResponse.from_iterator(FakeStreamIterator(["Hello ", "there"]))
+
+        response = self.client.post('/stream', json={"chat": "hi"}, headers={"Accept-Encoding": "gzip"})
+        decoder = zlib.decompressobj(31)
+        chunks = [decoder.decompress(chunk) for chunk in response.response]
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(chunks[:2], [b"Hello ", b"there"])
+
+    @mock.patch('batch.get_indian_market_data')
+    @mock.patch('app.generation.generate_content')
+    def test_chat_batch_streams_json_lines(self, generate_content, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        generate_content.return_value = mock.Mock(text="Diversify across index funds")
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        key = {"X-API-Key": "batch-client"}
+
+        with mock.patch('batch.BATCH_JOB_DIR', tmp.name), \
+                mock.patch('rate_limit.API_KEY_DIGESTS', {rate_limit.key_digest("batch-client")}):
+            resp = self.client.post('/chat/batch', headers=key, json={"items": [
+                {"id": "p1", "chat": "How should a 30 year old invest 20000 a month?"}, {"id": "p2"}]})
+            lines = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+            job_id = resp.headers["X-Batch-Job-ID"]
+            status = self.client.get(f'/chat/batch/{job_id}?results=true', headers=key)
+            missing = self.client.get('/chat/batch/unknown', headers=key)
+            resumed = self.client.post('/chat/batch', headers=key, json={"job_id": job_id})
+
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        # Only the configured front-end origins, not any site
+        self.assertNotEqual(resp.headers.get('Access-Control-Allow-Origin'), '*')
+        self.assertEqual([line["type"] for line in lines], ["job", "result", "result", "summary"])
+        self.assertEqual(lines[-1]["errors"], 1)
+        self.assertEqual(json.loads(status.data)["completed"], 1)
+        self.assertEqual(len(json.loads(status.data)["results"]), 2)
+        self.assertEqual(missing.status_code, 404)
+        self.assertEqual(resumed.status_code, 200)
+        self.assertEqual(generate_content.call_count, 1)
+
+    @mock.patch('batch.get_indian_market_data')
+    def test_chat_batch_requires_a_configured_key_and_owns_its_jobs(self, market_data):
+        market_data.return_value = SAMPLE_MARKET_DATA
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        digests = {rate_limit.key_digest("client-a"), rate_limit.key_digest("client-b")}
+
+        with mock.patch('batch.BATCH_JOB_DIR', tmp.name), mock.patch('rate_limit.API_KEY_DIGESTS', digests):
+            anonymous = self.client.post('/chat/batch', json={"items": ["How do I save tax?"]})
+            made_up = self.client.post('/chat/batch', json={"items": ["How do I save tax?"]},
+                                       headers={"X-API-Key": "made-up"})
+            chosen_id = self.client.post('/chat/batch', json={"items": ["How do I save tax?"], "job_id": "mine"},
+                                         headers={"X-API-Key": "client-a"})
+            job_id = batch.create_job(["How do I save tax?"], rate_limit.key_digest("client-a"))
+            other_status = self.client.get(f'/chat/batch/{job_id}?results=true',
+                                           headers={"Authorization": "Bearer client-b"})
+            other_resume = self.client.post('/chat/batch', json={"job_id": job_id},
+                                            headers={"Authorization": "Bearer client-b"})
+            anonymous_status = self.client.get(f'/chat/batch/{job_id}')
+            bad_history = self.client.post('/chat/batch', headers={"X-API-Key": "client-a"}, json={
+                "items": [{"chat": "How do I save tax?", "history": [{"parts": "hi"}]}]})
+
+        self.assertEqual(anonymous.status_code, 401)
+        self.assertEqual(made_up.status_code, 401)
+        self.assertEqual(chosen_id.status_code, 400)
+        self.assertEqual(other_status.status_code, 404)
+        self.assertEqual(other_resume.status_code, 404)
+        self.assertEqual(anonymous_status.status_code, 401)
+        self.assertEqual(bad_history.status_code, 400)
+
 if __name__ == '__main__':
     unittest.main() 
\ No newline at end of file
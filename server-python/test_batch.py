@@ -0,0 +1,131 @@
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import batch
+import response_cache
+
+SAMPLE_MARKET_DATA = {
+    "indices": {"nifty50": {"c": 22000, "percent_change": 0.5}, "sensex": {"c": 72500, "percent_change": 0.4}},
+    "forex": {"usd_inr": 83.2},
+    "top_gainers": [],
+    "top_losers": [],
+    "timestamp": "2025-03-23 10:00:00 IST"
+}
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        response_cache.cache.clear()
+        for patcher in (mock.patch.object(batch, "BATCH_JOB_DIR", tmp.name),
+                        mock.patch.object(batch, "get_indian_market_data", return_value=SAMPLE_MARKET_DATA),
+                        mock.patch.object(batch.prompt_builder, "get_model", return_value=mock.Mock())):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(batch.generation, "generate_content")
+        self.generate_content = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.generate_content.side_effect = lambda model, prompt, timeout: mock.Mock(
+            text="Advice for " + prompt.rsplit("Query: ", 1)[1])
+
+    def test_results_errors_and_summary(self):
+        lines = list(batch.run([
+            {"id": "a", "chat": "How should I invest 5 lakh for my daughter's education?"},
+            {"id": "b", "chat": "how should I invest 5 lakh for my daughter's education"},
+            {"id": "c", "chat": "What is Nifty at?"},
+            {"id": "d", "chat": ""},
+        ]))
+        results = {line["id"]: line for line in lines if line["type"] == "result"}
+
+        self.assertEqual(lines[0]["type"], "job")
+        self.assertEqual(lines[0]["total"], 4)
+        self.assertEqual(results["a"]["text"], results["b"]["text"])
+        self.assertIn("generation", results["a"]["timing"]["stages"])
+        self.assertEqual(results["c"]["routed"], "market_quote")
+        self.assertEqual(results["d"]["error"], "Message cannot be empty")
+        self.assertEqual(lines[-1], dict(lines[-1], type="summary", ok=3, errors=1))
+        # Identical questions share one generation and routed ones need none
+        self.assertEqual(self.generate_content.call_count, 1)
+
+    def test_malformed_history_rejects_the_job(self):
+        for history in ("not a list", [{"parts": "hi"}], [{"content": 5}]):
+            with self.assertRaises(batch.BatchError):
+                batch.create_job([{"id": "a", "chat": "How do I save tax?", "history": history}])
+        self.assertEqual(self.generate_content.call_count, 0)
+
+    def test_resume_only_redoes_unfinished_items(self):
+        def flaky(model, prompt, timeout):
+            if "retire" in prompt:
+                raise RuntimeError("upstream failed")
+            return mock.Mock(text="ok")
+
+        self.generate_content.side_effect = flaky
+        items = ["How should I plan to retire early?", "How do I build an emergency fund?"]
+        first = list(batch.run(items))
+        job_id = first[0]["job_id"]
+        self.assertEqual(first[-1]["errors"], 1)
+
+        self.generate_content.side_effect = lambda model, prompt, timeout: mock.Mock(text="retry ok")
+        second = list(batch.run(job_id=job_id))
+        results = [line for line in second if line["type"] == "result"]
+
+        self.assertEqual(self.generate_content.call_count, 3)
+        self.assertEqual([(r["id"], r["text"], r.get("replayed", False)) for r in results],
+                         [("1", "ok", True), ("0", "retry ok", False)])
+        self.assertEqual(batch.job_status(job_id)["completed"], 2)
+
+    def test_shared_response_cache_is_left_alone(self):
+        response_cache.cache.put("How do I save tax?", "live-version", "Use 80C")
+
+        lines = list(batch.run(["How do I save tax?"]))
+
+        # The job's frozen context version must neither read nor invalidate live entries
+        self.assertEqual(lines[-1]["ok"], 1)
+        self.assertEqual(self.generate_content.call_count, 1)
+        self.assertEqual(response_cache.cache.get("How do I save tax?", "live-version"), "Use 80C")
+
+    def test_job_runs_once_at_a_time(self):
+        job_id = batch.create_job(["How do I save tax?"])
+        with batch.open_job(job_id):
+            with self.assertRaises(batch.JobBusy):
+                batch.open_job(job_id)
+        batch.open_job(job_id).close()
+        with self.assertRaises(batch.JobNotFound):
+            batch.open_job("../etc/passwd")
+
+    def test_jobs_are_scoped_to_their_owner(self):
+        job_id = batch.create_job(["How do I save tax?"], owner="key-a")
+
+        self.assertEqual(batch.job_status(job_id, "key-a")["total"], 1)
+        with self.assertRaises(batch.JobNotFound):
+            batch.job_status(job_id, "key-b")
+        with self.assertRaises(batch.JobNotFound):
+            batch.open_job(job_id, "key-b")
+        batch.open_job(job_id, "key-a").close()
+
+    def test_parallelism_is_bounded(self):
+        running, peak = [0], [0]
+        lock = threading.Lock()
+
+        def slow(model, prompt, timeout):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+            return mock.Mock(text="ok")
+
+        self.generate_content.side_effect = slow
+        lines = list(batch.run([f"How should I invest for goal number {n}?" for n in range(8)], concurrency=2))
+
+        self.assertEqual(lines[-1]["ok"], 8)
+        self.assertEqual(peak[0], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+
+import numpy as np
+
+import calculator
+
+
+class TestProjections(unittest.TestCase):
+    def test_sip_future_value(self):
+        self.assertAlmostEqual(float(calculator.sip_future_value(5000, 12, 10)), 1161695, delta=1)
+        self.assertEqual(float(calculator.sip_future_value(1000, 0, 2)), 24000)
+
+    def test_sip_broadcasts_over_a_grid(self):
+        values = calculator.sip_future_value(np.array([1000, 2000])[:, None], 12, np.array([5, 10, 20]))
+        self.assertEqual(values.shape, (2, 3))
+        np.testing.assert_allclose(values[1], values[0] * 2)
+
+    def test_goal_is_inverse_of_sip(self):
+        monthly = float(calculator.required_monthly_sip(10000000, 12, 15))
+        self.assertAlmostEqual(float(calculator.sip_future_value(monthly, 12, 15)), 10000000, delta=1)
+
+    def test_monte_carlo_is_deterministic_and_bounded(self):
+        first = calculator.monte_carlo_sip(10000, 20, target=10000000)
+        second = calculator.monte_carlo_sip(10000, 20, target=10000000)
+        self.assertEqual(first, second)
+        self.assertLess(first["p10"], first["median"])
+        self.assertLess(first["median"], first["p90"])
+        self.assertTrue(0 <= first["probability_of_target"] <= 1)
+
+        capped = calculator.monte_carlo_sip(1000, 50, scenarios=10 ** 6)
+        self.assertLessEqual(capped["scenarios"] * capped["months"], calculator.MONTE_CARLO_MAX_CELLS)
+
+
+class TestIncomeTax(unittest.TestCase):
+    def test_new_regime_rebate(self):
+        self.assertEqual(float(calculator.income_tax(1200000, "new")["tax"]), 0)
+
+    def test_regimes_are_compared(self):
+        result = calculator.compare_regimes(1500000)
+        self.assertEqual(result["new_regime_tax"], 97500)
+        self.assertEqual(result["old_regime_tax"], 257400)
+        self.assertEqual(result["better"], "new")
+
+    def test_vectorised_over_incomes(self):
+        taxes = calculator.income_tax([500000, 1500000, 30000000], "old")["tax"]
+        self.assertEqual(taxes.shape, (3,))
+        self.assertTrue(np.all(np.diff(taxes) > 0))
+
+
+class TestCalculate(unittest.TestCase):
+    def test_invalid_input(self):
+        for params in (None, {"type": "bogus"}, {"type": "sip", "monthly": 5000},
+                       {"type": "sip", "monthly": "lots", "years": 5}, {"type": "goal", "target": 1, "years": 0},
+                       {"type": "sip", "monthly": 5000, "years": 1e6},
+                       {"type": "monte_carlo", "monthly": 1, "years": 500},
+                       {"type": "lumpsum", "amount": float("inf"), "years": 5},
+                       {"type": "lumpsum", "amount": 1e307, "years": 100, "annual_return": 1000},
+                       {"type": "compare", "amount": 100000, "years": 0.01},
+                       {"type": "goal", "target": 100000, "years": 0.01},
+                       {"type": "monte_carlo", "monthly": 5000, "years": 10, "volatility": -5},
+                       {"type": "monte_carlo", "monthly": 5000, "years": 10, "target": "nan"},
+                       {"type": "goal", "target": float("inf"), "years": 10}):
+            with self.assertRaises(calculator.CalculationError):
+                calculator.calculate(params)
+
+    def test_result_includes_type_and_timing(self):
+        result = calculator.calculate({"type": "lumpsum", "amount": 100000, "years": 1, "annual_return": 10})
+        self.assertAlmostEqual(result["future_value"], 110000)
+        self.assertEqual(result["type"], "lumpsum")
+        self.assertIn("compute_ms", result)
+
+
+class TestQueryParsing(unittest.TestCase):
+    def test_parse_query(self):
+        self.assertEqual(calculator.parse_query("If I invest 5,000 per month for 10 years at 12%, what will I get?"),
+                         {"type": "sip", "monthly": 5000, "years": 10, "annual_return": 12})
+        self.assertEqual(calculator.parse_query("SIP needed for a corpus of 1 crore in 15 years?"),
+                         {"type": "goal", "target": 10000000, "years": 15})
+        self.assertEqual(calculator.parse_query("Which tax regime is better on 15 lakh salary?"),
+                         {"type": "tax", "income": 1500000})
+        self.assertIsNone(calculator.parse_query("What is Nifty at today?"))
+
+    def test_format_inr(self):
+        self.assertEqual(calculator.format_inr(1161695.4), "₹11,61,695")
+        self.assertEqual(calculator.format_inr(999), "₹999")
+        self.assertEqual(calculator.format_inr(10000000), "₹1,00,00,000")
+
+    def test_figures_for_query(self):
+        figures = calculator.figures_for_query("5000 monthly SIP for 10 years at 12%")
+        self.assertIn("₹11,61,695", figures)
+        self.assertEqual(calculator.figures_for_query("Is gold a good hedge?"), "")
+        self.assertEqual(calculator.figures_for_query("SIP of 5000 per month for 100000 years"), "")
+        self.assertEqual(calculator.figures_for_query("Lumpsum of 1 crore for 100 years at 9000000%"), "")
+
+
+if __name__ == '__main__':
+    unittest.main()
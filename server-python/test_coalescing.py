@@ -0,0 +1,72 @@
+import threading
+import unittest
+
+import coalescing
+
+
+class TestCoalescing(unittest.TestCase):
+    def test_identical_requests_share_one_flight(self):
+        key = coalescing.flight_key("What is the best SIP?", "v1", "desktop")
+        leader, is_leader = coalescing.join(key, "chat")
+        follower, follower_is_leader = coalescing.join(coalescing.flight_key("best sip", "v1", "desktop"), "chat")
+        self.assertTrue(is_leader)
+        self.assertFalse(follower_is_leader)
+        self.assertIs(leader, follower)
+
+        leader.publish("Start with an index fund")
+        leader.finish()
+        self.assertEqual(follower.result(1), "Start with an index fund")
+        leader.detach()
+        follower.detach()
+        # A finished flight is not joined again
+        self.assertTrue(coalescing.join(key, "chat")[1])
+        coalescing.join(key, "chat")[0].detach()
+
+    def test_stream_consumers_each_get_every_chunk_from_one_source(self):
+        pulls = []
+
+        def source():
+            for text in ("a", "b", "c"):
+                pulls.append(text)
+                yield text
+
+        flight, _ = coalescing.join("stream-key", "stream")
+        coalescing.join("stream-key", "stream")
+        flight.set_source(source())
+        first = flight.subscribe()
+        self.assertEqual(next(first), "a")
+        results = {}
+        follower = threading.Thread(target=lambda: results.setdefault("follower", list(flight.subscribe())))
+        follower.start()
+        self.assertEqual(list(first), ["b", "c"])
+        follower.join(1)
+
+        self.assertEqual(results["follower"], ["a", "b", "c"])
+        self.assertEqual(pulls, ["a", "b", "c"])
+        self.assertTrue(flight.done)
+
+    def test_last_consumer_leaving_cancels_upstream(self):
+        cancelled = []
+        done = []
+        flight, _ = coalescing.join("cancel-key", "stream")
+        coalescing.join("cancel-key", "stream")
+        flight.set_source(iter(["a", "b"]), on_cancel=lambda: cancelled.append(True))
+        flight.add_done_callback(done.append)
+
+        flight.detach()
+        self.assertEqual(cancelled, [])
+        flight.detach()
+        self.assertEqual(cancelled, [True])
+        self.assertEqual(done, [flight])
+        self.assertTrue(coalescing.join("cancel-key", "stream")[1])
+
+    def test_leader_error_reaches_followers(self):
+        flight, _ = coalescing.join("error-key", "chat")
+        follower, _ = coalescing.join("error-key", "chat")
+        flight.fail(ValueError("quota exceeded"))
+        with self.assertRaises(ValueError):
+            follower.result(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
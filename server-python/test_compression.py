@@ -0,0 +1,74 @@
+import unittest
+import zlib
+
+from flask import Flask, jsonify
+
+import compression
+
+
+class TestNegotiate(unittest.TestCase):
+    def test_weights_and_preference(self):
+        self.assertIsNone(compression.negotiate(""))
+        self.assertIsNone(compression.negotiate("identity"))
+        self.assertEqual(compression.negotiate("gzip, deflate"), "gzip")
+        self.assertEqual(compression.negotiate("gzip;q=0, *"), compression.supported_encodings()[0])
+        self.assertIsNone(compression.negotiate("gzip;q=0"))
+        if compression.brotli is not None:
+            self.assertEqual(compression.negotiate("gzip, deflate, br"), "br")
+            self.assertEqual(compression.negotiate("gzip;q=1.0, br;q=0.5"), "gzip")
+
+
+class TestCompressResponse(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def test_large_json_is_gzipped(self):
+        payload = {"text": "Invest regularly in a diversified index fund. " * 40}
+        with self.app.app_context():
+            resp = compression.compress_response(jsonify(payload), "gzip")
+            small = compression.compress_response(jsonify({"ok": True}), "gzip")
+
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.headers["Vary"])
+        self.assertLess(len(resp.get_data()), 300)
+        self.assertIn(b"diversified index fund", zlib.decompress(resp.get_data(), 31))
+        self.assertNotIn("Content-Encoding", small.headers)
+
+
+class TestCompressStream(unittest.TestCase):
+    def test_each_gzip_chunk_decodes_as_it_arrives(self):
+        decoder = zlib.decompressobj(31)
+        stream = compression.compress_stream(iter(["Start ", "a SIP ", "today"]), "gzip")
+        self.assertEqual(decoder.decompress(next(stream)), b"Start ")
+        self.assertEqual(decoder.decompress(next(stream)), b"a SIP ")
+        self.assertEqual(decoder.decompress(next(stream)), b"today")
+        decoder.decompress(b"".join(stream))
+        self.assertTrue(decoder.eof)
+
+    @unittest.skipIf(compression.brotli is None, "brotli not installed")
+    def test_each_brotli_chunk_decodes_as_it_arrives(self):
+        decoder = compression.brotli.Decompressor()
+        stream = compression.compress_stream(iter(["Start ", "a SIP"]), "br")
+        self.assertEqual(decoder.process(next(stream)), b"Start ")
+        self.assertEqual(decoder.process(next(stream)), b"a SIP")
+        decoder.process(b"".join(stream))
+        self.assertTrue(decoder.is_finished())
+
+    def test_closing_reaches_the_wrapped_stream(self):
+        closed = []
+
+        def chunks():
+            try:
+                yield "a"
+                yield "b"
+            finally:
+                closed.append(True)
+
+        stream = compression.compress_stream(chunks(), "gzip")
+        next(stream)
+        stream.close()
+        self.assertEqual(closed, [True])
+
+
+if __name__ == '__main__':
+    unittest.main()
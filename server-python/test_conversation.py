@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+import conversation
+
+
+def make_history(n_turns, words_per_turn=40):
+    history = []
+    for i in range(n_turns):
+        role = "user" if i % 2 == 0 else "model"
+        text = f"Turn {i} talks about SIP number {i}. " + " ".join(["detail"] * words_per_turn)
+        history.append({"role": role, "parts": [{"text": text}]})
+    return history
+
+
+class TestConversation(unittest.TestCase):
+    def setUp(self):
+        conversation._summaries.clear()
+
+    def test_new_conversation_has_no_history_section(self):
+        self.assertEqual(conversation.build_history_section([]), "")
+        self.assertEqual(conversation.build_history_section(None), "")
+
+    def test_recent_turns_are_kept_verbatim(self):
+        history = make_history(2)
+        section = conversation.build_history_section(history)
+        self.assertIn("User: " + history[0]["parts"][0]["text"], section)
+        self.assertIn("FinWise: " + history[1]["parts"][0]["text"], section)
+
+    def test_section_size_stays_flat_as_conversation_grows(self):
+        sizes = [conversation.estimate_tokens(conversation.build_history_section(make_history(n)))
+                 for n in (20, 200, 2000)]
+        for size in sizes:
+            self.assertLessEqual(size, conversation.HISTORY_TOKEN_BUDGET + 16)
+        self.assertLess(max(sizes) - min(sizes), conversation.SUMMARY_TOKEN_BUDGET)
+        self.assertIn("Turn 1999", conversation.build_history_section(make_history(2000)))
+
+    def test_summary_is_extended_incrementally(self):
+        history = make_history(40)
+        conversation.build_history_section(history[:30])
+        with mock.patch.object(conversation, "_summarize_turn", wraps=conversation._summarize_turn) as summarize:
+            conversation.build_history_section(history[:32])
+        self.assertEqual(summarize.call_count, 2)
+
+    def test_deleted_message_invalidates_cached_summary(self):
+        history = make_history(30)
+        conversation.build_history_section(history)
+        del history[10]
+        section = conversation.build_history_section(history + make_history(1))
+        self.assertNotIn("Turn 10 talks", section)
+
+    def test_malformed_history_is_reported(self):
+        self.assertIsNone(conversation.history_error(make_history(3)))
+        self.assertIsNotNone(conversation.history_error(5))
+        self.assertIsNotNone(conversation.history_error(["hi"]))
+        self.assertIsNotNone(conversation.history_error([{"role": "user", "parts": [{"text": 5}]}]))
+        self.assertIsNotNone(conversation.history_error([{"role": "user", "content": ["hi"]}]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+import generation
+
+
+class TestGeneration(unittest.TestCase):
+    def test_slot_rejected_when_endpoint_is_full(self):
+        with mock.patch.dict(generation._slots, {"chat": generation.FairSlots(1, max_waiting=0)}):
+            release = generation.acquire_slot("chat")
+            with self.assertRaises(generation.GenerationRejected):
+                generation.acquire_slot("chat")
+            release()
+            release()  # releasing twice must not over-release the slot
+            self.assertEqual(generation._slots["chat"].active, 0)
+            generation.acquire_slot("chat")()
+
+    def test_waiting_requests_are_served_round_robin_by_priority(self):
+        slots = generation.FairSlots(1, max_waiting=10, client_max_waiting=3)
+        slots.acquire("holder")
+        order = []
+
+        def wait_for_slot(client, priority):
+            slots.acquire(client, priority, timeout=5)
+            order.append(client)
+            slots.release()
+
+        threads = []
+        # a floods the queue first; b and the mobile client arrive later
+        for client, priority in (("a", 1), ("a", 1), ("a", 1), ("b", 1), ("mobile", 0)):
+            thread = threading.Thread(target=wait_for_slot, args=(client, priority))
+            thread.start()
+            threads.append(thread)
+            while slots.waiting < len(threads):
+                time.sleep(0.001)
+        slots.release()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(order, ["mobile", "a", "b", "a", "a"])
+        self.assertEqual((slots.active, slots.waiting), (0, 0))
+
+    def test_client_with_too_many_waiting_is_turned_away(self):
+        slots = generation.FairSlots(1, max_waiting=10, client_max_waiting=1)
+        slots.acquire("a")
+        errors = []
+
+        def wait_for_slot():
+            try:
+                slots.acquire("a", 1, 0.2)
+            except generation.GenerationRejected as e:
+                errors.append(e)
+
+        waiter = threading.Thread(target=wait_for_slot)
+        waiter.start()
+        while not slots.waiting:
+            time.sleep(0.001)
+        with self.assertRaises(generation.ClientBusy):
+            slots.acquire("a", 1, 0.2)
+        waiter.join()
+        # The queued request timed out and left the queue
+        self.assertEqual(len(errors), 1)
+        self.assertNotIsInstance(errors[0], generation.ClientBusy)
+        self.assertEqual(slots.waiting, 0)
+
+    def test_in_flight_tracks_running_generations(self):
+        before = generation.in_flight()["stream"]
+        with generation.generation_slot("stream"):
+            self.assertEqual(generation.in_flight()["stream"], before + 1)
+        self.assertEqual(generation.in_flight()["stream"], before)
+
+    def test_run_with_timeout_does_not_wait_for_hung_call(self):
+        hung = threading.Event()
+        start = time.time()
+        with self.assertRaises(generation.GenerationTimeout):
+            generation.run_with_timeout(lambda: hung.wait(5), 0.05)
+        self.assertLess(time.time() - start, 1)
+        hung.set()
+
+    def test_generate_content_passes_deadline_to_client(self):
+        model = mock.Mock()
+        generation.generate_content(model, "prompt", 7)
+        _, kwargs = model._client.generate_content.call_args
+        self.assertEqual(kwargs["timeout"], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+import intent_router
+
+MARKET_DATA = {
+    "indices": {"nifty50": {"c": 22000, "percent_change": 0.5}, "sensex": {"c": 72500, "percent_change": -0.4}},
+    "forex": {"usd_inr": 83.2},
+    "top_gainers": [{"symbol": "RELIANCE.NS", "change_percent": 2.45}],
+    "top_losers": [],
+    "timestamp": "2025-03-23 10:00:00 IST"
+}
+
+
+class TestClassify(unittest.TestCase):
+    def test_intents(self):
+        cases = {
+            "What is Nifty at?": intent_router.MARKET_QUOTE,
+            "nifty and sensex today": intent_router.MARKET_QUOTE,
+            "What does XIRR mean?": intent_router.DEFINITION,
+            "what is an ELSS?": intent_router.DEFINITION,
+            "5000 monthly SIP for 10 years at 12%, how much do I get?": intent_router.CALCULATOR,
+            "Which tax regime is better for 15 lakh income?": intent_router.CALCULATOR,
+            "Will nifty go up tomorrow?": intent_router.ADVICE,
+            "What is the best SIP?": intent_router.ADVICE,
+            "Should I invest 5000 monthly in SIP for 10 years?": intent_router.ADVICE,
+            "nifty outlook": intent_router.ADVICE,
+        }
+        for msg, intent in cases.items():
+            self.assertEqual(intent_router.classify(msg), intent, msg)
+
+
+class TestRoute(unittest.TestCase):
+    def test_market_quote_uses_snapshot(self):
+        intent, text = intent_router.route("sensex and usd inr now?", MARKET_DATA, "chat")
+        self.assertEqual(intent, intent_router.MARKET_QUOTE)
+        self.assertIn("Sensex is at 72,500.00 (-0.40% today)", text)
+        self.assertIn("USD/INR is at 83.20", text)
+        self.assertIn("2025-03-23 10:00:00 IST", text)
+
+    def test_missing_data_falls_back_to_the_model(self):
+        unavailable = dict(MARKET_DATA, indices={"nifty50": {"c": "N/A", "percent_change": "N/A"}})
+        self.assertIsNone(intent_router.route("nifty now", unavailable, "chat")[1])
+        self.assertIsNone(intent_router.route("top losers", MARKET_DATA, "chat")[1])
+
+    def test_definition_and_calculation(self):
+        self.assertIn("Systematic Investment Plan", intent_router.route("What is a SIP?", MARKET_DATA, "chat")[1])
+        text = intent_router.route("5000 per month for 10 years at 12%", MARKET_DATA, "chat")[1]
+        self.assertIn("₹11,61,695", text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import json
+import tempfile
+import unittest
+
+from flask import Flask, jsonify
+
+import logging_wrapper
+
+
+class TestInteractionLogWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def make_writer(self, **kwargs):
+        writer = logging_wrapper.InteractionLogWriter(self.tmp.name, **kwargs)
+        self.addCleanup(writer.close)
+        return writer
+
+    def test_batches_are_appended_and_read_back_in_order(self):
+        writer = self.make_writer(flush_seconds=60)
+        for n in range(5):
+            writer.write({"n": n, "logged_at": n})
+        self.assertTrue(writer.flush())
+
+        self.assertEqual([e["n"] for e in logging_wrapper.read_interactions(self.tmp.name)], list(range(5)))
+        self.assertEqual([e["n"] for e in logging_wrapper.read_interactions(self.tmp.name, since=1, until=3)],
+                         [1, 2])
+        self.assertEqual(writer.stats()["written"], 5)
+
+    def test_segments_rotate_and_can_be_compressed(self):
+        writer = self.make_writer(segment_bytes=1, compress=True)
+        for n in range(3):
+            writer.write({"n": n})
+            writer.flush()
+        writer.close()
+
+        segments = sorted(os.listdir(self.tmp.name))
+        self.assertEqual(len(segments), 3)
+        self.assertTrue(all(name.endswith(".jsonl.gz") for name in segments))
+        self.assertEqual(sorted(e["n"] for e in logging_wrapper.read_interactions(self.tmp.name)), [0, 1, 2])
+
+    def test_full_buffer_drops_new_entries(self):
+        writer = self.make_writer(buffer_size=2, flush_seconds=60, batch_size=100)
+        writer._thread = None  # nothing drains the buffer
+        writer._pid = os.getpid()
+        results = [writer.write({"n": n}) for n in range(4)]
+        self.assertEqual(results, [True, True, False, False])
+        self.assertEqual(writer.stats()["dropped"], 2)
+
+    def test_reader_skips_truncated_last_line(self):
+        with open(os.path.join(self.tmp.name, "interactions-20250323-100000-1-1.jsonl"), "w") as f:
+            f.write(json.dumps({"n": 1}) + "\n" + '{"n": 2, "qu')
+        self.assertEqual(list(logging_wrapper.read_interactions(self.tmp.name)), [{"n": 1}])
+
+    def test_decorator_logs_one_entry_per_request(self):
+        app = Flask(__name__)
+        log_interaction = logging_wrapper.setup_interaction_logging(app, log_dir=self.tmp.name)
+
+        @app.route('/chat', methods=['POST'])
+        @log_interaction
+        def chat():
+            return jsonify({"text": "Start a SIP"}), 200
+
+        app.test_client().post('/chat', json={"chat": "sip?", "history": [{}, {}]})
+        app.extensions["interaction_log"].flush()
+
+        (entry,) = logging_wrapper.read_interactions(self.tmp.name)
+        self.assertEqual(entry["query"], "sip?")
+        self.assertEqual(entry["history_length"], 2)
+        self.assertEqual(entry["response"], "Start a SIP")
+        app.extensions["interaction_log"].close()
+
+    def test_decorator_leaves_malformed_history_to_the_view(self):
+        app = Flask(__name__)
+        log_interaction = logging_wrapper.setup_interaction_logging(app, log_dir=self.tmp.name)
+
+        @app.route('/chat', methods=['POST'])
+        @log_interaction
+        def chat():
+            return jsonify({"error": "history must be a list"}), 400
+
+        client = app.test_client()
+        responses = [client.post('/chat', json={"chat": "sip?", "history": history}) for history in (None, 5, "x")]
+        app.extensions["interaction_log"].flush()
+
+        self.assertEqual([r.status_code for r in responses], [400, 400, 400])
+        self.assertEqual([e["history_length"] for e in logging_wrapper.read_interactions(self.tmp.name)], [0, 0, 0])
+        app.extensions["interaction_log"].close()
+
+
+if __name__ == '__main__':
+    unittest.main()
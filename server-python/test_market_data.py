@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import market_data
+
+SNAPSHOT = {"indices": {}, "forex": {"usd_inr": 83.0}, "top_gainers": [], "top_losers": [], "timestamp": "t"}
+
+
+class TestMarketData(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        patcher = mock.patch.object(market_data, "SNAPSHOT_PATH", os.path.join(self.tmpdir, "snapshot.json"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        market_data._cache.update({"fetched_at": 0.0, "data": None, "snapshot_mtime": None})
+
+    def test_concurrent_cold_requests_fetch_once(self):
+        calls = []
+
+        def slow_fetch():
+            calls.append(1)
+            time.sleep(0.1)
+            return SNAPSHOT
+
+        with mock.patch.object(market_data, "fetch_market_data", side_effect=slow_fetch):
+            threads = [threading.Thread(target=market_data.get_indian_market_data) for _ in range(8)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(market_data.get_indian_market_data(), SNAPSHOT)
+        self.assertEqual(len(calls), 1)
+
+    def test_stale_data_is_served_while_refreshing_in_background(self):
+        market_data._cache.update({"fetched_at": time.time() - market_data.CACHE_EXPIRY_SECONDS, "data": SNAPSHOT})
+        refreshed = dict(SNAPSHOT, timestamp="new")
+        release = threading.Event()
+
+        def slow_fetch():
+            release.wait(2)
+            return refreshed
+
+        with mock.patch.object(market_data, "fetch_market_data", side_effect=slow_fetch) as fetch:
+            self.assertEqual(market_data.get_indian_market_data(), SNAPSHOT)
+            self.assertEqual(market_data.get_indian_market_data(), SNAPSHOT)
+            release.set()
+            self.assertTrue(market_data._refresh_done.wait(2))
+            time.sleep(0.01)
+            self.assertEqual(market_data.get_indian_market_data(), refreshed)
+        self.assertEqual(fetch.call_count, 1)
+
+    def test_snapshot_from_another_worker_is_reused(self):
+        market_data._save_snapshot(time.time(), SNAPSHOT)
+        market_data._cache.update({"fetched_at": 0.0, "data": None, "snapshot_mtime": None})
+        with mock.patch.object(market_data, "fetch_market_data") as fetch:
+            self.assertEqual(market_data.get_indian_market_data(), SNAPSHOT)
+        fetch.assert_not_called()
+
+    def test_polygon_bar_is_normalized(self):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = {"results": [{"o": 100.0, "c": 102.0}]}
+        with mock.patch.object(market_data.upstream, "session") as session:
+            session.return_value.get.return_value = response
+            index = market_data._fetch_index("NSEI", market_data.FALLBACK_INDICES["nifty50"])
+        self.assertEqual(index, {"c": 102.0, "percent_change": 2.0})
+        _, kwargs = session.return_value.get.call_args
+        self.assertEqual(kwargs["timeout"], market_data.UPSTREAM_TIMEOUT)
+
+
+if __name__ == '__main__':
+    unittest.main()
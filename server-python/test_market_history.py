@@ -0,0 +1,68 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import market_history
+
+
+def snapshot(nifty, sensex=72500.0, usd_inr=83.2, gainer="TCS.NS"):
+    return {
+        "indices": {"nifty50": {"c": nifty, "percent_change": 0.5}, "sensex": {"c": sensex, "percent_change": 0.4}},
+        "forex": {"usd_inr": usd_inr},
+        "top_gainers": [{"symbol": gainer, "change_percent": 1.78}],
+        "top_losers": [{"symbol": "INFY.NS", "change_percent": -1.23}],
+    }
+
+
+class TestMarketHistory(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.history = market_history.MarketHistory(self.tmpdir)
+
+    def test_range_query_and_downsampling(self):
+        for n in range(100):
+            self.history.append(1000.0 + n * 60, snapshot(22000.0 + n))
+        self.assertFalse(self.history.append(1000.0, snapshot(1.0)))  # not newer than the last row
+
+        result = self.history.query(start=1000.0 + 10 * 60, end=1000.0 + 20 * 60)
+        self.assertEqual(result["points"], 10)
+        self.assertEqual(result["series"]["nifty50"][0], 22010.0)
+
+        sampled = self.history.query(max_points=10, include_movers=True)
+        self.assertLessEqual(sampled["points"], 11)
+        self.assertEqual(sampled["series"]["timestamp"][-1], 1000.0 + 99 * 60)
+        self.assertEqual(sampled["series"]["top_gainers"][0], [{"symbol": "TCS.NS", "change_percent": 1.78}])
+
+    def test_rolling_aggregates(self):
+        day = 86400
+        self.history.append(0.0, snapshot(20000.0))
+        self.history.append(6 * day, snapshot(21000.0))
+        self.history.append(7 * day, snapshot(22000.0))
+
+        stats = self.history.aggregates(now=7 * day)["nifty50"]
+        self.assertEqual(stats["latest"], 22000.0)
+        self.assertEqual(stats["1d"]["change_pct"], 4.76)
+        self.assertEqual(stats["1w"]["change_pct"], 10.0)
+        self.assertEqual((stats["1w"]["low"], stats["1w"]["high"]), (20000.0, 22000.0))
+        self.assertGreater(stats["1w"]["volatility_pct"], 0)
+        self.assertIn("- Nifty 50: 1d +4.76%", self.history.trend_summary(now=7 * day))
+
+    def test_short_history_has_no_trend(self):
+        self.history.append(100.0, snapshot(22000.0))
+        self.assertIsNone(self.history.aggregates(now=200.0)["nifty50"]["1d"]["change_pct"])
+        self.assertEqual(self.history.trend_summary(now=200.0), "")
+
+    def test_torn_append_is_ignored_and_repaired(self):
+        self.history.append(1.0, snapshot(22000.0))
+        # Simulate a crash after only the first column of the next row was written
+        with open(os.path.join(self.tmpdir, "timestamp.bin"), "ab") as f:
+            f.write(b"\0" * 8)
+        self.assertEqual(self.history.rows(), 1)
+        self.history.append(2.0, snapshot(22100.0))
+        self.assertEqual(self.history.query()["series"]["timestamp"], [1.0, 2.0])
+
+
+if __name__ == '__main__':
+    unittest.main()
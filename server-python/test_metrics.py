@@ -0,0 +1,32 @@
+import unittest
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_quantiles_over_recent_window(self):
+        for ms in range(1, 101):
+            metrics.observe("test_quantiles", ms / 1000)
+        q = metrics.quantiles("test_quantiles")
+        self.assertAlmostEqual(q[0.5], 0.051)
+        self.assertAlmostEqual(q[0.95], 0.096)
+        self.assertAlmostEqual(q[0.99], 0.1)
+        self.assertIsNone(metrics.quantiles("never_recorded"))
+
+    def test_request_timings_accumulate_repeated_stages(self):
+        timings = metrics.RequestTimings()
+        timings.record("test_prompt_build", 0.25)
+        timings.record("test_prompt_build", 0.5)
+        self.assertEqual(timings.as_dict(), {"test_prompt_build": 0.75})
+
+    def test_render_exposes_counters_and_collectors(self):
+        metrics.inc("finwise_upstream_errors_total", provider="test_provider")
+        metrics.register_collector(lambda: [("finwise_test_gauge", "gauge", "Test gauge", {"kind": "x"}, 3)])
+        body = metrics.render()
+        self.assertIn("# TYPE finwise_upstream_errors_total counter", body)
+        self.assertIn('finwise_upstream_errors_total{provider="test_provider"} 1', body)
+        self.assertIn('finwise_test_gauge{kind="x"} 3', body)
+
+
+if __name__ == '__main__':
+    unittest.main()
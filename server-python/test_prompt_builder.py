@@ -0,0 +1,37 @@
+import unittest
+
+import prompt_builder
+
+MARKET_DATA = {
+    "indices": {"nifty50": {"c": 22000, "percent_change": 0.5}, "sensex": {"c": 72500, "percent_change": 0.4}},
+    "forex": {"usd_inr": 83.2},
+    "top_gainers": [{"symbol": "TCS.NS", "change_percent": 1.78}],
+    "top_losers": [{"symbol": "INFY.NS", "change_percent": -1.23}],
+    "timestamp": "2025-03-23 10:00:00 IST"
+}
+
+
+class TestPromptBuilder(unittest.TestCase):
+    def test_prompt_matches_legacy_layout(self):
+        context = prompt_builder.get_prompt_context(MARKET_DATA)
+        prompt = prompt_builder.build_prompt(context, "best sip?", prompt_builder.MOBILE_PROMPT_SUFFIX)
+        self.assertEqual(prompt, f"{prompt_builder.DETAILED_PROMPT}\n\n{context.market_context}\n\n"
+                                 f"Query: best sip?\n\nKeep your response very brief.")
+        self.assertIn("TCS.NS: +1.78%", context.market_context)
+        self.assertIn("INFY.NS: -1.23%", context.market_context)
+
+    def test_context_is_rendered_once_per_snapshot(self):
+        first = prompt_builder.get_prompt_context(MARKET_DATA)
+        self.assertIs(prompt_builder.get_prompt_context(MARKET_DATA), first)
+
+        refreshed = dict(MARKET_DATA, timestamp="2025-03-23 10:05:00 IST")
+        second = prompt_builder.get_prompt_context(refreshed)
+        self.assertIsNot(second, first)
+        self.assertNotEqual(second.version, first.version)
+
+    def test_model_client_is_shared(self):
+        self.assertIs(prompt_builder.get_model(), prompt_builder.get_model())
+
+
+if __name__ == '__main__':
+    unittest.main()
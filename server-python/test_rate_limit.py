@@ -0,0 +1,37 @@
+import os
+import tempfile
+import unittest
+
+import rate_limit
+
+
+class TestRateLimit(unittest.TestCase):
+    def check_bucket(self, store):
+        # 60/min = one token a second, burst of 2
+        self.assertEqual(store.take("a", 1.0, 2, now=100.0), 0)
+        self.assertEqual(store.take("a", 1.0, 2, now=100.0), 0)
+        self.assertAlmostEqual(store.take("a", 1.0, 2, now=100.0), 1.0)
+        self.assertAlmostEqual(store.take("a", 1.0, 2, now=100.5), 0.5)
+        self.assertEqual(store.take("a", 1.0, 2, now=101.0), 0)
+        # Other clients have their own bucket
+        self.assertEqual(store.take("b", 1.0, 2, now=101.0), 0)
+
+    def test_memory_bucket(self):
+        self.check_bucket(rate_limit.MemoryBucketStore())
+
+    def test_sqlite_bucket_is_shared_between_stores(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "limits.db")
+            self.check_bucket(rate_limit.SqliteBucketStore(path))
+            # A second store (another worker) sees the same, now empty, bucket
+            self.assertGreater(rate_limit.SqliteBucketStore(path).take("a", 1.0, 2, now=101.0), 0)
+
+    def test_memory_store_forgets_least_recent_clients(self):
+        store = rate_limit.MemoryBucketStore(max_clients=2)
+        for key in ("a", "b", "c"):
+            store.take(key, 1.0, 1, now=0.0)
+        self.assertNotIn("a", store._buckets)
+
+
+if __name__ == '__main__':
+    unittest.main()
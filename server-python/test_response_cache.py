@@ -0,0 +1,56 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from response_cache import ResponseCache, normalize_query
+
+
+class TestResponseCache(unittest.TestCase):
+    def test_normalize_query_ignores_case_punctuation_and_filler(self):
+        self.assertEqual(normalize_query("Hi, what is the best SIP for beginners?"),
+                         normalize_query("best sip for   beginners"))
+        self.assertEqual(normalize_query("Hello!"), "hello")
+
+    def test_normalize_query_keeps_percentages_and_decimals(self):
+        self.assertEqual(normalize_query("SIP of 5000 monthly for 10 years at 8.5%?"),
+                         "sip of 5000 monthly for 10 years at 8.5%")
+        self.assertNotEqual(normalize_query("SIP of 5000 monthly for 10 years at 8%"),
+                            normalize_query("SIP of 5000 monthly for 10 years at 8"))
+
+    def test_context_version_change_invalidates_entries(self):
+        cache = ResponseCache()
+        cache.put("best sip", "v1", "answer")
+        self.assertEqual(cache.get("best sip", "v1"), "answer")
+        self.assertIsNone(cache.get("best sip", "v2"))
+        self.assertEqual(cache.stats()["invalidations"], 1)
+
+    def test_expired_entries_miss(self):
+        cache = ResponseCache(ttl_seconds=0)
+        cache.put("best sip", "v1", "answer")
+        time.sleep(0.01)
+        self.assertIsNone(cache.get("best sip", "v1"))
+
+    def test_least_recently_used_entry_is_evicted_at_byte_limit(self):
+        cache = ResponseCache(max_bytes=60)
+        cache.put("first", "v1", "x" * 20)
+        cache.put("second", "v1", "y" * 20)
+        cache.get("first", "v1")
+        cache.put("third", "v1", "z" * 20)
+        self.assertIsNotNone(cache.get("first", "v1"))
+        self.assertIsNone(cache.get("second", "v1"))
+        self.assertLessEqual(cache.stats()["bytes"], 60)
+
+    def test_entries_survive_restart_when_persisted(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        path = os.path.join(tmpdir, "cache.json")
+        cache = ResponseCache(persist_path=path)
+        cache.put("best sip", "v1", "answer", "mobile")
+        cache.save()
+        self.assertEqual(ResponseCache(persist_path=path).get("best sip", "v1", "mobile"), "answer")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import stream_replay
+
+
+class StoreTests:
+    def make_store(self, **kwargs):
+        raise NotImplementedError
+
+    def test_chunks_after_an_event_id(self):
+        store = self.make_store()
+        store.open("r1")
+        for seq, text in enumerate(["a", "b", "c"], 1):
+            store.append("r1", seq, text)
+        store.close("r1")
+        self.assertEqual(store.read("r1", 1, 0), ([(2, "b"), (3, "c")], True, None))
+        self.assertIsNone(store.read("unknown", 0, 0))
+
+    def test_reader_waits_for_new_chunks(self):
+        store = self.make_store()
+        store.open("r1")
+        timer = threading.Timer(0.1, store.append, ("r1", 1, "late"))
+        timer.start()
+        self.addCleanup(timer.cancel)
+        self.assertEqual(store.read("r1", 0, 2), ([(1, "late")], False, None))
+        self.assertEqual(store.read("r1", 1, 0.05), ([], False, None))
+
+    def test_finished_streams_expire(self):
+        store = self.make_store(ttl_seconds=10)
+        store.open("old")
+        store.close("old")
+        with mock.patch("time.time", return_value=time.time() + 60):
+            store.open("new")
+        self.assertIsNone(store.read("old", 0, 0))
+        self.assertIsNotNone(store.read("new", 0, 0))
+
+    def test_abandoned_streams_expire(self):
+        store = self.make_store(ttl_seconds=10, stale_seconds=30)
+        store.open("hung")
+        with mock.patch("time.time", return_value=time.time() + 20):
+            store.open("newer")
+        self.assertIsNotNone(store.read("hung", 0, 0))
+        with mock.patch("time.time", return_value=time.time() + 60):
+            store.open("new")
+        self.assertIsNone(store.read("hung", 0, 0))
+        self.assertIsNotNone(store.read("new", 0, 0))
+
+
+class TestMemoryReplayStore(StoreTests, unittest.TestCase):
+    def make_store(self, **kwargs):
+        return stream_replay.MemoryReplayStore(**kwargs)
+
+    def test_size_is_bounded(self):
+        store = self.make_store(max_bytes=10)
+        store.open("first")
+        store.append("first", 1, "x" * 8)
+        store.open("second")
+        store.append("second", 1, "y" * 8)
+        self.assertIsNone(store.read("first", 0, 0))
+        self.assertEqual(store.stats(), {"streams": 1, "bytes": 8})
+
+
+class TestSqliteReplayStore(StoreTests, unittest.TestCase):
+    def make_store(self, **kwargs):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        kwargs.setdefault("evict_interval_seconds", 0)
+        return stream_replay.SqliteReplayStore(os.path.join(tmp.name, "replay.db"), **kwargs)
+
+    def test_eviction_runs_at_most_once_per_interval(self):
+        store = self.make_store(ttl_seconds=10, evict_interval_seconds=120)
+        store.open("old")
+        store.close("old")
+        start = time.time()
+        with mock.patch("time.time", return_value=start + 60):
+            store.open("soon")
+        self.assertIsNotNone(store.read("old", 0, 0))
+        with mock.patch("time.time", return_value=start + 130):
+            store.open("later")
+        self.assertIsNone(store.read("old", 0, 0))
+
+
+class TestEvents(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(stream_replay, "store", stream_replay.MemoryReplayStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_recorded_stream_as_sse(self):
+        stream_replay.record("r1", iter(["Hello\\n", "world"]))
+        body = "".join(stream_replay.events("r1", heartbeat_seconds=1))
+        self.assertIn('id: 1\ndata: {"text": "Hello\\\\n"}\n\n', body)
+        self.assertIn('id: 2\ndata: {"text": "world"}\n\n', body)
+        self.assertTrue(body.endswith('event: done\ndata: {"request_id": "r1", "chunks": 2}\n\n'))
+
+    def test_heartbeat_while_waiting_and_error_event(self):
+        release = threading.Event()
+
+        def chunks():
+            yield "partial"
+            release.wait(5)
+            raise RuntimeError("upstream failed")
+
+        stream_replay.record("r1", chunks(), on_error=lambda e: "Try again")
+        events = stream_replay.events("r1", heartbeat_seconds=0.05)
+        self.assertEqual(next(events), f"retry: {stream_replay.SSE_RETRY_MS}\n\n")
+        self.assertIn('"partial"', next(events))
+        self.assertEqual(next(events), ": heartbeat\n\n")
+        release.set()
+        self.assertIn('event: error\ndata: {"error": "Try again"', "".join(events))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import io
+import json
+import logging
+import unittest
+from unittest import mock
+
+import metrics
+import structured_logging
+
+
+class TestStructuredLogging(unittest.TestCase):
+    def setUp(self):
+        self.output = io.StringIO()
+        structured_logging.configure_logging(level="DEBUG", fmt="json", stream=self.output)
+        self.logger = logging.getLogger("test_structured_logging")
+
+    def tearDown(self):
+        structured_logging.configure_logging(stream=io.StringIO())
+
+    def records(self):
+        structured_logging.stop_logging()
+        return [json.loads(line) for line in self.output.getvalue().splitlines()]
+
+    def test_records_are_json_with_request_id_and_extra_fields(self):
+        structured_logging.start_request("req-1")
+        self.logger.info("Stage timings", extra={"stages": {"generation": 1.5}})
+        try:
+            raise ValueError("boom")
+        except ValueError:
+            self.logger.error("Failed", exc_info=True)
+
+        info, error = self.records()
+        self.assertEqual(info["message"], "Stage timings")
+        self.assertEqual(info["request_id"], "req-1")
+        self.assertEqual(info["stages"], {"generation": 1.5})
+        self.assertIn("ValueError: boom", error["exc"])
+
+    def test_per_request_cap_keeps_warnings(self):
+        with mock.patch.object(structured_logging, "LOG_MAX_RECORDS_PER_REQUEST", 3):
+            structured_logging.configure_logging(level="DEBUG", fmt="json", stream=self.output)
+        state = structured_logging.start_request("req-2")
+        for n in range(10):
+            self.logger.info(f"line {n}")
+        self.logger.warning("still logged")
+
+        messages = [r["message"] for r in self.records()]
+        self.assertEqual(messages, ["line 0", "line 1", "line 2", "still logged"])
+        self.assertEqual(state.dropped, 7)
+
+    def test_sampled_records_are_thinned(self):
+        with mock.patch.object(structured_logging, "LOG_SAMPLE_RATES", "DEBUG=0"):
+            structured_logging.configure_logging(level="DEBUG", fmt="json", stream=self.output)
+        for n in range(20):
+            self.logger.debug(f"chunk {n}", extra=structured_logging.SAMPLED)
+        self.logger.debug("not sampled")
+
+        self.assertEqual([r["message"] for r in self.records()], ["not sampled"])
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        structured_logging.stop_logging()  # nothing drains the queue now
+        with mock.patch.object(structured_logging._queue, "maxsize", 1):
+            self.logger.info("fills the queue")
+            self.logger.info("dropped")
+        self.assertIn('finwise_log_records_dropped_total{reason="queue_full"}', metrics.render())
+
+
+if __name__ == '__main__':
+    unittest.main()
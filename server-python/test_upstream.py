@@ -0,0 +1,177 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import requests
+from google.api_core import exceptions as google_exceptions
+from google.generativeai.types import GenerateContentResponse
+
+import generation
+import market_data
+import metrics
+import upstream
+
+
+class FaultyUpstream:
+    """Local HTTP server answering each request with the next scripted fault: "ok", "500" or a delay in seconds"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.requests = 0
+        faulty = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with lock:
+                    step = faulty.script[min(faulty.requests, len(faulty.script) - 1)]
+                    faulty.requests += 1
+                if step == "500":
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                if step != "ok":
+                    time.sleep(float(step))
+                body = b'{"rates": {"INR": 83.5}}'
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except OSError:
+                    pass  # the client gave up on a delayed answer
+
+            def log_message(self, *args):
+                pass
+
+        lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v6/latest/USD"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestCircuitBreaker(unittest.TestCase):
+    def test_opens_fails_fast_and_recovers_after_trial(self):
+        now = [0.0]
+        breaker = upstream.CircuitBreaker("test", failure_threshold=2, reset_seconds=10, clock=lambda: now[0])
+
+        def fail():
+            raise IOError("down")
+
+        for _ in range(2):
+            with self.assertRaises(IOError):
+                breaker.call(fail)
+        self.assertEqual(breaker.state, upstream.OPEN)
+        with self.assertRaises(upstream.CircuitOpen):
+            breaker.call(lambda: "not called")
+
+        now[0] = 10
+        self.assertTrue(breaker.allow())   # the single trial call
+        self.assertFalse(breaker.allow())  # everyone else still fails fast
+        breaker.record_success()
+        self.assertEqual(breaker.state, upstream.CLOSED)
+
+    def test_ignored_errors_do_not_count(self):
+        breaker = upstream.CircuitBreaker("test", failure_threshold=1)
+        with self.assertRaises(ValueError):
+            breaker.call(lambda: int("x"), is_failure=lambda e: not isinstance(e, ValueError))
+        self.assertEqual(breaker.state, upstream.CLOSED)
+
+
+class TestUpstreamGet(unittest.TestCase):
+    def setUp(self):
+        upstream.reset()
+        self.addCleanup(upstream.reset)
+
+    def serve(self, *script):
+        faulty = FaultyUpstream(script)
+        self.addCleanup(faulty.close)
+        return faulty
+
+    def test_server_errors_open_the_breaker(self):
+        faulty = self.serve("500")
+        with mock.patch.dict(upstream.PROVIDERS, {"test": {"timeout": (1, 1)}}):
+            for _ in range(upstream.BREAKER_FAILURE_THRESHOLD):
+                with self.assertRaises(upstream.UpstreamError):
+                    upstream.get("test", faulty.url)
+            with self.assertRaises(upstream.CircuitOpen):
+                upstream.get("test", faulty.url)
+        self.assertEqual(faulty.requests, upstream.BREAKER_FAILURE_THRESHOLD)
+        self.assertIn('finwise_circuit_breaker_state{provider="test"} 2', metrics.render())
+
+    def test_hung_upstream_is_bounded_by_timeout(self):
+        faulty = self.serve("2")
+        start = time.time()
+        with mock.patch.dict(upstream.PROVIDERS, {"test": {"timeout": (1, 0.2)}}):
+            with self.assertRaises(requests.exceptions.Timeout):
+                upstream.get("test", faulty.url)
+        self.assertLess(time.time() - start, 1)
+
+    def test_slow_request_is_hedged(self):
+        faulty = self.serve("1.5", "ok")
+        start = time.time()
+        with mock.patch.dict(upstream.PROVIDERS, {"test": {"timeout": (1, 3), "hedge_after": 0.1}}):
+            response = upstream.get("test", faulty.url)
+        self.assertEqual(response.json()["rates"]["INR"], 83.5)
+        self.assertLess(time.time() - start, 1)
+        self.assertIn('finwise_hedged_requests_total{provider="test",winner="hedge"}', metrics.render())
+
+    def test_market_data_fails_fast_to_fallback_and_keeps_last_known_values(self):
+        breaker = upstream.breaker("forex")
+        for _ in range(breaker.failure_threshold):
+            breaker.record_failure()
+        with mock.patch.object(upstream, "session") as session:
+            self.assertEqual(market_data._fetch_usd_inr(), market_data.FALLBACK_USD_INR)
+        session.assert_not_called()
+
+        fetched = {"indices": {"nifty50": {"c": 22100, "percent_change": 0.4},
+                               "sensex": market_data.FALLBACK_INDICES["sensex"]},
+                   "forex": {"usd_inr": market_data.FALLBACK_USD_INR}}
+        previous = {"indices": {"nifty50": {"c": 22000, "percent_change": 0.1},
+                                "sensex": {"c": 73000, "percent_change": 1}},
+                    "forex": {"usd_inr": 83.9}}
+        merged = market_data._with_last_known(fetched, previous)
+        self.assertEqual(merged["indices"]["nifty50"]["c"], 22100)
+        self.assertEqual(merged["indices"]["sensex"]["c"], 73000)
+        self.assertEqual(merged["forex"]["usd_inr"], 83.9)
+
+
+class TestGeminiBreaker(unittest.TestCase):
+    def setUp(self):
+        upstream.reset()
+        self.addCleanup(upstream.reset)
+
+    def test_transient_error_is_retried(self):
+        model = mock.Mock()
+        model._client.generate_content.side_effect = [google_exceptions.ServiceUnavailable("busy"), mock.DEFAULT]
+        with mock.patch.object(GenerateContentResponse, "from_response", return_value="answer"):
+            self.assertEqual(generation.generate_content(model, "prompt", 10), "answer")
+        self.assertEqual(model._client.generate_content.call_count, 2)
+
+    def test_open_breaker_rejects_without_calling_gemini(self):
+        model = mock.Mock()
+        model._client.generate_content.side_effect = google_exceptions.DeadlineExceeded("slow")
+        for _ in range(upstream.BREAKER_FAILURE_THRESHOLD):
+            with self.assertRaises(google_exceptions.DeadlineExceeded):
+                generation.generate_content(model, "prompt", 10)
+        with self.assertRaises(generation.ModelUnavailable):
+            generation.generate_content(model, "prompt", 10)
+        self.assertEqual(model._client.generate_content.call_count, upstream.BREAKER_FAILURE_THRESHOLD)
+
+    def test_bad_requests_do_not_trip_the_breaker(self):
+        model = mock.Mock()
+        model._client.generate_content.side_effect = google_exceptions.InvalidArgument("blocked")
+        for _ in range(upstream.BREAKER_FAILURE_THRESHOLD + 1):
+            with self.assertRaises(google_exceptions.InvalidArgument):
+                generation.generate_content(model, "prompt", 10)
+        self.assertEqual(upstream.breaker("gemini").state, upstream.CLOSED)
+
+
+if __name__ == '__main__':
+    unittest.main()
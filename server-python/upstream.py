@@ -0,0 +1,237 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Consecutive failures that open a provider's breaker, and how long it stays open
+# before a single trial call is let through
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_FAILURES", 5))
+BREAKER_RESET_SECONDS = float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", 30))
+HEDGE_WORKERS = int(os.getenv("UPSTREAM_HEDGE_WORKERS", 4))
+
+# Per-provider (connect, read) timeouts, and the delay after which a second copy of a
+# slow GET is sent (0 disables hedging). Gemini calls carry their own deadline.
+PROVIDERS = {
+    "polygon": {
+        "timeout": (float(os.getenv("MARKET_DATA_CONNECT_TIMEOUT", 2)),
+                    float(os.getenv("MARKET_DATA_READ_TIMEOUT", 3))),
+        "hedge_after": float(os.getenv("POLYGON_HEDGE_AFTER_SECONDS", 0)),
+    },
+    "forex": {
+        "timeout": (float(os.getenv("MARKET_DATA_CONNECT_TIMEOUT", 2)),
+                    float(os.getenv("MARKET_DATA_READ_TIMEOUT", 3))),
+        "hedge_after": float(os.getenv("FOREX_HEDGE_AFTER_SECONDS", 0)),
+    },
+    "gemini": {},
+}
+
+metrics.COUNTERS["finwise_circuit_breaker_transitions_total"] = \
+    "Circuit breaker state changes, by provider and new state"
+metrics.COUNTERS["finwise_circuit_breaker_rejected_total"] = \
+    "Upstream calls failed fast because the provider's breaker was open, by provider"
+metrics.COUNTERS["finwise_hedged_requests_total"] = \
+    "Second copies sent for slow upstream requests, by provider and which copy answered first"
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a provider whose breaker is open"""
+
+
+class UpstreamError(Exception):
+    """An upstream answered with a server error or throttling status"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure breaker. After failure_threshold failures in a row calls
+    fail fast for reset_seconds; then one trial call is allowed (half open) and its
+    outcome closes the breaker or opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS,
+                 clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    def _transition(self, state):
+        # Caller holds the lock
+        if state != self.state:
+            logger.warning(f"Circuit breaker for {self.name} is now {state}")
+            metrics.inc("finwise_circuit_breaker_transitions_total", provider=self.name, state=state)
+            self.state = state
+
+    def allow(self):
+        """True if a call may go ahead now"""
+        with self._lock:
+            if self.state == OPEN and self.clock() - self._opened_at >= self.reset_seconds:
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+        metrics.inc("finwise_circuit_breaker_rejected_total", provider=self.name)
+        return False
+
+    def retry_after(self):
+        """Seconds until an open breaker lets a trial call through"""
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.reset_seconds - (self.clock() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._trial_running = False
+            self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self._opened_at = self.clock()
+                self._transition(OPEN)
+
+    def call(self, fn, is_failure=None):
+        """
+        Run fn through the breaker; raises CircuitOpen without calling fn while open.
+        is_failure(exception) decides whether an error counts against the provider
+        (by default every error does).
+        """
+        if not self.allow():
+            raise CircuitOpen(f"{self.name} is unavailable (circuit open)")
+        try:
+            result = fn()
+        except Exception as e:
+            if is_failure is None or is_failure(e):
+                self.record_failure()
+            else:
+                self.record_success()
+            raise
+        self.record_success()
+        return result
+
+
+_lock = threading.Lock()
+_breakers = {}
+_sessions = {}
+_hedge_executor = None
+
+
+def breaker(provider):
+    """The process-wide breaker for a provider"""
+    with _lock:
+        if provider not in _breakers:
+            _breakers[provider] = CircuitBreaker(provider)
+        return _breakers[provider]
+
+
+def session(provider):
+    """Return a keep-alive session for an upstream provider"""
+    s = _sessions.get(provider)
+    if s is None:
+        with _lock:
+            s = _sessions.get(provider)
+            if s is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _sessions[provider] = s
+    return s
+
+
+def _executor():
+    global _hedge_executor
+    if _hedge_executor is None:
+        with _lock:
+            if _hedge_executor is None:
+                _hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix="upstream-hedge")
+    return _hedge_executor
+
+
+def reset():
+    """Forget breakers, sessions and the hedge pool (tests, and worker processes after fork)"""
+    global _hedge_executor
+    with _lock:
+        _breakers.clear()
+        _sessions.clear()
+        _hedge_executor = None
+
+
+def _hedged(provider, send, hedge_after):
+    """Send once; if no answer within hedge_after send again and take whichever succeeds first"""
+    first = _executor().submit(send)
+    done, _ = wait([first], timeout=hedge_after)
+    if done:
+        return first.result()
+    second = _executor().submit(send)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception as e:
+                error = e
+                continue
+            metrics.inc("finwise_hedged_requests_total", provider=provider,
+                        winner="hedge" if future is second else "original")
+            return result
+    raise error
+
+
+def get(provider, url, **kwargs):
+    """
+    GET through the provider's pooled session, timeout and breaker, hedged if the
+    provider is configured for it. 5xx and 429 answers count as failures and raise
+    UpstreamError; other statuses are returned to the caller.
+    """
+    config = PROVIDERS.get(provider, {})
+    kwargs.setdefault("timeout", config.get("timeout"))
+
+    def send():
+        response = session(provider).get(url, **kwargs)
+        if response.status_code >= 500 or response.status_code == 429:
+            raise UpstreamError(f"{provider} answered {response.status_code}")
+        return response
+
+    hedge_after = config.get("hedge_after")
+    if hedge_after:
+        return breaker(provider).call(lambda: _hedged(provider, send, hedge_after))
+    return breaker(provider).call(send)
+
+
+def _collect_metrics():
+    with _lock:
+        breakers = list(_breakers.values())
+    for b in breakers:
+        yield ("finwise_circuit_breaker_state", "gauge",
+               "Circuit breaker state by provider (0 closed, 1 half open, 2 open)",
+               {"provider": b.name}, _STATE_VALUES[b.state])
+
+
+metrics.register_collector(_collect_metrics)